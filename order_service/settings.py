@@ -161,7 +161,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'procurement_supply.pagination.PageSizePagination',
     'PAGE_SIZE': 10,
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
@@ -186,6 +186,31 @@ SPECTACULAR_SETTINGS = {
 }
 
 COMBINED_ORDER_MULTIPLIER = "1.1"
+MAX_PAGE_SIZE = 100
+CART_RESERVATION_TTL = 24 * 60 * 60
+CART_SWEEP_PERIOD = 5 * 60
+CART_SWEEP_BATCH_SIZE = 1000
+CART_BULK_MAX_POSITIONS = 1000
+ORDER_BULK_MAX_POSITIONS = 1000
+
+NOTIFICATION_DIGEST_WINDOW = 5 * 60
+NOTIFICATION_DISPATCH_PERIOD = 60
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_TTL = 7 * 24 * 60 * 60
+
+SEARCH_BATCH_SIZE = 1000
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_REQUEST_TIMEOUT = 60
+IMPORT_DELTA = True
+IMPORT_CHUNK_SIZE = 10000
+IMPORT_ERRORS_LIMIT = 1000
+IMPORT_LOCK_TIMEOUT = 3 * 60 * 60
+IMPORT_SCHEDULE_PERIOD = 60
+IMPORT_SCHEDULE_LIMIT = 100
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORT_FILE_TTL = 24 * 60 * 60
 
 SITE_ID = 1
 
@@ -204,3 +229,21 @@ LOGIN_REDIRECT_URL = '/accounts/vk/login/'
 
 CELERY_BROKER_URL = "redis://redis:6379"
 CELERY_RESULT_BACKEND = "redis://redis:6379"
+CELERY_BEAT_SCHEDULE = {
+    "schedule-imports": {
+        "task": "procurement_supply.tasks.schedule_imports",
+        "schedule": IMPORT_SCHEDULE_PERIOD,
+    },
+    "release-expired-reservations": {
+        "task": "procurement_supply.tasks.release_expired_reservations",
+        "schedule": CART_SWEEP_PERIOD,
+    },
+    "dispatch-notifications": {
+        "task": "procurement_supply.tasks.dispatch_notifications",
+        "schedule": NOTIFICATION_DISPATCH_PERIOD,
+    },
+    "clean-exports": {
+        "task": "procurement_supply.tasks.clean_exports",
+        "schedule": 60 * 60,
+    },
+}
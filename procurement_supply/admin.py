@@ -4,7 +4,7 @@ from django.contrib.auth.admin import UserAdmin
 from django.db import models
 
 from procurement_supply.models import User, Category, Product, Supplier, Stock, Characteristic, ProductCharacteristic, \
-    Purchaser, ChainStore, ShoppingCart, CartPosition, OrderPosition, Order
+    Purchaser, ChainStore, ShoppingCart, CartPosition, OrderPosition, Order, ImportSource, Notification
 from procurement_supply.tasks import do_import
 
 admin.site.site_header = 'Procurement Supply Review Admin'
@@ -369,10 +369,12 @@ class ShoppingCartAdmin(admin.ModelAdmin):
         Return a QuerySet of model instances that can be edited by the admin site.
         """
 
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).with_totals()
         if request.user.is_superuser:
             return qs
-        return qs.filter(cart_positions__stock__supplier__user=request.user).distinct()
+        return qs.filter(
+            id__in=CartPosition.objects.filter(stock__supplier__user=request.user).values("shopping_cart")
+        )
 
     def has_add_permission(self, request):
         """
@@ -393,10 +395,10 @@ class CartPositionAdmin(admin.ModelAdmin):
         Class to ensure all admin options and functionality for CartPosition model.
     """
 
-    list_display = ('id', 'shopping_cart', 'stock', 'price', 'quantity', 'amount')
+    list_display = ('id', 'shopping_cart', 'stock', 'price', 'quantity', 'amount', 'reserved_until')
     list_filter = ('shopping_cart', 'stock')
     search_fields = ('stock',)
-    readonly_fields = ('shopping_cart', 'stock', 'price', 'quantity', 'amount')
+    readonly_fields = ('shopping_cart', 'stock', 'price', 'quantity', 'amount', 'reserved_until')
 
     def get_queryset(self, request):
         """
@@ -446,7 +448,7 @@ class OrderAdmin(admin.ModelAdmin):
         qs = super().get_queryset(request)
         if request.user.is_superuser:
             return qs
-        return qs.filter(order_positions__stock__supplier__user=request.user).distinct()
+        return qs.filter(id__in=OrderPosition.objects.filter(stock__supplier__user=request.user).values("order"))
 
     def has_add_permission(self, request):
         """
@@ -496,6 +498,40 @@ class OrderPositionAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(ImportSource)
+class ImportSourceAdmin(admin.ModelAdmin):
+    """
+        Class to ensure all admin options and functionality for ImportSource model.
+        Deletion of import source makes next import from its URL download and import price list in full.
+    """
+
+    fields = ('supplier', 'url', 'refresh_interval', 'next_import_at', 'etag', 'last_modified', 'content_hash',
+              'imported_at')
+    list_display = ('id', 'supplier', 'url', 'refresh_interval', 'next_import_at', 'imported_at')
+    readonly_fields = ('etag', 'last_modified', 'content_hash', 'imported_at')
+    list_filter = ('supplier',)
+    search_fields = ('url',)
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    """
+        Class to ensure all admin options and functionality for Notification model.
+        Notifications are sent by dispatch_notifications task, so they may be only viewed and deleted.
+    """
+
+    list_display = ('id', 'email', 'subject', 'created_at', 'sent_at')
+    readonly_fields = ('email', 'subject', 'message', 'created_at', 'sent_at')
+    list_filter = (('sent_at', admin.EmptyFieldListFilter),)
+    search_fields = ('email', 'subject')
+
+    def has_add_permission(self, request):
+        """
+        Return False since notifications are created by application only.
+        """
+        return False
+
+
 class ImportStocks(CustomModelPage):
     """
     Construct admin page for stock import operation based on user URL input.
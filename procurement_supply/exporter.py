@@ -0,0 +1,236 @@
+import csv
+import gzip
+import json
+import os
+from functools import partial
+
+import yaml
+from django.conf import settings
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from procurement_supply.importer import batched
+from procurement_supply.models import (Category, Stock, StockTombstone,
+                                       Supplier, characteristics_prefetch)
+
+EXPORT_FORMATS = ("yaml", "json", "jsonl", "csv")
+EXPORT_EXTENSIONS = {"yaml": ".yml", "json": ".json", "jsonl": ".jsonl", "csv": ".csv"}
+CSV_FIELDS = ("id", "category", "model", "name", "shop", "price", "price_rrc", "quantity", "parameters")
+
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+dump_yaml = partial(yaml.dump, Dumper=SafeDumper, allow_unicode=True, default_flow_style=False, sort_keys=False)
+
+
+def default_path(export_format, compress=False):
+    """
+    Returns name of export file for indicated format
+    """
+    return f"export{EXPORT_EXTENSIONS[export_format]}" + (".gz" if compress else "")
+
+
+def shard_path(path, number):
+    """
+    Returns name of file of indicated shard, e.g. export-2.yml.gz for export.yml.gz
+    """
+    suffix = ".gz" if path.endswith(".gz") else ""
+    root, extension = os.path.splitext(path[:len(path) - len(suffix)])
+    return f"{root}-{number}{extension}{suffix}"
+
+
+class StockExporter:
+    """
+    Class to perform streaming export of stocks to file in yaml, json, jsonl or csv format.
+    Stocks are read from database in chunks with their characteristics and written to file one chunk after another,
+    so that memory consumption does not depend on size of catalog.
+    Incremental export contains only goods modified since indicated time and tombstones of deleted and zeroed stocks
+    """
+
+    def __init__(self, export_format="yaml", suppliers=None, categories=None, id_range=None, chunk_size=None,
+                 since=None):
+        self.format = export_format
+        self.suppliers = suppliers
+        self.categories = categories
+        self.id_range = id_range
+        self.chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+        self.since = since
+        self.exported_at = timezone.now()
+
+    def stocks(self):
+        """
+        Returns queryset of stocks to export ordered by id
+        """
+        stocks = Stock.objects.all()
+        if self.suppliers:
+            stocks = stocks.filter(supplier_id__in=self.suppliers)
+        if self.categories:
+            stocks = stocks.filter(product__category_id__in=self.categories)
+        if self.id_range:
+            stocks = stocks.filter(id__range=self.id_range)
+        if self.since:
+            stocks = stocks.filter(updated_at__gte=self.since)
+        return stocks.order_by("id")
+
+    def tombstones(self):
+        """
+        Returns tombstones of stocks deleted or zeroed since time of previous export
+        :return: generator of dicts with "id", "shop" and "tombstone" keys
+        """
+        if not self.since:
+            return
+        for stock in self.stocks().filter(quantity=0).values("sku", "supplier_id").iterator(self.chunk_size):
+            yield {"id": stock["sku"], "shop": stock["supplier_id"], "tombstone": "zeroed"}
+        deleted = StockTombstone.objects.filter(deleted_at__gte=self.since)
+        if self.suppliers:
+            deleted = deleted.filter(supplier_id__in=self.suppliers)
+        if self.categories:
+            deleted = deleted.filter(category_id__in=self.categories)
+        if self.id_range:
+            deleted = deleted.filter(stock_id__range=self.id_range)
+        for stock in deleted.order_by("id").values("sku", "supplier_id").iterator(self.chunk_size):
+            yield {"id": stock["sku"], "shop": stock["supplier_id"], "tombstone": "deleted"}
+
+    def header(self):
+        """
+        Returns categories and suppliers of exported stocks
+        :return: dict with "categories" and "shop" keys
+        """
+        categories = Category.objects.order_by("id")
+        suppliers = Supplier.objects.order_by("id")
+        if self.categories:
+            categories = categories.filter(id__in=self.categories)
+        if self.suppliers:
+            categories = categories.filter(products__stocks__supplier_id__in=self.suppliers).distinct()
+            suppliers = suppliers.filter(id__in=self.suppliers)
+        header = {
+            "categories": list(categories.values("id", "name")),
+            "shop": list(suppliers.values("id", "name")),
+        }
+        if self.since:
+            header.update(since=self.since.isoformat(), exported_at=self.exported_at.isoformat())
+        return header
+
+    def goods(self):
+        """
+        Reads stocks from database in chunks. Incremental export is followed by tombstones
+        :return: generator of goods in structure of import file
+        """
+        stocks = self.stocks().select_related("product").prefetch_related(characteristics_prefetch())
+        if self.since:
+            stocks = stocks.filter(quantity__gt=0)
+        for stock in stocks.iterator(chunk_size=self.chunk_size):
+            yield {
+                "id": stock.sku,
+                "category": stock.product.category_id,
+                "model": stock.model,
+                "name": stock.product.name,
+                "shop": stock.supplier_id,
+                "price": float(stock.price),
+                "price_rrc": float(stock.price_rrc),
+                "quantity": stock.quantity,
+                "parameters": {
+                    parameter.characteristic.name: parameter.value
+                    for parameter in stock.product_characteristics.all()
+                },
+            }
+        yield from self.tombstones()
+
+    def export(self, path, compress=False):
+        """
+        Writes export file
+        :param path: path of export file
+        :param compress: whether to compress file with gzip
+        :return: number of exported goods
+        """
+        opener = gzip.open if compress else open
+        with opener(path, "wt", encoding="utf8", newline="") as outfile:
+            return self.write(outfile)
+
+    def write(self, outfile):
+        """
+        Writes goods to text file-like object in format of exporter
+        :return: number of exported goods
+        """
+        return getattr(self, f"write_{self.format}")(outfile)
+
+    def write_yaml(self, outfile):
+        """
+        Writes goods as YAML document with "categories", "shop" and "goods" keys
+        """
+        outfile.write(dump_yaml(self.header()))
+        count = 0
+        for batch in batched(self.goods(), self.chunk_size):
+            if not count:
+                outfile.write("goods:\n")
+            outfile.write(dump_yaml(batch))
+            count += len(batch)
+        if not count:
+            outfile.write("goods: []\n")
+        return count
+
+    def write_json(self, outfile):
+        """
+        Writes goods as JSON object with "categories", "shop" and "goods" keys
+        """
+        header = json.dumps(self.header(), ensure_ascii=False)
+        outfile.write(header[:-1] + ', "goods": [')
+        count = 0
+        for good in self.goods():
+            outfile.write((",\n" if count else "\n") + json.dumps(good, ensure_ascii=False))
+            count += 1
+        outfile.write("\n]}\n")
+        return count
+
+    def write_jsonl(self, outfile):
+        """
+        Writes goods as JSON Lines. First line contains categories and suppliers, each next line contains a good
+        """
+        outfile.write(json.dumps(self.header(), ensure_ascii=False) + "\n")
+        count = 0
+        for good in self.goods():
+            outfile.write(json.dumps(good, ensure_ascii=False) + "\n")
+            count += 1
+        return count
+
+    def write_csv(self, outfile):
+        """
+        Writes goods as CSV table, parameters of good are written as JSON object
+        """
+        writer = csv.DictWriter(outfile, fieldnames=CSV_FIELDS + (("tombstone",) if self.since else ()))
+        writer.writeheader()
+        count = 0
+        for good in self.goods():
+            if "parameters" in good:
+                good["parameters"] = json.dumps(good["parameters"], ensure_ascii=False)
+            writer.writerow(good)
+            count += 1
+        return count
+
+    def shards(self, number):
+        """
+        Splits exported stocks into ranges of ids of approximately equal width
+        :param number: number of shards
+        :return: list of (first id, last id) tuples
+        """
+        ids = [self.stocks().aggregate(first=Min("id"), last=Max("id"))]
+        if self.since:
+            ids.append(
+                StockTombstone.objects.filter(deleted_at__gte=self.since).aggregate(
+                    first=Min("stock_id"), last=Max("stock_id")
+                )
+            )
+        firsts = [bounds["first"] for bounds in ids if bounds["first"] is not None]
+        if not firsts:
+            return [(0, 0)]
+        first_id, last_id = min(firsts), max(bounds["last"] for bounds in ids if bounds["last"] is not None)
+        width = (last_id - first_id) // number + 1
+        return [(first, min(first + width - 1, last_id)) for first in range(first_id, last_id + 1, width)]
+
+
+def export_shard(options, id_range, path, compress=False):
+    """
+    Exports shard of stocks. Module level function, so that it may be run in separate process
+    :param options: keyword arguments of StockExporter
+    :param id_range: (first id, last id) tuple of shard
+    :return: number of exported goods
+    """
+    return StockExporter(id_range=id_range, **options).export(path, compress)
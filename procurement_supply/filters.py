@@ -0,0 +1,54 @@
+from django.db.models import F
+from django.template import loader
+from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+from procurement_supply.models import Order
+from procurement_supply.search import search_stocks
+
+
+class OrderFilter(filters.FilterSet):
+    """
+    FilterSet class to filter orders by status and summary columns
+    """
+
+    confirmed = filters.BooleanFilter(method="filter_completed", field_name="confirmed_count")
+    delivered = filters.BooleanFilter(method="filter_completed", field_name="delivered_count")
+
+    class Meta:
+        model = Order
+        fields = {
+            "status": ["exact"],
+            "total_amount": ["gte", "lte"],
+            "total_quantity": ["gte", "lte"],
+            "supplier_count": ["exact", "gte"],
+        }
+
+    def filter_completed(self, queryset, name, value):
+        """
+        Filters orders whose positions are all confirmed or delivered, or not all of them if value is False
+        """
+        completed = {name: F("position_count")}
+        return queryset.filter(**completed) if value else queryset.exclude(**completed)
+
+
+class StockSearchFilter(SearchFilter):
+    """
+    Filter class to search stocks by precomputed search documents instead of LIKE over joined tables.
+    Found stocks are ordered by rank, the most relevant first
+    """
+
+    search_description = "Words to search in product, model, category, supplier, characteristics and description"
+
+    def filter_queryset(self, request, queryset, view):
+        """
+        Returns stocks matching all words of search parameter
+        """
+        return search_stocks(queryset, request.query_params.get(self.search_param, ""))
+
+    def to_html(self, request, queryset, view):
+        """
+        Returns search form of browsable API
+        """
+        context = {"param": self.search_param, "term": request.query_params.get(self.search_param, "")}
+        return loader.get_template(self.template).render(context)
@@ -0,0 +1,524 @@
+import hashlib
+import json
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from procurement_supply.models import (Category, Characteristic, Product,
+                                       ProductCharacteristic, Stock, Supplier)
+
+REQUIRED_GOOD_FIELDS = ("id", "category", "name", "price", "price_rrc", "quantity")
+
+
+class ImportFailed(Exception):
+    """
+    Exception raised when import cannot be performed. Its message is returned to user as result detail
+    """
+
+
+def batched(iterable, size):
+    """
+    Splits iterable into lists of indicated size
+    :param iterable: any iterable, e.g. goods from import file
+    :param size: maximum length of each list
+    :return: generator of lists
+    """
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def lock_supplier(supplier_id, token):
+    """
+    Locks import of supplier stocks, so that two imports of the same supplier never overlap.
+    Lock expires in IMPORT_LOCK_TIMEOUT seconds in case its import is lost
+    :param supplier_id: id of supplier
+    :param token: unique token of import, e.g. id of its task
+    :return: True if lock is acquired
+    """
+    now = timezone.now()
+    return bool(
+        Supplier.objects.filter(
+            Q(import_locked_until__isnull=True) | Q(import_locked_until__lt=now), id=supplier_id
+        ).update(import_lock=token, import_locked_until=now + timedelta(seconds=settings.IMPORT_LOCK_TIMEOUT))
+    )
+
+
+def unlock_supplier(supplier_id, token):
+    """
+    Releases lock of supplier import if it is still held by import with indicated token
+    """
+    Supplier.objects.filter(id=supplier_id, import_lock=token).update(import_lock="", import_locked_until=None)
+
+
+def to_price(value):
+    """
+    Converts price from import file to decimal with two decimal places
+    """
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+def fingerprint(good):
+    """
+    Calculates content hash of good from import file
+    :param good: dict describing good
+    :return: SHA-256 hex digest of sku, prices, quantity, model and parameters
+    """
+    content = [
+        str(good["id"]),
+        str(to_price(good["price"])),
+        str(to_price(good["price_rrc"])),
+        good["quantity"],
+        good.get("model"),
+        sorted((str(name), str(value)) for name, value in good["parameters"].items()),
+    ]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode()).hexdigest()
+
+
+def is_unchanged(stock, good, content_hash):
+    """
+    Checks whether stock already has content of good. Stock columns are compared as well as fingerprint,
+    since they may be amended after import, e.g. by reservation of quantity
+    """
+    return (
+        stock.content_hash == content_hash
+        and stock.model == good.get("model")
+        and stock.price == to_price(good["price"])
+        and stock.price_rrc == to_price(good["price_rrc"])
+        and stock.quantity == good["quantity"]
+    )
+
+
+def check_good(good):
+    """
+    Validates good from import file against constraints of stock, product and characteristic models
+    :param good: dict describing good
+    :return: list of errors, empty if good is valid
+    """
+    if not isinstance(good, dict):
+        return ["Good must be a mapping"]
+    errors = [f'Field "{field}" is required' for field in REQUIRED_GOOD_FIELDS if good.get(field) is None]
+    category = good.get("category")
+    if category is not None and type(category) != int:
+        errors.append('Field "category" must be an integer id of category')
+    if good.get("id") is not None and len(str(good["id"])) > 30:
+        errors.append('Field "id" must be no longer than 30 characters')
+    if good.get("name") is not None and len(str(good["name"])) > 50:
+        errors.append('Field "name" must be no longer than 50 characters')
+    if good.get("model") is not None and len(str(good["model"])) > 50:
+        errors.append('Field "model" must be no longer than 50 characters')
+    for field in ("price", "price_rrc"):
+        if good.get(field) is None:
+            continue
+        try:
+            price = to_price(good[field])
+        except (ArithmeticError, ValueError, TypeError):
+            errors.append(f'Field "{field}" must be a number')
+            continue
+        if not price.is_finite() or not Decimal("0.01") <= price < Decimal(10) ** 14:
+            errors.append(f'Field "{field}" must be a number from 0.01 to 10^14')
+    quantity = good.get("quantity")
+    if quantity is not None and (type(quantity) != int or quantity < 0):
+        errors.append('Field "quantity" must be a non-negative integer')
+    parameters = good.get("parameters", {})
+    if not isinstance(parameters, dict):
+        errors.append('Field "parameters" must be a mapping')
+    else:
+        for name, value in parameters.items():
+            if len(str(name)) > 50:
+                errors.append(f'Parameter name "{name}" must be no longer than 50 characters')
+            if value is None or len(str(value)) > 30:
+                errors.append(f'Parameter "{name}" value must be no longer than 30 characters')
+    return errors
+
+
+class StockImporter:
+    """
+    Class to perform import of stocks from file with determinated structure.
+    Categories, products, characteristics and stocks are resolved with a few queries per batch of goods and written
+    with bulk_create/bulk_update instead of separate queries for every good.
+    In delta mode stocks whose content matches stored fingerprint are not rewritten.
+    Invalid goods are skipped and reported in errors instead of failing the whole import.
+    """
+
+    def __init__(self, user_id=None, batch_size=None, delta=None, supplier_id=None, on_progress=None):
+        self.user_id = user_id
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.delta = settings.IMPORT_DELTA if delta is None else delta
+        self.on_progress = on_progress
+        self.counts = dict.fromkeys(("unchanged", "updated", "created", "zeroed", "invalid"), 0)
+        self.errors = []
+        self.rows_written = 0
+        self.supplier = Supplier.objects.get(id=supplier_id) if supplier_id else None
+        self.category_ids = set()
+        self.products = {}
+        self.characteristics = {}
+        self.imported_stock_ids = set()
+
+    def run(self, data):
+        """
+        Performs import of supplier, categories and goods from parsed import file within one transaction
+        :param data: dict with "shop", "categories" and "goods" keys
+        :return: dict with status and detail of import
+        """
+        return self.perform(self.import_file, data) or self.success()
+
+    def prepare(self, data):
+        """
+        Performs import of supplier and categories, so that goods may be imported in separate chunks
+        :param data: dict with "shop" and "categories" keys
+        :return: dict with status and detail if import failed, otherwise None
+        """
+        return self.perform(self.import_header, data)
+
+    def run_chunk(self, goods, first_row=1, error=None):
+        """
+        Performs import of chunk of goods within one transaction. Supplier must be indicated
+        :param goods: list of goods from import file
+        :param first_row: number of first good of chunk in import file
+        :param error: detail of error which occurred before chunk was dispatched
+        :return: dict with status of chunk, number of its rows, counts, errors and ids of imported stocks
+        """
+        if error:
+            result = {'status': 'fail', "detail": error}
+        else:
+            goods = self.validate(goods, first_row)
+            result = (
+                self.perform(self.resolve_exclusively, goods)
+                or self.perform(self.write_batches, goods)
+                or {'status': "success"}
+            )
+        result.update(
+            rows=len(goods), counts=self.counts, errors=self.errors, stock_ids=sorted(self.imported_stock_ids)
+        )
+        return result
+
+    def finish(self, results):
+        """
+        Merges results of chunks and sets to zero quantity of stocks absent in all of them
+        :param results: list of run_chunk results
+        :return: dict with status and detail of import
+        """
+        details = []
+        for result in results:
+            for name, count in result["counts"].items():
+                self.counts[name] += count
+            self.imported_stock_ids.update(result["stock_ids"])
+            self.errors.extend(result["errors"][:settings.IMPORT_ERRORS_LIMIT - len(self.errors)])
+            if result["status"] == "fail" and result["detail"] not in details:
+                details.append(result["detail"])
+        if details:
+            return {'status': 'fail', "detail": "; ".join(details), 'counts': self.counts, 'errors': self.errors}
+        return self.perform(self.zero_vanished_stocks) or self.success()
+
+    def success(self):
+        """
+        Returns result of successful import
+        """
+        detail = "Import or update performed successfully"
+        if self.counts["invalid"]:
+            detail += f', {self.counts["invalid"]} invalid goods skipped'
+        return {'status': "success", 'detail': detail, 'counts': self.counts, 'errors': self.errors}
+
+    def perform(self, operation, *args):
+        """
+        Calls import operation within transaction and converts import errors to result of import
+        :return: dict with status and detail if import failed, otherwise None
+        """
+        try:
+            with transaction.atomic():
+                operation(*args)
+        except ImportFailed as error:
+            return {'status': 'fail', "detail": str(error)}
+        except KeyError as error:
+            return {'status': 'fail', "detail": f"Field {error} is required in import file"}
+        except IntegrityError:
+            return {'status': 'fail', "detail": "Import file contains duplicated goods"}
+
+    def import_file(self, data):
+        """
+        Imports header and all goods of import file and sets to zero quantity of stocks absent in it
+        """
+        self.import_header(data)
+        self.import_batches(data["goods"])
+        self.zero_vanished_stocks()
+
+    def import_header(self, data):
+        """
+        Imports supplier and categories of import file
+        """
+        self.import_supplier(data["shop"])
+        self.import_categories(data["categories"])
+
+    def import_batches(self, goods, first_row=1):
+        """
+        Imports goods split into batches and reports progress after each batch
+        """
+        for number, batch in enumerate(batched(goods, self.batch_size)):
+            self.import_goods(batch, first_row + number * self.batch_size)
+            if self.on_progress:
+                self.on_progress(self.rows_written)
+
+    def write_batches(self, goods):
+        """
+        Writes already validated goods split into batches and reports progress after each batch
+        """
+        for batch in batched(goods, self.batch_size):
+            self.write_goods(batch)
+            if self.on_progress:
+                self.on_progress(self.rows_written)
+
+    def import_supplier(self, name):
+        """
+        Gets or creates supplier of request user. Without user supplier must already exist
+        :param name: supplier name from import file
+        """
+        if self.user_id:
+            try:
+                with transaction.atomic():
+                    self.supplier, created = Supplier.objects.get_or_create(
+                        user_id=self.user_id, name=name
+                    )
+            except IntegrityError:
+                raise ImportFailed("Request user already refers to another supplier instance")
+        else:
+            self.supplier = Supplier.objects.filter(name=name).first()
+            if not self.supplier:
+                raise ImportFailed("Indicted supplier does not exist")
+
+    def import_categories(self, categories):
+        """
+        Creates absent categories and links all categories from file to supplier
+        :param categories: list of dicts with "id" and "name" keys
+        """
+        incoming = {category["id"]: category["name"] for category in categories}
+        existing = Category.objects.filter(
+            Q(id__in=incoming) | Q(name__in=incoming.values())
+        ).values_list("id", "name")
+        existing_ids = set()
+        for category_id, name in existing:
+            if incoming.get(category_id) != name:
+                raise ImportFailed("Category with id from your file already exists with another name")
+            existing_ids.add(category_id)
+
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=name) for category_id, name in incoming.items()
+             if category_id not in existing_ids]
+        )
+        CategorySupplier = Category.suppliers.through
+        CategorySupplier.objects.bulk_create(
+            [CategorySupplier(category_id=category_id, supplier_id=self.supplier.id) for category_id in incoming],
+            ignore_conflicts=True,
+        )
+        self.category_ids.update(incoming)
+
+    def validate(self, goods, first_row=1):
+        """
+        Checks goods and existence of their categories. Categories absent in file header are looked up in database.
+        Invalid goods are registered in errors
+        :param goods: list of goods from import file
+        :param first_row: number of first good in import file
+        :return: list of valid goods
+        """
+        checked = []
+        for row, good in enumerate(goods, start=first_row):
+            errors = check_good(good)
+            if errors:
+                self.add_error(row, good, errors)
+            else:
+                good["name"] = str(good["name"])
+                good["parameters"] = {
+                    str(name): str(value) for name, value in good.get("parameters", {}).items()
+                }
+                checked.append((row, good))
+
+        unknown = {good["category"] for row, good in checked} - self.category_ids
+        if unknown:
+            self.category_ids.update(
+                Category.objects.filter(id__in=unknown).values_list("id", flat=True)
+            )
+        valid = []
+        for row, good in checked:
+            if good["category"] in self.category_ids:
+                valid.append(good)
+            else:
+                self.add_error(row, good, [f'Category with id {good["category"]} does not exist'])
+        return valid
+
+    def add_error(self, row, good, errors):
+        """
+        Registers errors of invalid good. Number of stored errors is limited by IMPORT_ERRORS_LIMIT setting
+        """
+        self.counts["invalid"] += 1
+        if len(self.errors) < settings.IMPORT_ERRORS_LIMIT:
+            sku = good.get("id") if isinstance(good, dict) else None
+            self.errors.append({"row": row, "sku": None if sku is None else str(sku), "errors": errors})
+
+    def resolve_products(self, goods):
+        """
+        Finds products of goods by name and category and creates absent ones
+        :param goods: list of goods from import file
+        """
+        keys = {(good["name"], good["category"]) for good in goods} - self.products.keys()
+        if not keys:
+            return
+
+        def fetch():
+            names = {name for name, category_id in keys}
+            category_ids = {category_id for name, category_id in keys}
+            for product_id, name, category_id in Product.objects.filter(
+                name__in=names, category__id__in=category_ids
+            ).order_by("-id").values_list("id", "name", "category_id"):
+                if (name, category_id) in keys:
+                    self.products[(name, category_id)] = product_id
+
+        fetch()
+        absent = keys - self.products.keys()
+        if absent:
+            Product.objects.bulk_create(
+                [Product(name=name, category_id=category_id) for name, category_id in absent],
+                batch_size=self.batch_size,
+            )
+            fetch()
+
+    def resolve_characteristics(self, goods):
+        """
+        Finds characteristics of goods by name and creates absent ones
+        :param goods: list of goods from import file
+        """
+        names = {name for good in goods for name in good["parameters"]} - self.characteristics.keys()
+        if not names:
+            return
+        Characteristic.objects.bulk_create(
+            [Characteristic(name=name) for name in names], ignore_conflicts=True
+        )
+        self.characteristics.update(
+            Characteristic.objects.filter(name__in=names).values_list("name", "id")
+        )
+
+    def resolve(self, goods):
+        """
+        Resolves products and characteristics of valid goods, creating absent ones
+        :param goods: list of goods from import file
+        """
+        self.resolve_products(goods)
+        self.resolve_characteristics(goods)
+
+    def resolve_exclusively(self, goods):
+        """
+        Resolves products and characteristics of valid goods while supplier is locked,
+        so that parallel chunks of the same import file do not create the same products twice
+        :param goods: list of goods from import file
+        """
+        list(Supplier.objects.select_for_update().filter(id=self.supplier.id).values_list("id", flat=True))
+        self.resolve(goods)
+
+    def import_goods(self, goods, first_row=1):
+        """
+        Validates batch of goods and writes valid ones
+        :param goods: list of goods from import file
+        :param first_row: number of first good of batch in import file
+        """
+        self.write_goods(self.validate(goods, first_row))
+
+    def write_goods(self, goods):
+        """
+        Creates or updates stocks, replaces their characteristics and rebuilds their search documents
+        for batch of valid goods
+        :param goods: list of validated goods from import file
+        """
+        self.resolve(goods)
+
+        rows = {}
+        for good in goods:
+            rows[(str(good["id"]), self.products[(good["name"], good["category"])])] = good
+
+        stocks = {}
+        for stock in Stock.objects.filter(
+            supplier=self.supplier, sku__in={sku for sku, product_id in rows}
+        ):
+            if (stock.sku, stock.product_id) in rows:
+                stocks[(stock.sku, stock.product_id)] = stock
+        self.imported_stock_ids.update(stock.id for stock in stocks.values())
+
+        changed = {}
+        now = timezone.now()
+        for key, stock in stocks.items():
+            good = rows[key]
+            content_hash = fingerprint(good)
+            if self.delta and is_unchanged(stock, good, content_hash):
+                self.counts["unchanged"] += 1
+                continue
+            stock.model = good.get("model")
+            stock.price = good["price"]
+            stock.price_rrc = good["price_rrc"]
+            stock.quantity = good["quantity"]
+            stock.content_hash = content_hash
+            stock.updated_at = now
+            changed[key] = stock
+        Stock.objects.bulk_update(
+            changed.values(),
+            ["model", "price", "price_rrc", "quantity", "content_hash", "updated_at"],
+            batch_size=self.batch_size,
+        )
+        ProductCharacteristic.objects.filter(stock__in=changed.values()).delete()
+        self.counts["updated"] += len(changed)
+
+        created = [
+            Stock(
+                sku=sku,
+                model=good.get("model"),
+                product_id=product_id,
+                supplier=self.supplier,
+                price=good["price"],
+                price_rrc=good["price_rrc"],
+                quantity=good["quantity"],
+                content_hash=fingerprint(good),
+            )
+            for (sku, product_id), good in rows.items()
+            if (sku, product_id) not in stocks
+        ]
+        if created:
+            Stock.objects.bulk_create(created, batch_size=self.batch_size)
+            for stock in Stock.objects.filter(
+                supplier=self.supplier, sku__in={stock.sku for stock in created}
+            ).only("id", "sku", "product_id"):
+                if (stock.sku, stock.product_id) in rows and (stock.sku, stock.product_id) not in stocks:
+                    changed[(stock.sku, stock.product_id)] = stock
+                    self.imported_stock_ids.add(stock.id)
+            self.counts["created"] += len(created)
+
+        ProductCharacteristic.objects.bulk_create(
+            [
+                ProductCharacteristic(
+                    stock_id=stock.id,
+                    characteristic_id=self.characteristics[name],
+                    value=value,
+                )
+                for key, stock in changed.items()
+                for name, value in rows[key]["parameters"].items()
+            ],
+            batch_size=self.batch_size,
+        )
+        Stock.refresh_search_documents([stock.id for stock in changed.values()], self.batch_size)
+        self.rows_written += len(rows)
+
+    def zero_vanished_stocks(self):
+        """
+        Sets to zero quantity of supplier stocks which are absent in import file
+        """
+        vanished = [
+            stock_id
+            for stock_id in Stock.objects.filter(supplier=self.supplier, quantity__gt=0)
+            .values_list("id", flat=True)
+            .iterator()
+            if stock_id not in self.imported_stock_ids
+        ]
+        for batch in batched(vanished, self.batch_size):
+            Stock.objects.filter(id__in=batch).update(quantity=0, content_hash="", updated_at=timezone.now())
+        self.counts["zeroed"] += len(vanished)
@@ -1,6 +1,13 @@
-import yaml
-from django.core.management.base import BaseCommand
-from procurement_supply.models import Category, Stock, Supplier
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from procurement_supply.exporter import (EXPORT_FORMATS, StockExporter,
+                                         default_path, export_shard,
+                                         shard_path)
 
 
 class Command(BaseCommand):
@@ -11,36 +18,53 @@ class Command(BaseCommand):
         """
         Entry point for subclassed commands to add custom arguments.
         """
-        pass
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='yaml', help='Format of export file')
+        parser.add_argument('--supplier', type=int, action='append', help='Id of supplier to export, may be repeated')
+        parser.add_argument('--category', type=int, action='append', help='Id of category to export, may be repeated')
+        parser.add_argument('--output', help='Path of export file, export.<format> by default')
+        parser.add_argument('--gzip', action='store_true', help='Compress export file with gzip')
+        parser.add_argument('--shards', type=int, default=1,
+                            help='Number of files to be written in parallel processes')
+        parser.add_argument('--chunk-size', type=int, help='Number of stocks read from database at once')
+        parser.add_argument('--since', help='Export only goods modified since indicated ISO 8601 time '
+                                            'and tombstones of goods deleted or zeroed since then')
 
     def handle(self, *args, **options):
         """
         Method to describe the actual logic of the command export_goods
         """
 
-        result = {'categories': [],
-                  'shop': [],
-                  'goods': []}
-        for category in Category.objects.all():
-            result['categories'].append({'id': category.id, 'name': category.name})
-        for supplier in Supplier.objects.all():
-            result['shop'].append({'id': supplier.id, 'name': supplier.name})
-
-        for stock in Stock.objects.all().\
-                prefetch_related('product_characteristics', 'product_characteristics__characteristic').\
-                select_related('product', 'product__category', 'supplier'):
-            parameters = {}
-            for parameter in stock.product_characteristics.all():
-                parameters[parameter.characteristic.name] = parameter.value
+        if options['shards'] < 1:
+            raise CommandError('Number of shards must be positive')
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if not since:
+                raise CommandError('Time of --since option must be in ISO 8601 format')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        exporter_options = {
+            'export_format': options['format'],
+            'suppliers': options['supplier'],
+            'categories': options['category'],
+            'chunk_size': options['chunk_size'],
+            'since': since,
+        }
+        path = options['output'] or default_path(options['format'], options['gzip'])
+        exporter = StockExporter(**exporter_options)
+        if since:
+            self.stdout.write(f'Next incremental export may start since {exporter.exported_at.isoformat()}')
+        if options['shards'] == 1:
+            count = exporter.export(path, options['gzip'])
+            self.stdout.write(f'{count} goods exported to {path}')
+            return
 
-            result['goods'].append({'id': stock.sku,
-                                    'category': stock.product.category.id,
-                                    'model': stock.model,
-                                    'name': stock.product.name,
-                                    'shop': stock.supplier.id,
-                                    'price': float('{:.2f}'.format(stock.price)),
-                                    'price_rrc': float('{:.2f}'.format(stock.price_rrc)),
-                                    'quantity': stock.quantity,
-                                    'parameters': parameters})
-        with open('export.yml', 'w', encoding='utf8') as outfile:
-            yaml.dump(result, outfile, allow_unicode=True, default_flow_style=False)
+        ranges = exporter.shards(options['shards'])
+        paths = [shard_path(path, number) for number in range(1, len(ranges) + 1)]
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            counts = executor.map(
+                export_shard, [exporter_options] * len(ranges), ranges, paths, [options['gzip']] * len(ranges)
+            )
+            for shard_file, count in zip(paths, counts):
+                self.stdout.write(f'{count} goods exported to {shard_file}')
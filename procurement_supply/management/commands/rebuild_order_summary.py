@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from procurement_supply.models import Order
+
+
+class Command(BaseCommand):
+    """
+        Class to arrange management command rebuild_order_summary.
+    """
+    def add_arguments(self, parser):
+        """
+        Entry point for subclassed commands to add custom arguments.
+        """
+        parser.add_argument('--check', action='store_true',
+                            help='Only report orders with stale summary columns, exit with error if there are any')
+        parser.add_argument('--order', type=int, action='append', help='Id of order to rebuild, may be repeated')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of orders read and updated at once')
+
+    def handle(self, *args, **options):
+        """
+        Method to describe the actual logic of the command rebuild_order_summary
+        """
+
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size must be positive')
+        orders = Order.objects.all()
+        if options['order']:
+            orders = orders.filter(id__in=options['order'])
+
+        if not options['check']:
+            count = orders.refresh_summaries(options['batch_size'])
+            self.stdout.write(f'{count} order summaries rebuilt')
+            return
+
+        count = 0
+        for order, summary in orders.stale_summaries(options['batch_size']):
+            count += 1
+            differences = ', '.join(
+                f'{column} {getattr(order, column)} != {value}'
+                for column, value in summary.items() if getattr(order, column) != value
+            )
+            self.stdout.write(f'Order #{order.id}: {differences}')
+        if count:
+            raise CommandError(f'{count} order summaries are stale')
+        self.stdout.write('All order summaries are consistent')
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="content_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
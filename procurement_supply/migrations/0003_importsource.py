@@ -0,0 +1,57 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0002_stock_content_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportSource",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("url", models.URLField(max_length=500)),
+                ("etag", models.CharField(blank=True, default="", max_length=255)),
+                (
+                    "last_modified",
+                    models.CharField(blank=True, default="", max_length=64),
+                ),
+                (
+                    "content_hash",
+                    models.CharField(blank=True, default="", max_length=64),
+                ),
+                ("imported_at", models.DateTimeField(auto_now=True)),
+                (
+                    "supplier",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_sources",
+                        to="procurement_supply.supplier",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Источник импорта",
+                "verbose_name_plural": "Список источников импорта",
+                "ordering": ("supplier", "url"),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="importsource",
+            constraint=models.UniqueConstraint(
+                fields=("supplier", "url"), name="unique_import_source"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:37
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0003_importsource"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importsource",
+            name="next_import_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="importsource",
+            name="refresh_interval",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Интервал обновления в минутах",
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+            ),
+        ),
+        migrations.AddField(
+            model_name="supplier",
+            name="import_lock",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=255
+            ),
+        ),
+        migrations.AddField(
+            model_name="supplier",
+            name="import_locked_until",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name="importsource",
+            name="imported_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0004_import_schedule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockTombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("stock_id", models.PositiveIntegerField()),
+                ("sku", models.CharField(max_length=30)),
+                ("supplier_id", models.PositiveIntegerField()),
+                ("category_id", models.PositiveIntegerField()),
+                ("deleted_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                "verbose_name": "Удаленный запас продукта",
+                "verbose_name_plural": "Список удаленных запасов продукта",
+                "ordering": ("deleted_at",),
+            },
+        ),
+        migrations.AddField(
+            model_name="productcharacteristic",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="stock",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.7 on 2026-10-18 02:51
+
+from django.db import migrations, models
+import procurement_supply.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0005_stock_modification_tracking"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cartposition",
+            name="reserved_until",
+            field=models.DateTimeField(
+                db_index=True, default=procurement_supply.models.reservation_deadline
+            ),
+        ),
+    ]
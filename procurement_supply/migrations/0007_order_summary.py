@@ -0,0 +1,84 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:02
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+def fill_order_summary(apps, schema_editor):
+    """
+    Calculates summary columns of existing orders
+    """
+    Order = apps.get_model("procurement_supply", "Order")
+    orders = Order.objects.annotate(
+        positions_quantity=Sum("order_positions__quantity"),
+        positions_amount=Sum(
+            F("order_positions__quantity") * F("order_positions__price"),
+            output_field=models.DecimalField(max_digits=16, decimal_places=2),
+        ),
+        positions_count=Count("order_positions"),
+        suppliers_count=Count("order_positions__stock__supplier", distinct=True),
+        confirmed_positions=Count("order_positions", filter=Q(order_positions__confirmed=True)),
+        delivered_positions=Count("order_positions", filter=Q(order_positions__delivered=True)),
+    ).order_by("id")
+    updated = []
+    for order in orders.iterator(chunk_size=1000):
+        amount = Decimal(order.positions_amount or 0)
+        if order.suppliers_count > 1:
+            amount *= Decimal(settings.COMBINED_ORDER_MULTIPLIER)
+        order.total_quantity = order.positions_quantity or 0
+        order.total_amount = amount.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+        order.supplier_count = order.suppliers_count
+        order.position_count = order.positions_count
+        order.confirmed_count = order.confirmed_positions
+        order.delivered_count = order.delivered_positions
+        updated.append(order)
+    Order.objects.bulk_update(
+        updated,
+        ["total_quantity", "total_amount", "supplier_count", "position_count", "confirmed_count", "delivered_count"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0006_cart_reservation_expiry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="confirmed_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="delivered_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="position_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="supplier_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_amount",
+            field=models.DecimalField(
+                db_index=True, decimal_places=2, default=0, max_digits=16
+            ),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="total_quantity",
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(fill_order_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0008_notification_outbox"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="order",
+            options={
+                "ordering": ("-date", "purchaser_id"),
+                "verbose_name": "Заказ",
+                "verbose_name_plural": "Список заказов",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="orderposition",
+            options={
+                "ordering": ("order_id", "price"),
+                "verbose_name": "Позиция заказа",
+                "verbose_name_plural": "Список позиций заказов",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="productcharacteristic",
+            options={
+                "ordering": ("stock_id", "value"),
+                "verbose_name": "Характеристика запаса продукта",
+                "verbose_name_plural": "Список характеристик запаса продукта",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="stock",
+            options={
+                "ordering": ("product_id", "price"),
+                "verbose_name": "Запас продукта",
+                "verbose_name_plural": "Список запасов продукта",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["-date", "purchaser", "id"], name="order_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["purchaser", "-date"], name="order_purchaser_date_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="orderposition",
+            index=models.Index(
+                fields=["order", "price", "id"], name="order_position_ordering_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productcharacteristic",
+            index=models.Index(
+                fields=["stock", "value"], name="product_char_stock_value_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stock",
+            index=models.Index(
+                condition=models.Q(("quantity__gt", 0)),
+                fields=["product", "price", "id"],
+                name="stock_available_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stock",
+            index=models.Index(
+                fields=["supplier", "product", "price", "id"], name="stock_supplier_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.7 on 2026-10-18 03:39
+
+from itertools import islice
+
+from django.contrib.postgres.indexes import GinIndex
+from django.db import migrations, models
+
+from procurement_supply.search import search_vector
+
+SEARCH_INDEX = GinIndex(search_vector(), name="stock_search_idx")
+
+
+def fill_search_document(apps, schema_editor):
+    """
+    Builds search documents of existing stocks
+    """
+    Stock = apps.get_model("procurement_supply", "Stock")
+    stock_ids = iter(list(Stock.objects.order_by("id").values_list("id", flat=True)))
+    while batch := list(islice(stock_ids, 1000)):
+        stocks = list(
+            Stock.objects.filter(id__in=batch)
+            .select_related("product__category", "supplier")
+            .prefetch_related("product_characteristics")
+        )
+        for stock in stocks:
+            parts = [
+                stock.product.name,
+                stock.model,
+                stock.product.category.name,
+                stock.supplier.name,
+                stock.supplier.address,
+                *(product_characteristic.value for product_characteristic in stock.product_characteristics.all()),
+                stock.description,
+            ]
+            stock.search_document = " ".join(part for part in parts if part).lower()
+        Stock.objects.bulk_update(stocks, ["search_document"])
+
+
+def add_search_index(apps, schema_editor):
+    """
+    Creates GIN index of full-text search vectors of search documents, only PostgreSQL supports it
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(apps.get_model("procurement_supply", "Stock"), SEARCH_INDEX)
+
+
+def remove_search_index(apps, schema_editor):
+    """
+    Drops GIN index of search documents
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(apps.get_model("procurement_supply", "Stock"), SEARCH_INDEX)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0009_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="search_document",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.RunPython(fill_search_document, migrations.RunPython.noop),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:37
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("procurement_supply", "0010_stock_search_document"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("import_id", models.CharField(db_index=True, max_length=255)),
+                ("first_row", models.PositiveIntegerField(default=1)),
+                (
+                    "goods",
+                    models.JSONField(
+                        default=list,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "supplier",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_chunks",
+                        to="procurement_supply.supplier",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Часть импорта",
+                "verbose_name_plural": "Список частей импорта",
+                "ordering": ("id",),
+            },
+        ),
+    ]
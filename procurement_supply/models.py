@@ -1,10 +1,19 @@
 import uuid
-from decimal import Decimal
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from functools import reduce
+from itertools import islice
+from operator import or_
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
 
 
 USER_TYPE_CHOICES = (
@@ -46,15 +55,64 @@ class User(AbstractUser):
         ordering = ("id",)
 
 
-class Supplier(models.Model):
+class SearchDocumentSource:
+    """
+    Mixin of models whose fields are included in search documents of stocks. Values of searched fields
+    are remembered when instance is loaded from database, so that their changes are detected without reading it again
+    """
+
+    SEARCH_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Creates instance loaded from database and remembers values of its searched fields
+        """
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_search_fields()
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Saves instance and remembers saved values of searched fields
+        """
+        super().save(*args, **kwargs)
+        self.snapshot_search_fields()
+
+    def snapshot_search_fields(self):
+        """
+        Remembers current values of loaded searched fields
+        """
+        deferred = self.get_deferred_fields()
+        self.search_original = {field: getattr(self, field) for field in self.SEARCH_FIELDS if field not in deferred}
+
+    def search_fields_changed(self, update_fields=None):
+        """
+        Checks whether any of searched fields was changed since instance was loaded or saved
+        :param update_fields: fields written by save, all fields if None
+        :return: True if field was changed or its original value is unknown, otherwise False
+        """
+        original = getattr(self, "search_original", {})
+        return any(
+            field not in original or original[field] != getattr(self, field)
+            for field in self.SEARCH_FIELDS
+            if update_fields is None or field in update_fields
+        )
+
+
+class Supplier(SearchDocumentSource, models.Model):
     """
     Class to describe products suppliers
     """
 
+    SEARCH_FIELDS = ("name", "address")
+
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=50, unique=True)
     address = models.CharField(max_length=100, null=True, blank=True)
     order_status = models.BooleanField(default=True)
+    import_lock = models.CharField(max_length=255, blank=True, default="", editable=False)
+    import_locked_until = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Поставщик"
@@ -65,11 +123,13 @@ class Supplier(models.Model):
         return self.name
 
 
-class Category(models.Model):
+class Category(SearchDocumentSource, models.Model):
     """
     Class to describe products categories
     """
 
+    SEARCH_FIELDS = ("name",)
+
     name = models.CharField(max_length=30, unique=True)
     suppliers = models.ManyToManyField(Supplier, related_name="categories", blank=True)
 
@@ -82,11 +142,13 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(SearchDocumentSource, models.Model):
     """
     Class to describe products
     """
 
+    SEARCH_FIELDS = ("name", "category_id")
+
     name = models.CharField(max_length=50)
     category = models.ForeignKey(
         Category, on_delete=models.CASCADE, related_name="products"
@@ -101,11 +163,27 @@ class Product(models.Model):
         return self.name
 
 
+class StockQuerySet(models.QuerySet):
+    """
+    QuerySet class of stocks
+    """
+
+    def delete(self):
+        """
+        Saves tombstones of stocks with single INSERT ... SELECT and deletes them
+        """
+        with transaction.atomic():
+            StockTombstone.record(self)
+            return super().delete()
+
+
 class Stock(models.Model):
     """
     Class to describe stock of certain product on warehouse of certain supplier
     """
 
+    objects = StockQuerySet.as_manager()
+
     description = models.TextField(null=True, blank=True)
     sku = models.CharField(max_length=30)
     model = models.CharField(max_length=50, null=True, blank=True)
@@ -122,6 +200,9 @@ class Stock(models.Model):
         decimal_places=2, max_digits=16, validators=[MinValueValidator(0.01)]
     )
     quantity = models.PositiveIntegerField()
+    content_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
+    search_document = models.TextField(blank=True, default="", editable=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "Запас продукта"
@@ -131,11 +212,115 @@ class Stock(models.Model):
                 fields=["sku", "product", "supplier"], name="unique_stock"
             ),
         ]
-        ordering = ("product", "price")
+        indexes = [
+            models.Index(
+                fields=["product", "price", "id"], condition=Q(quantity__gt=0), name="stock_available_idx"
+            ),
+            models.Index(fields=["supplier", "product", "price", "id"], name="stock_supplier_idx"),
+        ]
+        ordering = ("product_id", "price")
 
     def __str__(self):
         return f"Запас {self.product.name} у {self.supplier.name}"
 
+    def build_search_document(self):
+        """
+        Returns text of stock found by search in lower case. Fields come in order of their importance:
+        product name, model, category, supplier name and address, characteristic values and description
+        Product with category, supplier and product characteristics should be selected with stock
+        """
+        parts = [
+            self.product.name,
+            self.model,
+            self.product.category.name,
+            self.supplier.name,
+            self.supplier.address,
+            *(product_characteristic.value for product_characteristic in self.product_characteristics.all()),
+            self.description,
+        ]
+        return " ".join(part for part in parts if part).lower()
+
+    @classmethod
+    def refresh_search_documents(cls, stock_ids, batch_size=None):
+        """
+        Rebuilds search documents of stocks in batches, only changed documents are written.
+        Stocks are not marked as modified for incremental export
+        :param stock_ids: iterable of ids of stocks
+        :param batch_size: number of stocks read and written at once, SEARCH_BATCH_SIZE by default
+        :return: number of changed documents
+        """
+        batch_size = batch_size or settings.SEARCH_BATCH_SIZE
+        stock_ids = iter(stock_ids)
+        changed = 0
+        while batch := list(islice(stock_ids, batch_size)):
+            stocks = []
+            for stock in (
+                cls.objects.filter(id__in=batch)
+                .select_related("product__category", "supplier")
+                .prefetch_related("product_characteristics")
+            ):
+                document = stock.build_search_document()
+                if stock.search_document != document:
+                    stock.search_document = document
+                    stocks.append(stock)
+            cls.objects.bulk_update(stocks, ["search_document"])
+            changed += len(stocks)
+        return changed
+
+    def delete(self, *args, **kwargs):
+        """
+        Saves tombstone of stock and deletes it
+        """
+        with transaction.atomic():
+            StockTombstone.record(Stock.objects.filter(id=self.id))
+            return super().delete(*args, **kwargs)
+
+    @classmethod
+    def reserve(cls, stock_id, quantity):
+        """
+        Takes indicated quantity from stock with single conditional UPDATE, so that concurrent reservations
+        never oversell stock or overwrite each other
+        :return: True if quantity is reserved, False if not enough stock is available
+        """
+        return bool(
+            cls.objects.filter(id=stock_id, quantity__gte=quantity).update(
+                quantity=F("quantity") - quantity, updated_at=timezone.now()
+            )
+        )
+
+    @classmethod
+    def release(cls, stock_id, quantity):
+        """
+        Returns indicated quantity to stock with single UPDATE
+        """
+        cls.objects.filter(id=stock_id).update(quantity=F("quantity") + quantity, updated_at=timezone.now())
+
+    @classmethod
+    def release_many(cls, quantities):
+        """
+        Returns quantities to several stocks with single UPDATE
+        :param quantities: dict of quantities by stock id
+        """
+        if not quantities:
+            return
+        cls.objects.filter(id__in=quantities).update(
+            quantity=F("quantity") + Case(
+                *[When(id=stock_id, then=Value(quantity)) for stock_id, quantity in quantities.items()],
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+
+    @classmethod
+    def reserve_many(cls, quantities):
+        """
+        Takes quantities from several stocks with single UPDATE.
+        Stocks must be locked with select_for_update() and checked for enough quantity in the same transaction
+        :param quantities: dict of quantities by stock id, negative quantity is returned to stock
+        """
+        cls.release_many({stock_id: -quantity for stock_id, quantity in quantities.items()})
+
 
 class Characteristic(models.Model):
     """
@@ -165,6 +350,7 @@ class ProductCharacteristic(models.Model):
         Characteristic, on_delete=models.CASCADE, related_name="product_characteristics"
     )
     value = models.CharField(max_length=30)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Характеристика запаса продукта"
@@ -174,11 +360,153 @@ class ProductCharacteristic(models.Model):
                 fields=["stock", "characteristic"], name="unique_product_characteristic"
             ),
         ]
-        ordering = ("stock", "value")
+        indexes = [
+            models.Index(fields=["stock", "value"], name="product_char_stock_value_idx"),
+        ]
+        ordering = ("stock_id", "value")
 
     def __str__(self):
         return self.value
 
+    def save(self, *args, **kwargs):
+        """
+        Saves product characteristic and resets content hash of its stock, so that next delta import rewrites it.
+        Stock is marked as modified for incremental export and its search document is rebuilt
+        """
+        super().save(*args, **kwargs)
+        Stock.objects.filter(id=self.stock_id).update(content_hash="", updated_at=timezone.now())
+        Stock.refresh_search_documents([self.stock_id])
+
+    def delete(self, *args, **kwargs):
+        """
+        Deletes product characteristic and resets content hash of its stock, so that next delta import rewrites it.
+        Stock is marked as modified for incremental export and its search document is rebuilt
+        """
+        Stock.objects.filter(id=self.stock_id).update(content_hash="", updated_at=timezone.now())
+        deleted = super().delete(*args, **kwargs)
+        Stock.refresh_search_documents([self.stock_id])
+        return deleted
+
+
+def characteristics_prefetch(lookup="product_characteristics"):
+    """
+    Returns prefetch of product characteristics with their characteristics,
+    so that characteristics of any number of stocks are read with single query
+    :param lookup: path to product characteristics from prefetched model
+    :return: Prefetch
+    """
+    return models.Prefetch(lookup, queryset=ProductCharacteristic.objects.select_related("characteristic"))
+
+
+class StockTombstone(models.Model):
+    """
+    Class to describe deleted stock, so that its deletion may be exported incrementally
+    """
+
+    stock_id = models.PositiveIntegerField()
+    sku = models.CharField(max_length=30)
+    supplier_id = models.PositiveIntegerField()
+    category_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Удаленный запас продукта"
+        verbose_name_plural = "Список удаленных запасов продукта"
+        ordering = ("deleted_at",)
+
+    def __str__(self):
+        return f"Удаленный запас {self.sku} поставщика {self.supplier_id}"
+
+    @classmethod
+    def record(cls, stocks):
+        """
+        Saves tombstones of stocks with single INSERT ... SELECT, so that their deletion is included
+        in incremental export. Stocks deleted by cascade must be recorded before deletion of their supplier or product
+        :param stocks: queryset of stocks
+        :return: number of saved tombstones
+        """
+        select = (
+            stocks.order_by()
+            .annotate(tombstone_deleted_at=Value(timezone.now(), output_field=models.DateTimeField()))
+            .values_list("id", "sku", "supplier_id", "product__category_id", "tombstone_deleted_at")
+        )
+        sql, params = select.query.sql_with_params()
+        columns = ", ".join(
+            connection.ops.quote_name(cls._meta.get_field(field).column)
+            for field in ("stock_id", "sku", "supplier_id", "category_id", "deleted_at")
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {connection.ops.quote_name(cls._meta.db_table)} ({columns}) {sql}", params)
+            return cursor.rowcount
+
+
+class ImportSource(models.Model):
+    """
+    Class to describe price list of certain supplier at certain URL as it was at last successful import
+    """
+
+    supplier = models.ForeignKey(
+        Supplier, on_delete=models.CASCADE, related_name="import_sources"
+    )
+    url = models.URLField(max_length=500)
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=64, blank=True, default="")
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    imported_at = models.DateTimeField(null=True, blank=True)
+    refresh_interval = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)], help_text="Интервал обновления в минутах"
+    )
+    next_import_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Источник импорта"
+        verbose_name_plural = "Список источников импорта"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["supplier", "url"], name="unique_import_source"
+            ),
+        ]
+        ordering = ("supplier", "url")
+
+    def __str__(self):
+        return f"Источник импорта {self.supplier.name}: {self.url}"
+
+    @property
+    def conditional_headers(self):
+        """
+        Returns headers of conditional request for price list
+        :return: dict
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ImportChunk(models.Model):
+    """
+    Class to describe chunk of goods of import file staged for import_chunk task,
+    so that tasks receive only id of chunk instead of goods
+    """
+
+    import_id = models.CharField(max_length=255, db_index=True)
+    supplier = models.ForeignKey(
+        Supplier, on_delete=models.CASCADE, related_name="import_chunks"
+    )
+    first_row = models.PositiveIntegerField(default=1)
+    goods = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Часть импорта"
+        verbose_name_plural = "Список частей импорта"
+        ordering = ("id",)
+
+    def __str__(self):
+        return f"Часть импорта {self.import_id} со строки {self.first_row}"
+
 
 class Purchaser(models.Model):
     """
@@ -219,6 +547,45 @@ class ChainStore(models.Model):
         return f"{self.name} {self.address}"
 
 
+def positions_quantity(positions):
+    """
+    Returns expression of total quantity of positions for annotation of carts or orders
+    :param positions: name of relation to positions
+    """
+    return Coalesce(Sum(f"{positions}__quantity"), 0)
+
+
+def positions_amount(positions):
+    """
+    Returns expression of total amount of positions for annotation of carts or orders
+    :param positions: name of relation to positions
+    """
+    amount_field = models.DecimalField(max_digits=16, decimal_places=2)
+    return Coalesce(
+        Sum(F(f"{positions}__quantity") * F(f"{positions}__price"), output_field=amount_field),
+        Value(Decimal(0)),
+        output_field=amount_field,
+    )
+
+
+class ShoppingCartQuerySet(models.QuerySet):
+    """
+    QuerySet class of shopping carts
+    """
+
+    def with_totals(self):
+        """
+        Annotates shopping carts with total quantity and amount of their positions calculated in the same query,
+        total_quantity and total_amount of annotated carts do not read positions.
+        Default ordering is set explicitly, since Meta.ordering is not applied to GROUP BY queries
+        """
+        queryset = self.annotate(
+            positions_quantity=positions_quantity("cart_positions"),
+            positions_amount=positions_amount("cart_positions"),
+        )
+        return queryset if self.query.order_by else queryset.order_by(*self.model._meta.ordering)
+
+
 class ShoppingCart(models.Model):
     """
     Class to describe purchasers shopping cart
@@ -228,11 +595,15 @@ class ShoppingCart(models.Model):
         Purchaser, on_delete=models.CASCADE, related_name="shopping_cart"
     )
 
+    objects = ShoppingCartQuerySet.as_manager()
+
     def calculate_total_quantity(self):
         """
         Calculates total quantity of items in shopping cart
         :return: total quantity of items
         """
+        if hasattr(self, "positions_quantity"):
+            return self.positions_quantity
         return sum([position.quantity for position in self.cart_positions.all()])
 
     @property
@@ -248,6 +619,8 @@ class ShoppingCart(models.Model):
         Calculates total amount of shopping cart
         :return: total amount for items
         """
+        if hasattr(self, "positions_amount"):
+            return self.positions_amount
         return sum([position.amount for position in self.cart_positions.all()])
 
     @property
@@ -267,6 +640,13 @@ class ShoppingCart(models.Model):
         return f"Корзина {self.purchaser.name}"
 
 
+def reservation_deadline():
+    """
+    Returns time when stock reserved in shopping cart at the moment is released back to stock
+    """
+    return timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+
 class CartPosition(models.Model):
     """
     Class to describe products positions in purchasers cart
@@ -282,6 +662,7 @@ class CartPosition(models.Model):
     price = models.DecimalField(
         decimal_places=2, max_digits=16, validators=[MinValueValidator(0.01)], default=0
     )
+    reserved_until = models.DateTimeField(default=reservation_deadline, db_index=True)
 
     @property
     def amount(self) -> Decimal:
@@ -302,11 +683,80 @@ class CartPosition(models.Model):
         ordering = ("shopping_cart",)
 
 
+class OrderQuerySet(models.QuerySet):
+    """
+    QuerySet class of orders
+    """
+
+    def with_totals(self):
+        """
+        Annotates orders with total quantity and amount of their positions, number of their positions and suppliers
+        and number of unconfirmed and undelivered positions calculated in the same query.
+        Default ordering is set explicitly, since Meta.ordering is not applied to GROUP BY queries
+        """
+        queryset = self.annotate(
+            positions_quantity=positions_quantity("order_positions"),
+            positions_amount=positions_amount("order_positions"),
+            positions_count=Count("order_positions"),
+            suppliers_count=Count("order_positions__stock__supplier", distinct=True),
+            unconfirmed_count=Count("order_positions", filter=Q(order_positions__confirmed=False)),
+            undelivered_count=Count("order_positions", filter=Q(order_positions__delivered=False)),
+        )
+        return queryset if self.query.order_by else queryset.order_by(*self.model._meta.ordering)
+
+    def summary_batches(self, batch_size=1000):
+        """
+        Reads orders annotated with totals of their positions in batches ordered by id
+        :param batch_size: number of orders read from database at once
+        :return: generator of lists of orders
+        """
+        last_id = 0
+        while batch := list(self.with_totals().filter(id__gt=last_id).order_by("id")[:batch_size]):
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_id = batch[-1].id
+
+    def stale_summaries(self, batch_size=1000):
+        """
+        Compares summary columns of orders with totals of their positions
+        :param batch_size: number of orders read from database at once
+        :return: generator of (order, dict of actual values of summary columns) tuples of orders with stale summary
+        """
+        for batch in self.summary_batches(batch_size):
+            for order in batch:
+                summary = order.calculate_summary()
+                if any(getattr(order, column) != value for column, value in summary.items()):
+                    yield order, summary
+
+    def refresh_summaries(self, batch_size=1000):
+        """
+        Recalculates summary columns of orders from their positions and saves stale ones with bulk updates
+        :param batch_size: number of orders read and updated at once
+        :return: number of updated orders
+        """
+        stale = self.stale_summaries(batch_size)
+        count = 0
+        while batch := list(islice(stale, batch_size)):
+            for order, summary in batch:
+                for column, value in summary.items():
+                    setattr(order, column, value)
+            self.model.objects.bulk_update([order for order, _ in batch], self.model.SUMMARY_FIELDS)
+            count += len(batch)
+        return count
+
+
 class Order(models.Model):
     """
-    Class to describe order
+    Class to describe order.
+    Totals of order positions are stored in summary columns, so that orders may be filtered and sorted by them.
+    Summary is calculated on order creation and kept up to date by signals of order positions
     """
 
+    SUMMARY_FIELDS = (
+        "total_quantity", "total_amount", "supplier_count", "position_count", "confirmed_count", "delivered_count"
+    )
+
     purchaser = models.ForeignKey(
         Purchaser, on_delete=models.CASCADE, related_name="orders"
     )
@@ -315,16 +765,14 @@ class Order(models.Model):
     chain_store = models.ForeignKey(
         ChainStore, on_delete=models.CASCADE, related_name="orders"
     )
+    total_quantity = models.PositiveIntegerField(default=0, db_index=True)
+    total_amount = models.DecimalField(decimal_places=2, max_digits=16, default=0, db_index=True)
+    supplier_count = models.PositiveIntegerField(default=0)
+    position_count = models.PositiveIntegerField(default=0)
+    confirmed_count = models.PositiveIntegerField(default=0)
+    delivered_count = models.PositiveIntegerField(default=0)
 
-    def check_confirmed(self):
-        """
-        Checks whether all order positions are confirmed
-        :return: True if all positions are confirmed, otherwise False
-        """
-        for position in self.order_positions.all():
-            if not position.confirmed:
-                return False
-        return True
+    objects = OrderQuerySet.as_manager()
 
     @property
     def confirmed(self) -> bool:
@@ -332,17 +780,7 @@ class Order(models.Model):
         Sets confirmed field of order instance
         :return: True if all positions are confirmed, otherwise False
         """
-        return self.check_confirmed()
-
-    def check_delivered(self):
-        """
-        Checks whether all order positions are delivered
-        :return: True if all positions are delivered, otherwise False
-        """
-        for position in self.order_positions.all():
-            if not position.delivered:
-                return False
-        return True
+        return self.confirmed_count == self.position_count
 
     @property
     def delivered(self) -> bool:
@@ -350,61 +788,146 @@ class Order(models.Model):
         Sets delivered field of order instance
         :return: True if all positions are delivered, otherwise False
         """
-        return self.check_delivered()
+        return self.delivered_count == self.position_count
 
-    def calculate_total_quantity(self):
+    @staticmethod
+    def summarize(positions):
         """
-        Calculates total quantity of items in order
-        :return: total quantity of items
+        Calculates values of summary columns from order positions.
+        If order contains positions from more than one supplier, amount will be multiplied using
+        COMBINED_ORDER_MULTIPLIER from project settings
+        :param positions: order positions with loaded stocks, positions may be not saved yet
+        :return: dict of values by column name
         """
-        return sum([position.quantity for position in self.order_positions.all()])
-
-    @property
-    def total_quantity(self) -> int:
+        positions = list(positions)
+        return Order.summary(
+            quantity=sum(position.quantity for position in positions),
+            amount=sum(position.amount for position in positions),
+            suppliers=len({position.stock.supplier_id for position in positions}),
+            positions=len(positions),
+            confirmed=len([position for position in positions if position.confirmed]),
+            delivered=len([position for position in positions if position.delivered]),
+        )
+
+    @staticmethod
+    def summary(quantity, amount, suppliers, positions, confirmed, delivered):
         """
-        Sets total_quantity field of order instance
-        :return: total quantity of items
+        Returns dict of values of summary columns, amount is multiplied for orders of several suppliers
         """
-        return self.calculate_total_quantity()
-
-    def calculate_total_amount(self):
-        """
-        Calculates total amount for items in order.
-        If order contains positions from more than one supplier, amount will be multiplied using
-        COMBINED_ORDER_MULTIPLIER from project settings
-        :return: total amount of order
-        """
-        amount = 0
-        suppliers = set()
-        for position in self.order_positions.all():
-            amount += position.amount
-            suppliers.add(position.stock.supplier)
-        if len(suppliers) > 1:
+        if suppliers > 1:
             amount = Decimal(settings.COMBINED_ORDER_MULTIPLIER) * Decimal(amount)
-        return amount
+        return {
+            "total_quantity": quantity,
+            "total_amount": Decimal(amount).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP),
+            "supplier_count": suppliers,
+            "position_count": positions,
+            "confirmed_count": confirmed,
+            "delivered_count": delivered,
+        }
+
+    def calculate_summary(self):
+        """
+        Calculates values of summary columns from annotations of with_totals() or from positions read from database
+        :return: dict of values by column name
+        """
+        if not hasattr(self, "positions_count"):
+            return self.summarize(self.order_positions.select_related("stock"))
+        return self.summary(
+            quantity=self.positions_quantity,
+            amount=self.positions_amount,
+            suppliers=self.suppliers_count,
+            positions=self.positions_count,
+            confirmed=self.positions_count - self.unconfirmed_count,
+            delivered=self.positions_count - self.undelivered_count,
+        )
+
+    @classmethod
+    def refresh_summary(cls, order_id):
+        """
+        Recalculates summary columns of order from its positions
+        """
+        cls.objects.filter(id=order_id).refresh_summaries()
 
-    @property
-    def total_amount(self) -> Decimal:
+    @classmethod
+    def change_summaries(cls, changes):
         """
-        Sets total_amount field of order instance
-        :return: total amount of order
+        Changes numbers of confirmed and delivered positions of orders with single UPDATE
+        :param changes: dict of (change of confirmed positions, change of delivered positions) tuples by order id,
+        e.g. {1: (1, 0), 2: (-1, 1)}
         """
-        return self.calculate_total_amount()
+        changes = {order_id: change for order_id, change in changes.items() if any(change)}
+        if not changes:
+            return
+        cls.objects.filter(id__in=changes).update(
+            confirmed_count=F("confirmed_count") + Case(
+                *[When(id=order_id, then=Value(change[0])) for order_id, change in changes.items()],
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ),
+            delivered_count=F("delivered_count") + Case(
+                *[When(id=order_id, then=Value(change[1])) for order_id, change in changes.items()],
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ),
+        )
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Список заказов"
-        ordering = ("-date", "purchaser")
+        indexes = [
+            models.Index(fields=["-date", "purchaser", "id"], name="order_date_idx"),
+            models.Index(fields=["purchaser", "-date"], name="order_purchaser_date_idx"),
+        ]
+        ordering = ("-date", "purchaser_id")
 
     def __str__(self):
         return f"{self.purchaser.name} {self.date}"
 
 
+order_positions_changed = Signal()
+
+
+class OrderPositionQuerySet(models.QuerySet):
+    """
+    QuerySet class of order positions
+    """
+
+    def update_status(self, **status):
+        """
+        Sets confirmed and/or delivered status of order positions with single UPDATE.
+        Summary columns of orders are changed and order_positions_changed signal is sent like on save of positions
+        :param status: confirmed and/or delivered values, e.g. confirmed=True
+        :return: list of changed positions with loaded orders, purchasers and users
+        """
+        with transaction.atomic():
+            changed = list(
+                self.filter(reduce(or_, [~Q(**{field: value}) for field, value in status.items()]))
+                .select_for_update(of=("self",))
+                .select_related("order__purchaser__user")
+                .order_by("id")
+            )
+            if not changed:
+                return changed
+            self.model.objects.filter(id__in=[position.id for position in changed]).update(**status)
+            for position in changed:
+                for field, value in status.items():
+                    setattr(position, field, value)
+            Order.change_summaries(OrderPosition.status_changes(changed))
+        order_positions_changed.send(sender=self.model, positions=changed)
+        for position in changed:
+            position.snapshot()
+        return changed
+
+
 class OrderPosition(models.Model):
     """
-    Class to describe certain product position of certain order
+    Class to describe certain product position of certain order.
+    Values of tracked fields are remembered when position is loaded from database,
+    so that changes are detected without reading position again
     """
 
+    TRACKED_FIELDS = ("stock_id", "quantity", "price", "confirmed", "delivered")
+
     order = models.ForeignKey(
         Order, on_delete=models.CASCADE, related_name="order_positions"
     )
@@ -418,6 +941,68 @@ class OrderPosition(models.Model):
     confirmed = models.BooleanField(default=False)
     delivered = models.BooleanField(default=False)
 
+    objects = OrderPositionQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Creates instance loaded from database and remembers values of its tracked fields
+        """
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot()
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Saves instance and remembers saved values of tracked fields
+        """
+        super().save(*args, **kwargs)
+        self.snapshot()
+
+    def snapshot(self):
+        """
+        Remembers current values of loaded tracked fields
+        """
+        deferred = self.get_deferred_fields()
+        self.original = {field: getattr(self, field) for field in self.TRACKED_FIELDS if field not in deferred}
+
+    def was_changed(self, *fields):
+        """
+        Checks whether any of indicated tracked fields was changed since position was loaded or saved
+        :return: True if field was changed or its original value is unknown, otherwise False
+        """
+        original = getattr(self, "original", {})
+        return any(field not in original or original[field] != getattr(self, field) for field in fields)
+
+    @staticmethod
+    def status_changes(positions):
+        """
+        Calculates changes of numbers of confirmed and delivered positions of orders
+        :param positions: changed positions with remembered original values
+        :return: dict of (change of confirmed positions, change of delivered positions) tuples by order id
+        """
+        changes = {}
+        for position in positions:
+            confirmed, delivered = changes.get(position.order_id, (0, 0))
+            changes[position.order_id] = (
+                confirmed + int(position.confirmed) - int(position.original["confirmed"]),
+                delivered + int(position.delivered) - int(position.original["delivered"]),
+            )
+        return changes
+
+    def purchaser_email(self):
+        """
+        Returns email of purchaser of order. Already loaded order, purchaser and user are used,
+        otherwise email is read with single query
+        """
+        if (
+            OrderPosition.order.is_cached(self)
+            and Order.purchaser.is_cached(self.order)
+            and Purchaser.user.is_cached(self.order.purchaser)
+        ):
+            return self.order.purchaser.user.email
+        return User.objects.filter(purchaser__orders=self.order_id).values_list("email", flat=True).first()
+
     @property
     def amount(self) -> Decimal:
         """
@@ -434,7 +1019,10 @@ class OrderPosition(models.Model):
                 fields=["order", "stock"], name="unique_order_stock"
             ),
         ]
-        ordering = ("order", "price")
+        indexes = [
+            models.Index(fields=["order", "price", "id"], name="order_position_ordering_idx"),
+        ]
+        ordering = ("order_id", "price")
 
 
 class PasswordResetToken(models.Model):
@@ -452,3 +1040,40 @@ class PasswordResetToken(models.Model):
 
     def __str__(self):
         return f"Password reset token for user {self.user}"
+
+
+class Notification(models.Model):
+    """
+    Class to describe email notification waiting in outbox. Pending notifications of the same recipient
+    are coalesced into one digest email by dispatch_notifications task
+    """
+
+    email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Уведомление"
+        verbose_name_plural = "Список уведомлений"
+        indexes = [
+            models.Index(
+                fields=["email", "created_at"], condition=Q(sent_at__isnull=True), name="pending_notification_idx"
+            ),
+        ]
+        ordering = ("created_at",)
+
+    def __str__(self):
+        return f"Уведомление {self.email}: {self.subject}"
+
+    @classmethod
+    def enqueue(cls, *notifications):
+        """
+        Puts notifications into outbox with single INSERT
+        :param notifications: (subject, message, email) tuples
+        :return: list of created notifications
+        """
+        return cls.objects.bulk_create(
+            cls(subject=subject, message=message, email=email) for subject, message, email in notifications
+        )
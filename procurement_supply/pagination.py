@@ -0,0 +1,87 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class PageSizePagination(PageNumberPagination):
+    """
+    Page number pagination with page size selected by client with page_size parameter, at most MAX_PAGE_SIZE
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination in order of cursor_ordering attribute of view. Next page is selected by indexed keys
+    of the last object of previous page instead of OFFSET, so response time does not depend on page number
+    """
+
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Returns ordering of view, ordering parameter of request is not supported by cursor pagination
+        """
+        return tuple(view.cursor_ordering)
+
+
+class OptionalKeysetPagination(PageSizePagination):
+    """
+    Page number pagination switching to cursor pagination when client requests it with pagination=cursor parameter
+    """
+
+    pagination_query_param = "pagination"
+    keyset_pagination_class = KeysetPagination
+
+    def __init__(self):
+        self.keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Paginates queryset by page number or by cursor depending on pagination parameter of request
+        """
+        if request.query_params.get(self.pagination_query_param) != "cursor":
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = self.keyset_pagination_class()
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """
+        Returns response with count of objects for page number pagination or without it for cursor pagination
+        """
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        """
+        Returns page controls of browsable API
+        """
+        if self.keyset:
+            return self.keyset.to_html()
+        return super().to_html()
+
+    def get_schema_operation_parameters(self, view):
+        """
+        Returns parameters of both kinds of pagination for schema of API
+        """
+        keyset = self.keyset_pagination_class()
+        return super().get_schema_operation_parameters(view) + [
+            {
+                "name": self.pagination_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to cursor to paginate by cursor instead of page number",
+                "schema": {"type": "string", "enum": ["cursor"]},
+            },
+            {
+                "name": keyset.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": str(keyset.cursor_query_description),
+                "schema": {"type": "string"},
+            },
+        ]
@@ -186,10 +186,7 @@ class IsCartStockOwner(BasePermission):
         """
         Return `True` if permission is granted, `False` otherwise.
         """
-        for position in obj.cart_positions.all():
-            if position.stock.supplier.user == request.user:
-                return True
-        return False
+        return obj.cart_positions.filter(stock__supplier__user=request.user).exists()
 
 
 class IsCartPositionOwner(BasePermission):
@@ -233,10 +230,7 @@ class IsOrderStockOwner(BasePermission):
         """
         Return `True` if permission is granted, `False` otherwise.
         """
-        for position in obj.order_positions.all():
-            if position.stock.supplier.user == request.user:
-                return True
-        return False
+        return obj.order_positions.filter(stock__supplier__user=request.user).exists()
 
 
 class IsOrderPositionOwner(BasePermission):
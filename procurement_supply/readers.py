@@ -0,0 +1,150 @@
+import hashlib
+import json
+import tempfile
+from itertools import chain
+from urllib.parse import urlparse
+
+import requests
+import yaml
+from yaml.composer import Composer
+from yaml.events import (MappingEndEvent, MappingStartEvent,
+                         SequenceEndEvent, SequenceStartEvent)
+
+from procurement_supply.importer import ImportFailed
+
+JSON_LINES_CONTENT_TYPES = ("application/jsonl", "application/x-ndjson", "application/json-lines")
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+HEADER_FIELDS = ("shop", "categories")
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class StreamingLoader(SafeLoader, Composer):
+    """
+    YAML loader which composes nodes one by one, so that goods may be constructed while file is being read.
+    Uses C-accelerated libyaml parser when it is available.
+    """
+
+    def __init__(self, stream):
+        SafeLoader.__init__(self, stream)
+        Composer.__init__(self)
+
+    def load_node(self):
+        """
+        Composes and constructs next node of stream
+        :return: python object
+        """
+        return self.construct_document(self.compose_node(None, None))
+
+
+def iter_yaml(stream):
+    """
+    Reads top level mapping of YAML stream. Items of "goods" sequence are yielded one by one
+    :param stream: file-like object
+    :return: generator of (key, value) pairs
+    """
+    loader = StreamingLoader(stream)
+    try:
+        loader.get_event()
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise ImportFailed("Import file has invalid structure")
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            key = loader.load_node()
+            if key == "goods" and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield key, loader.load_node()
+                loader.get_event()
+            else:
+                yield key, loader.load_node()
+    except yaml.YAMLError as error:
+        raise ImportFailed(f"Import file could not be parsed: {error}")
+    finally:
+        loader.dispose()
+
+
+def iter_json_lines(lines):
+    """
+    Reads JSON Lines stream. Lines with "shop" or "categories" keys and without "id" key are header,
+    any other line is a good
+    :param lines: iterable of lines
+    :return: generator of (key, value) pairs
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as error:
+            raise ImportFailed(f"Import file could not be parsed: line {number}: {error}")
+        if not isinstance(item, dict):
+            raise ImportFailed(f"Import file could not be parsed: line {number} is not an object")
+        if "id" not in item and item.keys() & set(HEADER_FIELDS):
+            yield from item.items()
+        else:
+            yield "goods", item
+
+
+def read_price_list(items):
+    """
+    Collects header of price list and returns goods as generator, which reads the rest of file lazily.
+    Header ("shop" and "categories") must precede goods
+    :param items: iterable of (key, value) pairs
+    :return: dict with "shop", "categories" and "goods" keys
+    """
+    items = iter(items)
+    data = {}
+    for key, value in items:
+        if key == "goods":
+            data["goods"] = chain([value], (value for key, value in items if key == "goods"))
+            break
+        data[key] = value
+    else:
+        data["goods"] = iter(())
+    for field in HEADER_FIELDS:
+        if field not in data:
+            raise ImportFailed(f'Field "{field}" is required before goods in import file')
+    return data
+
+
+def is_json_lines(url, content_type=""):
+    """
+    Checks whether price list is in JSON Lines format by its content type or URL extension
+    """
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return content_type in JSON_LINES_CONTENT_TYPES or urlparse(url).path.lower().endswith(JSON_LINES_EXTENSIONS)
+
+
+def download(response):
+    """
+    Streams body of HTTP response opened with stream=True to temporary file and calculates its SHA-256
+    :param response: requests response
+    :return: tuple of temporary file positioned at its start and hex digest of its content
+    """
+    import_file = tempfile.TemporaryFile()
+    content_hash = hashlib.sha256()
+    try:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            content_hash.update(chunk)
+            import_file.write(chunk)
+    except requests.RequestException as error:
+        import_file.close()
+        raise ImportFailed(f"Import file could not be downloaded: {error}")
+    import_file.seek(0)
+    return import_file, content_hash.hexdigest()
+
+
+def read_file(import_file, url, content_type=""):
+    """
+    Streams price list from file
+    :param import_file: binary file-like object
+    :param url: price list URL
+    :param content_type: Content-Type of price list
+    :return: dict with "shop", "categories" and "goods" keys
+    """
+    if is_json_lines(url, content_type):
+        return read_price_list(iter_json_lines(import_file))
+    return read_price_list(iter_yaml(import_file))
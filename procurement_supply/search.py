@@ -0,0 +1,57 @@
+import re
+from functools import reduce
+from operator import add
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import StrIndex
+
+from procurement_supply.models import Stock
+
+TERM_PATTERN = re.compile(r"\w+")
+# Text search configuration of GIN index of migration 0010_stock_search_document and of search queries.
+# Index is used only while query expression matches it, so change of configuration requires new migration
+SEARCH_CONFIG = "russian"
+
+
+def search_vector():
+    """
+    Returns full-text search vector of stock search document
+    """
+    return SearchVector("search_document", config=SEARCH_CONFIG)
+
+
+def search_terms(text):
+    """
+    Splits search text into words in lower case
+    """
+    return [term.lower() for term in TERM_PATTERN.findall(text or "")]
+
+
+def search_stocks(queryset, text):
+    """
+    Filters stocks whose search document contains all words of search text as prefixes of its words
+    and orders them by rank. PostgreSQL matches documents with full-text search by GIN index of tsvector
+    of documents and ranks them with ts_rank. Other databases match documents with LIKE and rank higher stocks,
+    whose words are found closer to the beginning of their documents, i.e. in more important fields
+    :param queryset: queryset of stocks
+    :param text: search text
+    :return: queryset annotated with search_rank
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+    if connection.vendor == "postgresql":
+        vector = search_vector()
+        query = SearchQuery(" & ".join(f"{term}:*" for term in terms), search_type="raw", config=SEARCH_CONFIG)
+        queryset = queryset.alias(search_vector=vector).filter(search_vector=query).annotate(
+            search_rank=SearchRank(vector, query)
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(search_document__contains=term)
+        queryset = queryset.annotate(
+            search_rank=Value(0) - reduce(add, [StrIndex(F("search_document"), Value(term)) for term in terms])
+        )
+    return queryset.order_by("-search_rank", *Stock._meta.ordering, "id")
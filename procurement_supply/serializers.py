@@ -1,10 +1,12 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from procurement_supply.exporter import EXPORT_FORMATS
 from procurement_supply.models import (CartPosition, Category, ChainStore,
-                                       Characteristic, Order, OrderPosition,
-                                       Product, ProductCharacteristic,
-                                       Purchaser, ShoppingCart, Stock,
-                                       Supplier, User)
+                                       Characteristic, ImportSource, Order,
+                                       OrderPosition, Product,
+                                       ProductCharacteristic, Purchaser,
+                                       ShoppingCart, Stock, Supplier, User)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -85,6 +87,23 @@ class ProductCharacteristicSerializer(serializers.ModelSerializer):
         fields = ["id", "stock", "characteristic", "value"]
 
 
+class CharacteristicsField(serializers.DictField):
+    """
+    Field to represent product characteristics of stock as {characteristic name: value} map.
+    Product characteristics should be prefetched with characteristics_prefetch to avoid query per stock
+    """
+
+    child = serializers.CharField()
+
+    def to_representation(self, value):
+        return super().to_representation(
+            {
+                product_characteristic.characteristic.name: product_characteristic.value
+                for product_characteristic in value.all()
+            }
+        )
+
+
 class StockSerializer(serializers.ModelSerializer):
     """
     Serializer class to serialize stock instances
@@ -93,7 +112,7 @@ class StockSerializer(serializers.ModelSerializer):
     description = serializers.CharField(required=False)
     model = serializers.CharField(required=False)
     sku = serializers.CharField()
-    product_characteristics = serializers.StringRelatedField(read_only=True, many=True)
+    product_characteristics = CharacteristicsField(read_only=True)
 
     class Meta:
         model = Stock
@@ -111,6 +130,49 @@ class StockSerializer(serializers.ModelSerializer):
         ]
 
 
+class ImportSourceSerializer(serializers.ModelSerializer):
+    """
+    Serializer class to serialize import source instances
+    """
+
+    class Meta:
+        model = ImportSource
+        fields = [
+            "id",
+            "supplier",
+            "url",
+            "refresh_interval",
+            "next_import_at",
+            "etag",
+            "last_modified",
+            "imported_at",
+        ]
+        read_only_fields = ["next_import_at", "etag", "last_modified", "imported_at"]
+
+    def update(self, instance, validated_data):
+        """
+        Update an import source instance. Changed URL is downloaded in full at next import,
+        changed refresh interval makes import source due to import at once
+        """
+        if validated_data.get("url", instance.url) != instance.url:
+            instance.etag = instance.last_modified = instance.content_hash = ""
+        if validated_data.get("refresh_interval", instance.refresh_interval) != instance.refresh_interval:
+            instance.next_import_at = None
+        return super().update(instance, validated_data)
+
+
+class ExportSerializer(serializers.Serializer):
+    """
+    Serializer class to validate parameters of stocks export
+    """
+
+    format = serializers.ChoiceField(choices=EXPORT_FORMATS, default="yaml")
+    suppliers = serializers.ListField(child=serializers.IntegerField(), required=False)
+    categories = serializers.ListField(child=serializers.IntegerField(), required=False)
+    since = serializers.DateTimeField(required=False)
+    gzip = serializers.BooleanField(default=False)
+
+
 class ChainStoreSerializer(serializers.ModelSerializer):
     """
     Serializer class to serialize chain store instances
@@ -141,8 +203,28 @@ class CartPositionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CartPosition
-        fields = ["id", "shopping_cart", "stock", "quantity", "price", "amount"]
-        read_only_fields = ["amount"]
+        fields = ["id", "shopping_cart", "stock", "quantity", "price", "amount", "reserved_until"]
+        read_only_fields = ["amount", "reserved_until"]
+
+
+class CartPositionBulkItemSerializer(serializers.Serializer):
+    """
+    Serializer class to validate single operation of bulk cart positions request
+    """
+
+    stock = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class CartPositionBulkSerializer(serializers.Serializer):
+    """
+    Serializer class to validate bulk cart positions request.
+    Quantity of cart position is set to indicated value, position with zero quantity is removed from cart
+    """
+
+    positions = CartPositionBulkItemSerializer(
+        many=True, allow_empty=False, max_length=settings.CART_BULK_MAX_POSITIONS
+    )
 
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
@@ -179,6 +261,32 @@ class OrderPositionSerializer(serializers.ModelSerializer):
         read_only_fields = ["order", "stock", "quantity", "price" "amount"]
 
 
+class OrderPositionBulkSerializer(serializers.Serializer):
+    """
+    Serializer class to validate bulk confirmation and delivery of order positions
+    """
+
+    positions = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False,
+        max_length=settings.ORDER_BULK_MAX_POSITIONS,
+    )
+    order = serializers.IntegerField(required=False)
+    confirmed = serializers.BooleanField(required=False)
+    delivered = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        """
+        Checks that either positions or order and at least one of statuses are indicated
+        """
+        if ("positions" in attrs) == ("order" in attrs):
+            raise serializers.ValidationError('Either "positions" or "order" field is required')
+        if "confirmed" not in attrs and "delivered" not in attrs:
+            raise serializers.ValidationError('"confirmed" or/and "delivered" field is required')
+        if attrs.get("confirmed") is False or attrs.get("delivered") is False:
+            raise serializers.ValidationError("Your cannot revoke your confirmation or delivery")
+        return attrs
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """
     Serializer class to serialize order instances
@@ -186,6 +294,9 @@ class OrderSerializer(serializers.ModelSerializer):
 
     chain_store = ChainStoreSerializer()
     order_positions = OrderPositionSerializer(read_only=True, many=True)
+    total_amount = serializers.DecimalField(
+        max_digits=16, decimal_places=2, coerce_to_string=False, read_only=True
+    )
 
     class Meta:
         model = Order
@@ -196,6 +307,10 @@ class OrderSerializer(serializers.ModelSerializer):
             "chain_store",
             "total_quantity",
             "total_amount",
+            "supplier_count",
+            "position_count",
+            "confirmed_count",
+            "delivered_count",
             "status",
             "confirmed",
             "delivered",
@@ -205,6 +320,10 @@ class OrderSerializer(serializers.ModelSerializer):
             "total_quantity",
             "date",
             "total_amount",
+            "supplier_count",
+            "position_count",
+            "confirmed_count",
+            "delivered_count",
             "status",
             "confirmed",
             "delivered",
@@ -1,20 +1,46 @@
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from procurement_supply.models import OrderPosition, User
-from procurement_supply.tasks import send_email
+from procurement_supply.models import (Category, Notification, Order,
+                                       OrderPosition, Product, Stock,
+                                       StockTombstone, Supplier, User,
+                                       order_positions_changed)
+from procurement_supply.tasks import refresh_search_documents
 
+SEARCH_DOCUMENT_LOOKUPS = {
+    Product: "product_id",
+    Category: "product__category_id",
+    Supplier: "supplier_id",
+}
 
-@receiver(pre_save, sender=OrderPosition)
-def cache_previous_order_position_status(sender, instance, **kwargs):
+
+@receiver(post_save, sender=OrderPosition)
+def update_order_summary(sender, instance, created, **kwargs):
     """
-    Save previous confirmed and delivered OrderPosition status in order to post_save check whether it was changed or not
+    Keeps summary columns of order up to date. Changes of confirmed and delivered status change counters of order
+    with single UPDATE, new positions and changes of quantity or price recalculate summary of order
     """
 
-    if instance.id:
-        order_position = sender.objects.get(pk=instance.id)
-        instance.__original_confirmed = order_position.confirmed
-        instance.__original_delivered = order_position.delivered
+    original = getattr(instance, "original", {})
+    if (
+        created
+        or "confirmed" not in original
+        or "delivered" not in original
+        or instance.was_changed("stock_id", "quantity", "price")
+    ):
+        Order.refresh_summary(instance.order_id)
+        return
+    Order.change_summaries(OrderPosition.status_changes([instance]))
+
+
+@receiver(post_delete, sender=OrderPosition)
+def update_order_summary_on_delete(sender, instance, **kwargs):
+    """
+    Recalculates summary columns of order after deletion of its position
+    """
+
+    Order.refresh_summary(instance.order_id)
 
 
 @receiver(post_save, sender=OrderPosition)
@@ -24,41 +50,112 @@ def send_email_change_order_pos_status(sender, instance, created, **kwargs):
     """
 
     if not created:
-        if (instance.__original_confirmed == instance.confirmed) \
-                and (instance.__original_delivered == instance.delivered):
-            return
-        if (instance.__original_confirmed and not instance.confirmed) \
-                or (instance.__original_delivered and not instance.delivered):
-            send_email.delay(
-                "Order position confirmation and/or delivery status revoked",
-                f'''Please contact supplier of position {instance.id} from your order #{instance.order.id}.
-                 Confirmation and/or delivery status or both of this position was revoked through admin site''',
-                instance.order.purchaser.user.email,
+        notify_purchasers([instance])
+
+
+@receiver(order_positions_changed, sender=OrderPosition)
+def send_email_change_order_pos_statuses(sender, positions, **kwargs):
+    """
+    Sends to purchasers notifications about positions changed with bulk update
+    """
+
+    notify_purchasers(positions)
+
+
+def notify_purchasers(positions):
+    """
+    Compares new and previous confirmation and delivery status of order positions and puts into outbox
+    one notification of each kind about all changed positions of each order
+    :param positions: order positions with remembered original values
+    """
+
+    emails = {}
+    revoked = {}
+    changed = {}
+    for position in positions:
+        original = getattr(position, "original", {})
+        if "confirmed" not in original or "delivered" not in original:
+            continue
+        if (original["confirmed"] == position.confirmed) and (original["delivered"] == position.delivered):
+            continue
+        if position.order_id not in emails:
+            emails[position.order_id] = position.purchaser_email()
+        if (original["confirmed"] and not position.confirmed) or (original["delivered"] and not position.delivered):
+            revoked.setdefault(position.order_id, []).append(
+                f'''Please contact supplier of position {position.id} from your order #{position.order_id}.
+                 Confirmation and/or delivery status or both of this position was revoked through admin site'''
             )
-            return
-        text = f'Your order #{instance.order.id} position {instance.id} was\n'
-        if not instance.__original_confirmed and instance.confirmed:
+            continue
+        text = f'Your order #{position.order_id} position {position.id} was\n'
+        if not original["confirmed"] and position.confirmed:
             text += '- confirmed\n'
-        if not instance.__original_delivered and instance.delivered:
+        if not original["delivered"] and position.delivered:
             text += '- delivered\n'
-        text += """by supplier.
-        Order is confirmed when all positions are confirmed and delivered after all position are delivered"""
-        send_email.delay(
+        changed.setdefault(position.order_id, []).append(text)
+
+    notifications = [
+        (
+            "Order position confirmation and/or delivery status revoked",
+            "\n".join(texts),
+            emails[order_id],
+        )
+        for order_id, texts in revoked.items()
+    ]
+    notifications.extend(
+        (
             "Order position confirmation and/or delivery status changed",
-            text,
-            instance.order.purchaser.user.email
+            "".join(texts) + """by supplier.
+        Order is confirmed when all positions are confirmed and delivered after all position are delivered""",
+            emails[order_id],
         )
+        for order_id, texts in changed.items()
+    )
+    if notifications:
+        Notification.enqueue(*notifications)
 
 
 @receiver(post_save, sender=User)
 def send_email_new_user(sender, instance, created, **kwargs):
     """
-    Sends user a welcome email after registration
+    Puts welcome email to user into outbox after registration
     """
 
     if created:
-        send_email.delay(
-            "Welcome to our site",
-            f"""Thank you for your registration, {instance.username}.""",
-            instance.email
+        Notification.enqueue(
+            ("Welcome to our site", f"""Thank you for your registration, {instance.username}.""", instance.email)
         )
+
+
+@receiver(pre_delete, sender=Supplier)
+@receiver(pre_delete, sender=Product)
+def create_stock_tombstones(sender, instance, **kwargs):
+    """
+    Saves tombstones of stocks of deleted supplier or product before they are deleted by cascade,
+    so that their deletion is included in incremental export
+    """
+
+    StockTombstone.record(instance.stocks.all())
+
+
+@receiver(post_save, sender=Stock)
+def update_search_document(sender, instance, **kwargs):
+    """
+    Rebuilds search document of created or changed stock
+    """
+
+    Stock.refresh_search_documents([instance.id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Supplier)
+def update_search_documents(sender, instance, created, **kwargs):
+    """
+    Rebuilds search documents of stocks of changed product, category or supplier in celery task
+    after commit of transaction
+    """
+
+    if created or not instance.search_fields_changed(kwargs.get("update_fields")):
+        return
+    lookup = SEARCH_DOCUMENT_LOOKUPS[sender]
+    transaction.on_commit(lambda: refresh_search_documents.delay(**{lookup: instance.pk}))
@@ -1,13 +1,29 @@
+import os
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from itertools import chain
+from smtplib import SMTPException
+
 import requests
-import yaml
-from celery import shared_task
-from django.core.mail import send_mail
+from celery import chord, shared_task
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.conf import settings
-from django.core.exceptions import MultipleObjectsReturned, ValidationError
+from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db.utils import IntegrityError
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from procurement_supply.models import Supplier, Category, Stock, Product, ProductCharacteristic, Characteristic
+from procurement_supply.exporter import StockExporter, default_path
+from procurement_supply.importer import (ImportFailed, StockImporter, batched,
+                                         lock_supplier, unlock_supplier)
+from procurement_supply.models import (CartPosition, ImportChunk,
+                                       ImportSource, Notification, Stock,
+                                       Supplier, User)
+from procurement_supply.readers import download, read_file
 
 
 @shared_task()
@@ -18,10 +34,170 @@ def send_email(title, message, address):
     send_mail(title, message, settings.EMAIL_HOST_USER, [address], fail_silently=False)
 
 
+def digest(notifications):
+    """
+    Composes one email of all pending notifications of a recipient.
+    Single notification is sent as is, several notifications are joined under common subject
+    :param notifications: notifications of the same recipient ordered by creation time
+    :return: EmailMessage
+    """
+    if len(notifications) == 1:
+        subject, message = notifications[0].subject, notifications[0].message
+    else:
+        subject = f"You have {len(notifications)} new notifications"
+        message = "\n\n".join(
+            f"{notification.subject}\n{notification.message}" for notification in notifications
+        )
+    return EmailMessage(subject, message, settings.EMAIL_HOST_USER, [notifications[0].email])
+
+
+@shared_task()
+def dispatch_notifications(window=None):
+    """
+    Sends notifications from outbox. Notifications of a recipient are sent when the oldest of them has waited
+    for NOTIFICATION_DIGEST_WINDOW seconds, all pending notifications of the recipient are coalesced into one digest.
+    Digests are sent in batches of NOTIFICATION_BATCH_SIZE recipients over a single connection to mail server.
+    Notifications locked by concurrent dispatcher are left to it. Digests are sent one by one and only sent ones
+    are marked, so that after failure of mail server remaining notifications are sent by the next run and sent ones
+    are not repeated
+    :param window: digest window in seconds, NOTIFICATION_DIGEST_WINDOW by default
+    """
+    if window is None:
+        window = settings.NOTIFICATION_DIGEST_WINDOW
+    sent = digests = 0
+    failure = None
+    with get_connection() as connection:
+        while True:
+            pending = Notification.objects.filter(sent_at__isnull=True)
+            with transaction.atomic():
+                recipients = list(
+                    pending.values("email")
+                    .annotate(first=Min("created_at"))
+                    .filter(first__lte=timezone.now() - timedelta(seconds=window))
+                    .order_by("first")
+                    .values_list("email", flat=True)[:settings.NOTIFICATION_BATCH_SIZE]
+                )
+                notifications = defaultdict(list)
+                for notification in (
+                    pending.select_for_update(skip_locked=True).filter(email__in=recipients).order_by("id")
+                ):
+                    notifications[notification.email].append(notification)
+                ids = []
+                for batch in notifications.values():
+                    try:
+                        connection.send_messages([digest(batch)])
+                    except (SMTPException, OSError) as error:
+                        failure = error
+                        break
+                    ids.extend(notification.id for notification in batch)
+                    digests += 1
+                Notification.objects.filter(id__in=ids).update(sent_at=timezone.now())
+            sent += len(ids)
+            if failure or not ids or len(recipients) < settings.NOTIFICATION_BATCH_SIZE:
+                break
+    Notification.objects.filter(
+        sent_at__lt=timezone.now() - timedelta(seconds=settings.NOTIFICATION_TTL)
+    ).delete()
+    detail = f"{sent} notifications sent in {digests} emails"
+    if failure:
+        return {'status': 'fail', 'detail': f"{detail}, sending failed: {failure}"}
+    return {'status': "success", 'detail': detail}
+
+
 @shared_task()
-def do_import(url, user_id=None):
+def refresh_search_documents(**lookup):
+    """
+    Rebuilds search documents of stocks after change of their product, category or supplier
+    :param lookup: keyword arguments of filter selecting stocks, e.g. supplier_id
+    """
+    changed = Stock.refresh_search_documents(list(Stock.objects.filter(**lookup).values_list("id", flat=True)))
+    return {'status': "success", 'detail': f"{changed} search documents rebuilt"}
+
+
+@shared_task()
+def release_expired_reservations():
+    """
+    Deletes cart positions whose reservation has expired and returns their quantities to stocks.
+    Expired positions are found by index on reserved_until and released in batches:
+    quantities of every batch are returned to stocks with single UPDATE.
+    Positions locked by concurrent cart requests are left to the next sweep
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            positions = list(
+                CartPosition.objects.select_for_update(skip_locked=True)
+                .filter(reserved_until__lt=timezone.now())
+                .order_by("reserved_until")
+                .values_list("id", "stock_id", "quantity")[:settings.CART_SWEEP_BATCH_SIZE]
+            )
+            quantities = defaultdict(int)
+            for position_id, stock_id, quantity in positions:
+                quantities[stock_id] += quantity
+            Stock.release_many(quantities)
+            CartPosition.objects.filter(id__in=[position[0] for position in positions]).delete()
+        released += len(positions)
+        if len(positions) < settings.CART_SWEEP_BATCH_SIZE:
+            break
+    return {'status': "success", 'detail': f"{released} expired cart positions released"}
+
+
+class ImportProgress:
     """
-    Performs import of stocks from file with determinated structure
+    Class to publish progress of import as PROGRESS state of celery task
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.write_started = None
+        self.rows_parsed = 0
+
+    def count(self, goods):
+        """
+        Counts goods parsed from import file
+        :param goods: iterable of goods
+        :return: generator of the same goods
+        """
+        for good in goods:
+            self.rows_parsed += 1
+            yield good
+
+    def start_writing(self):
+        """
+        Starts timing of writing of parsed goods, download and parsing of import file are not included
+        """
+        self.write_started = time.monotonic()
+
+    def __call__(self, rows_written):
+        """
+        Publishes numbers of parsed and written rows, throughput and estimated time to the end of import.
+        Throughput is measured from start of writing, ETA is estimated from share of parsed rows already written
+        """
+        if self.task.request.called_directly or self.task.request.is_eager:
+            return
+        elapsed = time.monotonic() - self.write_started if self.write_started else 0
+        eta = None
+        if elapsed and rows_written:
+            eta = round(elapsed * max(self.rows_parsed - rows_written, 0) / rows_written, 1)
+        self.task.update_state(
+            state="PROGRESS",
+            meta={
+                "rows_parsed": self.rows_parsed,
+                "rows_written": rows_written,
+                "rows_per_second": round(rows_written / elapsed, 1) if elapsed else 0,
+                "eta_seconds": eta,
+            },
+        )
+
+
+@shared_task(bind=True)
+def do_import(self, url, user_id=None, delta=None):
+    """
+    Performs import of stocks from file with determinated structure.
+    In delta mode only new, changed and vanished stocks are written, and import is skipped at all
+    if price list is not modified since last successful import from the same URL.
+    Imports of the same supplier never overlap.
+    Progress of import is published as PROGRESS state of the task
     """
 
     url_validator = URLValidator()
@@ -30,74 +206,240 @@ def do_import(url, user_id=None):
     except ValidationError:
         return {'status': 'fail', "detail": 'Enter a valid URL.'}
 
-    import_file = requests.get(url).content
-    data = yaml.load(import_file, Loader=yaml.FullLoader)
-
+    delta = settings.IMPORT_DELTA if delta is None else delta
+    source = find_import_source(url, user_id) if delta else None
+    headers = source.conditional_headers if source else {}
     try:
-        if user_id:
-            supplier, created = Supplier.objects.get_or_create(
-                user__id=user_id, name=data["shop"]
-            )
-        else:
-            if not Supplier.objects.filter(name=data["shop"]).exists():
-                return {'status': 'fail', "detail": "Indicted supplier does not exist"}
-            supplier = Supplier.objects.get(name=data["shop"])
-    except IntegrityError:
-        return {'status': 'fail', "detail": "Request user already refers to another supplier instance"}
-
-    for category in data["categories"]:
+        with requests.get(url, headers=headers, stream=True, timeout=settings.IMPORT_REQUEST_TIMEOUT) as response:
+            if response.status_code == 304:
+                return {'status': "success", "detail": "Import file is not modified since last import", 'skipped': True}
+            if response.status_code != 200:
+                return {'status': 'fail', "detail": f"Import file could not be downloaded: HTTP {response.status_code}"}
+            import_file, content_hash = download(response)
+    except requests.RequestException as error:
+        return {'status': 'fail', "detail": f"Import file could not be downloaded: {error}"}
+    except ImportFailed as error:
+        return {'status': 'fail', "detail": str(error)}
+    fetched = {
+        "url": url,
+        "etag": response.headers.get("ETag", ""),
+        "last_modified": response.headers.get("Last-Modified", ""),
+        "content_hash": content_hash,
+    }
+    if source and source.content_hash == content_hash:
+        ImportSource.objects.filter(id=source.id).update(etag=fetched["etag"], last_modified=fetched["last_modified"])
+        return {'status': "success", "detail": "Import file content is not changed since last import", 'skipped': True}
+
+    with import_file:
+        progress = ImportProgress(self)
         try:
-            category_instance, created = Category.objects.get_or_create(
-                id=category["id"], name=category["name"]
-            )
-            category_instance.suppliers.add(supplier.id)
-            category_instance.save()
-        except IntegrityError:
-            return {'status': 'fail', "detail": "Category with id from your file already exists with another name"}
+            data = read_file(import_file, url, response.headers.get("Content-Type"))
+        except ImportFailed as error:
+            return {'status': 'fail', "detail": str(error)}
+        lock = self.request.id or str(uuid.uuid4())
+        suppliers = Supplier.objects.filter(user_id=user_id) if user_id else Supplier.objects.filter(name=data["shop"])
+        supplier_id = suppliers.values_list("id", flat=True).first()
+        if supplier_id and not lock_supplier(supplier_id, lock):
+            return {'status': 'fail', "detail": "Import of this supplier is already in progress"}
+        dispatched = False
+        try:
+            try:
+                chunks = batched(progress.count(data["goods"]), settings.IMPORT_CHUNK_SIZE)
+                first_chunk = next(chunks, [])
+                second_chunk = next(chunks, None)
+            except ImportFailed as error:
+                return {'status': 'fail', "detail": str(error)}
+            importer = StockImporter(user_id, delta=delta, on_progress=progress)
+            if second_chunk is None:
+                data["goods"] = first_chunk
+                progress.start_writing()
+                result = importer.run(data)
+                if importer.supplier:
+                    result["supplier_id"] = importer.supplier.id
+                if result["status"] == "success":
+                    save_import_source(importer.supplier.id, fetched)
+                return result
+            result = import_in_chunks(importer, data, chain([first_chunk, second_chunk], chunks), fetched, lock)
+            dispatched = result["status"] == "processing"
+            return result
+        finally:
+            if supplier_id and not dispatched:
+                unlock_supplier(supplier_id, lock)
 
-    for db_stock in Stock.objects.filter(supplier=supplier.id):
-        db_stock.quantity = 0
-        db_stock.save()
 
-    for import_stock in data["goods"]:
-        try:
-            product, created = Product.objects.get_or_create(
-                name=import_stock["name"],
-                category=Category.objects.get(id=import_stock["category"]),
-            )
+def find_import_source(url, user_id=None):
+    """
+    Finds state of price list at indicated URL saved at last successful import.
+    Import without user refers to any supplier, whose price list is located at this URL
+    :return: ImportSource instance or None
+    """
+    sources = ImportSource.objects.filter(url=url)
+    if user_id:
+        sources = sources.filter(supplier__user_id=user_id)
+    return sources.order_by("-imported_at").first()
 
-        except MultipleObjectsReturned:
-            product = Product.objects.filter(
-                name=import_stock["name"], category__id=import_stock["category"]
-            ).first()
-        if Stock.objects.filter(
-            sku=import_stock["id"], product=product.id, supplier=supplier.id
-        ).exists():
-            stock = Stock.objects.get(
-                sku=import_stock["id"], product=product.id, supplier=supplier.id
-            )
-            stock.model = import_stock["model"]
-            stock.price = import_stock["price"]
-            stock.price_rrc = import_stock["price_rrc"]
-            stock.quantity = import_stock["quantity"]
-            stock.save()
-            ProductCharacteristic.objects.filter(stock=stock.id).delete()
-        else:
-            stock = Stock.objects.create(
-                sku=import_stock["id"],
-                model=import_stock.get("model"),
-                product=product,
-                supplier=supplier,
-                price=import_stock["price"],
-                price_rrc=import_stock["price_rrc"],
-                quantity=import_stock["quantity"],
-            )
-        for name, value in import_stock["parameters"].items():
-            characteristic, created = Characteristic.objects.get_or_create(
-                name=name
-            )
-            ProductCharacteristic.objects.create(
-                characteristic=characteristic, stock=stock, value=value
+
+def save_import_source(supplier_id, fetched):
+    """
+    Saves ETag, Last-Modified and SHA-256 of successfully imported price list
+    :param supplier_id: id of supplier
+    :param fetched: dict with "url", "etag", "last_modified" and "content_hash" keys
+    """
+    fetched = dict(fetched, imported_at=timezone.now())
+    ImportSource.objects.update_or_create(supplier_id=supplier_id, url=fetched.pop("url"), defaults=fetched)
+
+
+@shared_task()
+def schedule_imports():
+    """
+    Enqueues imports of price lists due to refresh according to their refresh interval.
+    Imports are staggered evenly over the period of beat schedule, and at most IMPORT_SCHEDULE_LIMIT
+    imports are enqueued at once, so that refresh of many suppliers does not hit workers simultaneously.
+    Price lists of suppliers being imported at the moment wait for the next period.
+    Chunks of imports which did not finish within IMPORT_LOCK_TIMEOUT are deleted
+    """
+    now = timezone.now()
+    ImportChunk.objects.filter(created_at__lt=now - timedelta(seconds=settings.IMPORT_LOCK_TIMEOUT)).delete()
+    with transaction.atomic():
+        sources = list(
+            ImportSource.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("supplier")
+            .filter(Q(next_import_at__isnull=True) | Q(next_import_at__lte=now), refresh_interval__isnull=False)
+            .exclude(supplier__import_locked_until__gt=now)
+            .order_by("next_import_at")[:settings.IMPORT_SCHEDULE_LIMIT]
+        )
+        for source in sources:
+            source.next_import_at = now + timedelta(minutes=source.refresh_interval)
+        ImportSource.objects.bulk_update(sources, ["next_import_at"])
+    spacing = settings.IMPORT_SCHEDULE_PERIOD / len(sources) if sources else 0
+    for number, source in enumerate(sources):
+        do_import.apply_async((source.url, source.supplier.user_id), countdown=round(number * spacing, 1))
+    return {'status': "success", 'detail': f"{len(sources)} imports scheduled"}
+
+
+def import_in_chunks(importer, data, chunks, fetched=None, lock=None):
+    """
+    Imports supplier and categories, stages chunks of goods in database one by one
+    and fans out a group of import_chunk tasks receiving ids of staged chunks.
+    Goods are validated only by import_chunk tasks. Results of chunks are merged by finish_import callback of the chord
+    :return: dict with ids of group and callback to check progress of import
+    """
+    failure = importer.prepare(data)
+    if failure:
+        return failure
+    import_id = lock or str(uuid.uuid4())
+    header = []
+    first_row = 1
+    try:
+        for chunk in chunks:
+            staged = ImportChunk.objects.create(
+                import_id=import_id, supplier=importer.supplier, first_row=first_row, goods=chunk
             )
+            header.append(import_chunk.s(importer.supplier.id, staged.id, importer.delta))
+            first_row += len(chunk)
+            if importer.on_progress:
+                importer.on_progress(0)
+    except ImportFailed as error:
+        header.append(import_chunk.s(importer.supplier.id, None, importer.delta, str(error)))
+
+    result = chord(header, finish_import.s(importer.supplier.id, fetched, lock, import_id)).apply_async()
+    if result.parent:
+        result.parent.save()
+    return {
+        'status': "processing",
+        'detail': f"Import is split into {len(header)} chunks",
+        'chunks_total': len(header),
+        'group_id': result.parent.id if result.parent else None,
+        'callback_id': result.id,
+    }
+
+
+@shared_task()
+def import_chunk(supplier_id, chunk_id, delta, error=None):
+    """
+    Performs import of staged chunk of goods for indicated supplier and deletes the chunk
+    """
+    importer = StockImporter(supplier_id=supplier_id, delta=delta)
+    chunk = ImportChunk.objects.filter(id=chunk_id).first() if chunk_id else None
+    if chunk is None:
+        return importer.run_chunk([], error=error or "Import chunk does not exist")
+    try:
+        return importer.run_chunk(chunk.goods, chunk.first_row)
+    finally:
+        ImportChunk.objects.filter(id=chunk_id).delete()
+
+
+@shared_task()
+def finish_import(results, supplier_id, fetched=None, lock=None, import_id=None):
+    """
+    Merges results of chunks and sets to zero quantity of supplier stocks absent in import file.
+    State of successfully imported price list is saved for conditional fetch, chunks left staged are deleted
+    and lock of supplier import is released
+    """
+    if import_id:
+        ImportChunk.objects.filter(import_id=import_id).delete()
+    try:
+        result = StockImporter(supplier_id=supplier_id).finish(results)
+        result["supplier_id"] = supplier_id
+        if fetched and result["status"] == "success":
+            save_import_source(supplier_id, fetched)
+        return result
+    finally:
+        if lock:
+            unlock_supplier(supplier_id, lock)
 
-    return {'status': "success", 'detail': "Import or update performed successfully"}
+
+@shared_task(bind=True)
+def do_export(self, user_id, export_format="yaml", suppliers=None, categories=None, since=None, compress=False):
+    """
+    Performs streaming export of stocks to file, which may be downloaded by user who requested export.
+    Supplier user exports only stocks of own supplier instance
+    """
+
+    user = User.objects.filter(id=user_id).first()
+    if not user:
+        return {'status': 'fail', "detail": "User does not exist"}
+    if not user.is_superuser:
+        supplier_id = Supplier.objects.filter(user=user).values_list("id", flat=True).first()
+        if not supplier_id:
+            return {'status': 'fail', "detail": "you need to create Supplier before you export stocks"}
+        suppliers = [supplier_id]
+
+    task_id = self.request.id or str(uuid.uuid4())
+    file_name = f"{task_id}-{default_path(export_format, compress)}"
+    path = os.path.join(settings.EXPORT_ROOT, file_name)
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    exporter = StockExporter(
+        export_format, suppliers, categories, since=parse_datetime(since) if since else None
+    )
+    try:
+        count = exporter.export(f"{path}.part", compress)
+        os.replace(f"{path}.part", path)
+    finally:
+        if os.path.exists(f"{path}.part"):
+            os.remove(f"{path}.part")
+    return {
+        'status': "success",
+        'detail': f"{count} goods exported",
+        'count': count,
+        'file': file_name,
+        'exported_at': exporter.exported_at.isoformat(),
+        'user_id': user_id,
+    }
+
+
+@shared_task()
+def clean_exports():
+    """
+    Deletes export files older than EXPORT_FILE_TTL seconds
+    """
+    if not os.path.isdir(settings.EXPORT_ROOT):
+        return {'status': "success", 'detail': "0 export files deleted"}
+    expired = time.time() - settings.EXPORT_FILE_TTL
+    deleted = 0
+    with os.scandir(settings.EXPORT_ROOT) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+                deleted += 1
+    return {'status': "success", 'detail': f"{deleted} export files deleted"}
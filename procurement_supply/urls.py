@@ -18,14 +18,18 @@ from django.urls import path
 from rest_framework.authtoken.views import obtain_auth_token
 from rest_framework.routers import DefaultRouter
 
-from procurement_supply.views import (CartPositionViewSet, CategoryViewSet,
+from procurement_supply.views import (CartPositionBulkView,
+                                      CartPositionViewSet, CategoryViewSet,
                                       ChainStoreViewSet, CharacteristicViewSet,
                                       ImportView, OrderPositionViewSet,
                                       OrderViewSet, PasswordResetView,
                                       ProductCharacteristicViewSet,
                                       ProductViewSet, PurchaserViewSet,
                                       ShoppingCartViewSet, StockViewSet,
-                                      SupplierViewSet, UserViewSet, ImportCheckView)
+                                      SupplierViewSet, UserViewSet, ImportCheckView,
+                                      ImportReportView, ImportSourceViewSet,
+                                      ExportView, ExportCheckView,
+                                      ExportDownloadView, OrderPositionBulkView)
 
 app_name = "procurement_supply"
 r = DefaultRouter()
@@ -42,9 +46,16 @@ r.register("shopping_carts", ShoppingCartViewSet)
 r.register("chain_stores", ChainStoreViewSet)
 r.register("orders", OrderViewSet)
 r.register("order_positions", OrderPositionViewSet)
+r.register("import_sources", ImportSourceViewSet)
 urlpatterns = [
     path("authorize/", obtain_auth_token),
     path("password_reset/", PasswordResetView.as_view()),
     path("import/", ImportView.as_view()),
     path("import/<str:task_id>/", ImportCheckView.as_view()),
+    path("import/<str:task_id>/report/", ImportReportView.as_view()),
+    path("export/", ExportView.as_view()),
+    path("export/<str:task_id>/", ExportCheckView.as_view()),
+    path("export/<str:task_id>/download/", ExportDownloadView.as_view()),
+    path("cart_positions/bulk/", CartPositionBulkView.as_view()),
+    path("order_positions/bulk/", OrderPositionBulkView.as_view()),
 ] + r.urls
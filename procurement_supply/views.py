@@ -1,22 +1,38 @@
+import csv
+import os
 from uuid import UUID
 
+from django.conf import settings
 from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.password_validation import validate_password
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from django.db.models.query import QuerySet
+from django.http import FileResponse, HttpResponse
+from django.shortcuts import get_object_or_404
 from rest_framework import status
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from celery.result import AsyncResult
+from celery.result import AsyncResult, GroupResult
+from django_filters.rest_framework import DjangoFilterBackend
 
 from order_service.celery import app as celery_app
-from procurement_supply.tasks import send_email, do_import
+from procurement_supply.filters import OrderFilter, StockSearchFilter
+from procurement_supply.pagination import OptionalKeysetPagination
+from procurement_supply.tasks import send_email, do_import, do_export
 from procurement_supply.models import (CartPosition, Category, ChainStore,
-                                       Characteristic, Order, OrderPosition,
-                                       PasswordResetToken, Product,
+                                       Characteristic, ImportSource,
+                                       Notification, Order, OrderPosition,
+                                       PasswordResetToken,
+                                       Product,
                                        ProductCharacteristic, Purchaser,
-                                       ShoppingCart, Stock, Supplier, User)
+                                       ShoppingCart, Stock, Supplier, User,
+                                       characteristics_prefetch,
+                                       reservation_deadline)
 from procurement_supply.permissions import (IsAdmin, IsCartPositionOwner,
                                             IsCartStockOwner,
                                             IsOrderPositionOwner,
@@ -25,11 +41,15 @@ from procurement_supply.permissions import (IsAdmin, IsCartPositionOwner,
                                             IsStockOwner,
                                             IsStockReferencedOwner, IsSupplier,
                                             IsUser)
-from procurement_supply.serializers import (CartPositionSerializer,
+from procurement_supply.serializers import (CartPositionBulkSerializer,
+                                            CartPositionSerializer,
                                             CategorySerializer,
                                             ChainStoreSerializer,
                                             CharacteristicSerializer,
+                                            ExportSerializer,
+                                            ImportSourceSerializer,
                                             OrderCreateSerializer,
+                                            OrderPositionBulkSerializer,
                                             OrderPositionSerializer,
                                             OrderSerializer,
                                             ProductCharacteristicSerializer,
@@ -40,6 +60,15 @@ from procurement_supply.serializers import (CartPositionSerializer,
                                             SupplierSerializer, UserSerializer)
 
 
+def restored_stocks(quantities):
+    """
+    Returns quantities returned to stocks in format of response
+    :param quantities: dict of quantities by stock id
+    :return: list of dicts with "stock" and "quantity" keys ordered by stock id
+    """
+    return [{"stock": stock_id, "quantity": quantity} for stock_id, quantity in sorted(quantities.items())]
+
+
 class UserViewSet(ModelViewSet):
     """
     ViewSet class to provide CRUD operations with user instances
@@ -334,6 +363,90 @@ class SupplierViewSet(ModelViewSet):
         return super().update(request, *args, **kwargs)
 
 
+class ImportSourceViewSet(ModelViewSet):
+    """
+    ViewSet class to provide CRUD operations with import source instances.
+    Import sources with refresh interval are imported periodically
+    """
+    queryset = ImportSource.objects.select_related("supplier")
+    serializer_class = ImportSourceSerializer
+    http_method_names = ["post", "patch", "get", "delete"]
+
+    def get_queryset(self):
+        """
+        Get the list of import source items for view.
+        """
+
+        assert self.queryset is not None, (
+            "'%s' should either include a `queryset` attribute, "
+            "or override the `get_queryset()` method." % self.__class__.__name__
+        )
+
+        queryset = self.queryset
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.all()
+        if self.request.user.is_superuser:
+            return queryset
+        if self.request.user.type == "supplier":
+            return queryset.filter(supplier__user=self.request.user)
+        return queryset.none()
+
+    def get_permissions(self):
+        """
+        Instantiates and returns the list of permissions that this view requires.
+        """
+
+        if self.action == "list":
+            return [IsAuthenticated()]
+        if self.action in ["retrieve", "update", "partial_update", "destroy"]:
+            ObjectPerm = IsAdmin | IsStockOwner
+            return [ObjectPerm()]
+        if self.action == "create":
+            return [IsSupplier()]
+        return []
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create an import source instance.
+        """
+
+        supplier = Supplier.objects.filter(user=request.user).first()
+        if not supplier:
+            return Response(
+                {
+                    "error": "you need to create Supplier before you create ImportSource"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if ImportSource.objects.filter(supplier=supplier, url=request.data.get("url")).exists():
+            return Response(
+                {"error": "Import source with this url already exists"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        request.data["supplier"] = supplier.id
+        return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        """
+        Update an import source instance.
+        """
+
+        instance = self.get_object()
+        if "supplier" in request.data:
+            return Response(
+                {"error": "supplier cannot be amended"}, status=status.HTTP_403_FORBIDDEN
+            )
+        if (
+            request.data.get("url", instance.url) != instance.url
+            and ImportSource.objects.filter(supplier=instance.supplier, url=request.data["url"]).exists()
+        ):
+            return Response(
+                {"error": "Import source with this url already exists"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return super().update(request, *args, **kwargs)
+
+
 class CategoryViewSet(ModelViewSet):
     """
     ViewSet class to provide CRUD operations with category instances
@@ -415,6 +528,9 @@ class StockViewSet(ModelViewSet):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
     http_method_names = ["post", "patch", "get", "delete"]
+    pagination_class = OptionalKeysetPagination
+    cursor_ordering = ("product_id", "price", "id")
+    filter_backends = [DjangoFilterBackend, StockSearchFilter]
     filterset_fields = [
         "product__id",
         "product__name",
@@ -423,15 +539,6 @@ class StockViewSet(ModelViewSet):
         "supplier__id",
         "supplier__name",
     ]
-    search_fields = [
-        "description",
-        "model",
-        "product__name",
-        "product__category__name",
-        "supplier__name",
-        "supplier__address",
-        "product_characteristics__value",
-    ]
 
     def get_queryset(self):
         """
@@ -447,20 +554,16 @@ class StockViewSet(ModelViewSet):
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
         if self.request.user.is_superuser:
-            return queryset.select_related("product").prefetch_related(
-                "product_characteristics", "product"
-            )
+            return queryset.prefetch_related(characteristics_prefetch())
         if self.request.user.type == "purchaser":
             return (
                 queryset.filter(supplier__order_status=True, quantity__gt=0)
-                .select_related("product")
-                .prefetch_related("product_characteristics", "product")
+                .prefetch_related(characteristics_prefetch())
             )
         if self.request.user.type == "supplier":
             return (
                 queryset.filter(supplier__user=self.request.user)
-                .select_related("product")
-                .prefetch_related("product_characteristics", "product")
+                .prefetch_related(characteristics_prefetch())
             )
 
     def get_permissions(self):
@@ -624,8 +727,11 @@ class ImportView(APIView):
                 status.HTTP_403_FORBIDDEN,
             )
         url = request.data.get("url")
+        delta = request.data.get("delta")
+        if delta is not None and type(delta) != bool:
+            return Response({"delta": ["Must be a valid boolean."]}, status.HTTP_400_BAD_REQUEST)
         if url:
-            async_result = do_import.delay(url, request.user.id)
+            async_result = do_import.delay(url, request.user.id, delta)
             return Response({"detail": f"Your task id is {async_result.task_id}"}, status.HTTP_200_OK)
         return Response({"url": ["This field is required."]}, status.HTTP_400_BAD_REQUEST)
 
@@ -650,8 +756,186 @@ class ImportCheckView(APIView):
                 status.HTTP_403_FORBIDDEN,
             )
         result = AsyncResult(task_id, app=celery_app)
+        if isinstance(result.result, dict) and result.result.get("callback_id"):
+            return Response(self.get_chunks_progress(result.result), status.HTTP_200_OK)
         return Response({"status": result.status, 'result': result.result}, status.HTTP_200_OK)
 
+    @staticmethod
+    def get_chunks_progress(meta):
+        """
+        Collects status and result of import split into chunks and its aggregated progress
+        :param meta: result of import task with ids of chunks group and callback
+        :return: dict with status, result and progress of import
+        """
+        callback = AsyncResult(meta["callback_id"], app=celery_app)
+        chunks_done = rows_processed = 0
+        group = GroupResult.restore(meta["group_id"], app=celery_app) if meta.get("group_id") else None
+        if group:
+            for chunk in group.results:
+                if chunk.ready():
+                    chunks_done += 1
+                    if chunk.successful():
+                        rows_processed += chunk.result.get("rows", 0)
+        elif callback.ready():
+            chunks_done = meta["chunks_total"]
+        return {
+            "status": callback.status,
+            "result": callback.result,
+            "progress": {
+                "chunks_done": chunks_done,
+                "chunks_total": meta["chunks_total"],
+                "rows_processed": rows_processed,
+            },
+        }
+
+
+class ImportReportView(APIView):
+    """
+    APIView class to download report on invalid goods skipped by stocks import operations
+    """
+
+    def get(self, request, task_id):
+        """
+        Returns CSV file with row number, sku and errors of every invalid good of finished import
+        for authenticated supplier or admin user
+        """
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Authentication credentials were not provided."},
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        if not request.user.type == "supplier" and not request.user.is_superuser:
+            return Response(
+                {"detail": "You do not have permission to perform this action."},
+                status.HTTP_403_FORBIDDEN,
+            )
+        result = AsyncResult(task_id, app=celery_app).result
+        if isinstance(result, dict) and result.get("callback_id"):
+            result = AsyncResult(result["callback_id"], app=celery_app).result
+        if not isinstance(result, dict) or "errors" not in result or not self.is_available(request.user, result):
+            return Response(
+                {"error": "Import is not finished or task does not exist"},
+                status.HTTP_404_NOT_FOUND,
+            )
+
+        response = HttpResponse(content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="import_{task_id}_report.csv"'
+        writer = csv.writer(response)
+        writer.writerow(["row", "sku", "errors"])
+        for error in result["errors"]:
+            writer.writerow([error["row"], error["sku"], "; ".join(error["errors"])])
+        return response
+
+    @staticmethod
+    def is_available(user, result):
+        """
+        Checks whether report of finished import may be seen by user: admin sees all reports,
+        supplier user sees only reports of imports of own supplier instance
+        """
+        if user.is_superuser:
+            return True
+        return Supplier.objects.filter(user=user, id=result.get("supplier_id")).exists()
+
+
+class ExportView(APIView):
+    """
+    APIView class to perform stocks export operations
+    """
+
+    def post(self, request):
+        """
+        Method to arrange export of stocks to file in requested format. Supplier exports only own stocks
+        :param request: request object
+        :return: response with corresponding status code
+        """
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Authentication credentials were not provided."},
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        if not request.user.type == "supplier" and not request.user.is_superuser:
+            return Response(
+                {"detail": "You do not have permission to perform this action."},
+                status.HTTP_403_FORBIDDEN,
+            )
+        serializer = ExportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        async_result = do_export.delay(
+            request.user.id,
+            data["format"],
+            data.get("suppliers"),
+            data.get("categories"),
+            data["since"].isoformat() if data.get("since") else None,
+            data["gzip"],
+        )
+        return Response({"detail": f"Your task id is {async_result.task_id}"}, status.HTTP_200_OK)
+
+
+class ExportCheckView(APIView):
+    """
+    APIView class to get result of stocks export operations
+    """
+
+    def get(self, request, task_id):
+        """
+        Checks status and result of celery-task fulfilment for user who requested export or admin user
+        """
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Authentication credentials were not provided."},
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        if not request.user.type == "supplier" and not request.user.is_superuser:
+            return Response(
+                {"detail": "You do not have permission to perform this action."},
+                status.HTTP_403_FORBIDDEN,
+            )
+        result = AsyncResult(task_id, app=celery_app)
+        if not self.is_available(request.user, result.result):
+            return Response({"status": "PENDING", "result": None}, status.HTTP_200_OK)
+        return Response({"status": result.status, "result": result.result}, status.HTTP_200_OK)
+
+    @staticmethod
+    def is_available(user, result):
+        """
+        Checks whether result of finished export may be seen by user
+        """
+        if not isinstance(result, dict):
+            return result is None or user.is_superuser
+        return user.is_superuser or result.get("user_id") == user.id
+
+
+class ExportDownloadView(APIView):
+    """
+    APIView class to download file of finished stocks export
+    """
+
+    def get(self, request, task_id):
+        """
+        Streams export file to user who requested export or admin user
+        """
+        if not request.user.is_authenticated:
+            return Response(
+                {"detail": "Authentication credentials were not provided."},
+                status.HTTP_401_UNAUTHORIZED,
+            )
+        if not request.user.type == "supplier" and not request.user.is_superuser:
+            return Response(
+                {"detail": "You do not have permission to perform this action."},
+                status.HTTP_403_FORBIDDEN,
+            )
+        result = AsyncResult(task_id, app=celery_app).result
+        path = None
+        if isinstance(result, dict) and result.get("file") and ExportCheckView.is_available(request.user, result):
+            path = os.path.join(settings.EXPORT_ROOT, os.path.basename(result["file"]))
+        if not path or not os.path.exists(path):
+            return Response(
+                {"error": "Export is not finished, expired or task does not exist"},
+                status.HTTP_404_NOT_FOUND,
+            )
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=result["file"])
+
 
 class PurchaserViewSet(ModelViewSet):
     """
@@ -675,11 +959,11 @@ class PurchaserViewSet(ModelViewSet):
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
         if self.request.user.is_superuser:
-            return queryset.prefetch_related("chain_stores")
+            return queryset.select_related("shopping_cart").prefetch_related("chain_stores")
         if self.request.user.type == "purchaser":
-            return queryset.filter(user=self.request.user.id).prefetch_related(
-                "chain_stores"
-            )
+            return queryset.filter(user=self.request.user.id).select_related(
+                "shopping_cart"
+            ).prefetch_related("chain_stores")
 
     def get_permissions(self):
         """
@@ -748,6 +1032,7 @@ class ShoppingCartViewSet(ModelViewSet):
         queryset = self.queryset
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
+        queryset = queryset.with_totals()
         if self.request.user.is_superuser:
             return queryset.prefetch_related("cart_positions")
         if self.request.user.type == "purchaser":
@@ -755,11 +1040,11 @@ class ShoppingCartViewSet(ModelViewSet):
                 "cart_positions"
             )
         if self.request.user.type == "supplier":
-            return (
-                queryset.filter(cart_positions__stock__supplier__user=self.request.user)
-                .distinct()
-                .prefetch_related("cart_positions")
-            )
+            return queryset.filter(
+                id__in=CartPosition.objects.filter(
+                    stock__supplier__user=self.request.user
+                ).values("shopping_cart")
+            ).prefetch_related("cart_positions")
 
     def get_permissions(self):
         """
@@ -777,16 +1062,24 @@ class ShoppingCartViewSet(ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         """
-        Delete all positions from shopping cart
+        Delete all positions from shopping cart and return their quantities to stocks with single UPDATE
+        in one transaction
         """
 
-        cart_positions = CartPosition.objects.filter(shopping_cart=self.get_object())
-        for position in cart_positions:
-            stock = Stock.objects.get(id=position.stock.id)
-            stock.quantity += position.quantity
-            stock.save()
-        cart_positions.delete()
-        return Response({"success": f"Your shopping cart is empty"}, status.HTTP_200_OK)
+        shopping_cart = self.get_object()
+        with transaction.atomic():
+            positions = list(
+                CartPosition.objects.select_for_update()
+                .filter(shopping_cart=shopping_cart)
+                .values_list("id", "stock_id", "quantity")
+            )
+            restored = {stock_id: quantity for _, stock_id, quantity in positions}
+            Stock.release_many(restored)
+            CartPosition.objects.filter(id__in=[position_id for position_id, _, _ in positions]).delete()
+        return Response(
+            {"success": f"Your shopping cart is empty", "restored": restored_stocks(restored)},
+            status.HTTP_200_OK,
+        )
 
 
 class CartPositionViewSet(ModelViewSet):
@@ -866,15 +1159,20 @@ class CartPositionViewSet(ModelViewSet):
                     {"quantity": ["Ensure this value is integer and greater than 0."]},
                     status.HTTP_400_BAD_REQUEST,
                 )
-            if request.data["quantity"] > stock.quantity:
+            try:
+                with transaction.atomic():
+                    if not Stock.reserve(stock.id, request.data["quantity"]):
+                        stock.refresh_from_db(fields=["quantity"])
+                        return Response(
+                            {"error": f"Not enough stock. Only {stock.quantity} is available"},
+                            status.HTTP_400_BAD_REQUEST,
+                        )
+                    return super().create(request, *args, **kwargs)
+            except IntegrityError:
                 return Response(
-                    {"error": f"Not enough stock. Only {stock.quantity} is available"},
+                    {"error": f"You already have this product in your cart"},
                     status.HTTP_400_BAD_REQUEST,
                 )
-            else:
-                stock.quantity = stock.quantity - request.data["quantity"]
-                stock.save()
-            return super().create(request, *args, **kwargs)
         else:
             return Response(
                 {"error": f'Fields "stock" and "quantity" are required'},
@@ -883,14 +1181,22 @@ class CartPositionViewSet(ModelViewSet):
 
     def destroy(self, request, *args, **kwargs):
         """
-        Destroy a cart position instance.
+        Destroy a cart position instance and return its quantity to stock.
         """
 
+        with transaction.atomic():
+            cart_position = self.lock_object()
+            Stock.release(cart_position.stock_id, cart_position.quantity)
+            cart_position.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def lock_object(self):
+        """
+        Returns cart position of request locked till the end of transaction,
+        so that concurrent requests change its quantity one after another
+        """
         cart_position = self.get_object()
-        stock = Stock.objects.get(id=cart_position.stock.id)
-        stock.quantity += cart_position.quantity
-        stock.save()
-        return super().destroy(request, *args, **kwargs)
+        return get_object_or_404(CartPosition.objects.select_for_update(), id=cart_position.id)
 
     def update(self, request, *args, **kwargs):
         """
@@ -912,34 +1218,149 @@ class CartPositionViewSet(ModelViewSet):
                     {"quantity": ["Ensure this value is integer and greater than 0."]},
                     status.HTTP_400_BAD_REQUEST,
                 )
-            cart_position = self.get_object()
-            stock = Stock.objects.get(id=cart_position.stock.id)
+            with transaction.atomic():
+                cart_position = self.lock_object()
+                stock = Stock.objects.select_related("supplier").get(id=cart_position.stock_id)
+
+                if request.data["quantity"] < cart_position.quantity:
+                    Stock.release(stock.id, cart_position.quantity - request.data["quantity"])
+                elif request.data["quantity"] > cart_position.quantity:
+                    if not stock.supplier.order_status:
+                        return Response(
+                            {
+                                "error": f"This supplier does not take new orders at the moment"
+                            },
+                            status.HTTP_400_BAD_REQUEST,
+                        )
+                    if Stock.reserve(stock.id, request.data["quantity"] - cart_position.quantity):
+                        request.data["price"] = stock.price
+                    else:
+                        stock.refresh_from_db(fields=["quantity"])
+                        return Response(
+                            {
+                                "error": f"Not enough stock. You can add only {stock.quantity} to your initial quantity"
+                            },
+                            status.HTTP_400_BAD_REQUEST,
+                        )
+                CartPosition.objects.filter(id=cart_position.id).update(reserved_until=reservation_deadline())
+                return super().update(request, *args, **kwargs)
+        return super().update(request, *args, **kwargs)
 
-            if request.data["quantity"] <= cart_position.quantity:
-                stock.quantity += cart_position.quantity - request.data["quantity"]
-                stock.save()
-            else:
-                if not stock.supplier.order_status:
-                    return Response(
-                        {
-                            "error": f"This supplier does not take new orders at the moment"
-                        },
-                        status.HTTP_400_BAD_REQUEST,
+
+class CartPositionBulkView(APIView):
+    """
+    APIView class to add, update and remove many cart positions with one request
+    """
+
+    permission_classes = [IsPurchaser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Sets quantities of cart positions of indicated stocks, zero quantity removes position from cart.
+        Stocks are read and locked with one query, operations are checked one by one and applied with bulk queries
+        in single transaction, so that number of queries does not depend on number of positions.
+        Operations with errors are skipped, result of every operation is returned
+        """
+
+        serializer = CartPositionBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        purchaser = Purchaser.objects.select_related("shopping_cart").filter(user=request.user).first()
+        if not purchaser:
+            return Response(
+                {
+                    "error": "You need to create Purchaser and ShoppingCart will be created as well"
+                },
+                status.HTTP_400_BAD_REQUEST,
+            )
+        shopping_cart = purchaser.shopping_cart
+        operations = serializer.validated_data["positions"]
+        stock_ids = {operation["stock"] for operation in operations}
+
+        results = []
+        saved = []
+        with transaction.atomic():
+            positions = {
+                position.stock_id: position
+                for position in CartPosition.objects.select_for_update().filter(
+                    shopping_cart=shopping_cart, stock_id__in=stock_ids
+                )
+            }
+            stocks = {
+                stock.id: stock
+                for stock in Stock.objects.select_for_update(of=("self",))
+                .select_related("supplier")
+                .filter(id__in=stock_ids)
+                .order_by("id")
+            }
+            reserved = {}
+            processed = set()
+            created, updated, deleted = [], [], []
+            for operation in operations:
+                stock_id, quantity = operation["stock"], operation["quantity"]
+                result = {"stock": stock_id, "quantity": quantity}
+                results.append(result)
+                position = positions.get(stock_id)
+                error = self.check_operation(stocks.get(stock_id), position, quantity, stock_id in processed)
+                processed.add(stock_id)
+                if error:
+                    result.update(status="error", error=error)
+                    continue
+
+                stock = stocks[stock_id]
+                difference = quantity - (position.quantity if position else 0)
+                reserved[stock_id] = difference
+                stock.quantity -= difference
+                if not quantity:
+                    deleted.append(position.id)
+                    result.update(status="deleted", id=position.id)
+                    continue
+                if not position:
+                    position = CartPosition(
+                        shopping_cart=shopping_cart, stock=stock, quantity=quantity, price=stock.price
                     )
-                if stock.quantity >= (
-                    request.data["quantity"] - cart_position.quantity
-                ):
-                    stock.quantity -= request.data["quantity"] - cart_position.quantity
-                    stock.save()
-                    request.data["price"] = stock.price
+                    created.append(position)
+                    result["status"] = "created"
                 else:
-                    return Response(
-                        {
-                            "error": f"Not enough stock. You can add only {stock.quantity} to your initial quantity"
-                        },
-                        status.HTTP_400_BAD_REQUEST,
-                    )
-        return super().update(request, *args, **kwargs)
+                    position.quantity = quantity
+                    if difference > 0:
+                        position.price = stock.price
+                    position.reserved_until = reservation_deadline()
+                    updated.append(position)
+                    result["status"] = "updated"
+                saved.append((result, position))
+
+            Stock.reserve_many({stock_id: quantity for stock_id, quantity in reserved.items() if quantity})
+            CartPosition.objects.bulk_create(created)
+            CartPosition.objects.bulk_update(updated, ["quantity", "price", "reserved_until"])
+            CartPosition.objects.filter(id__in=deleted).delete()
+
+        for result, position in saved:
+            result.update(CartPositionSerializer(position).data)
+        return Response({"positions": results}, status.HTTP_200_OK)
+
+    @staticmethod
+    def check_operation(stock, position, quantity, repeated):
+        """
+        Checks whether quantity of cart position may be set to indicated value
+        :param stock: locked stock instance or None if stock does not exist
+        :param position: cart position instance or None if product is not in cart
+        :param quantity: new quantity of cart position
+        :param repeated: whether stock was already processed in the same request
+        :return: error message or None if operation is valid
+        """
+        if repeated:
+            return "This product is repeated in request"
+        if not stock:
+            return "Stock does not exist"
+        if not position and not quantity:
+            return "You do not have this product in your cart"
+        difference = quantity - (position.quantity if position else 0)
+        if difference > 0 and not stock.supplier.order_status:
+            return "This supplier does not take new orders at the moment"
+        if difference > stock.quantity:
+            if position:
+                return f"Not enough stock. You can add only {stock.quantity} to your initial quantity"
+            return f"Not enough stock. Only {stock.quantity} is available"
 
 
 class ChainStoreViewSet(ModelViewSet):
@@ -1019,6 +1440,11 @@ class OrderViewSet(ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     http_method_names = ["post", "patch", "get", "delete"]
+    filter_backends = api_settings.DEFAULT_FILTER_BACKENDS + [OrderingFilter]
+    filterset_class = OrderFilter
+    pagination_class = OptionalKeysetPagination
+    cursor_ordering = ("-date", "purchaser_id", "id")
+    ordering_fields = ["date", "total_amount", "total_quantity", "supplier_count"]
 
     def get_queryset(self):
         """
@@ -1035,31 +1461,29 @@ class OrderViewSet(ModelViewSet):
             queryset = queryset.all()
         if self.request.user.is_superuser:
             return queryset.select_related("chain_store").prefetch_related(
-                "order_positions",
-                "order_positions__stock",
-                "order_positions__stock__product_characteristics",
+                Prefetch("order_positions", queryset=OrderPosition.objects.select_related("stock")),
+                characteristics_prefetch("order_positions__stock__product_characteristics"),
             )
         if self.request.user.type == "purchaser":
             return (
                 queryset.filter(purchaser__user=self.request.user)
                 .select_related("chain_store")
                 .prefetch_related(
-                    "order_positions",
-                    "order_positions__stock",
-                    "order_positions__stock__product_characteristics",
+                    Prefetch("order_positions", queryset=OrderPosition.objects.select_related("stock")),
+                    characteristics_prefetch("order_positions__stock__product_characteristics"),
                 )
             )
         if self.request.user.type == "supplier":
             return (
                 queryset.filter(
-                    order_positions__stock__supplier__user=self.request.user
+                    id__in=OrderPosition.objects.filter(
+                        stock__supplier__user=self.request.user
+                    ).values("order")
                 )
-                .distinct()
                 .select_related("chain_store")
                 .prefetch_related(
-                    "order_positions",
-                    "order_positions__stock",
-                    "order_positions__stock__product_characteristics",
+                    Prefetch("order_positions", queryset=OrderPosition.objects.select_related("stock")),
+                    characteristics_prefetch("order_positions__stock__product_characteristics"),
                 )
             )
 
@@ -1093,9 +1517,8 @@ class OrderViewSet(ModelViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        purchaser = Purchaser.objects.get(user=user)
-        cart_positions = purchaser.shopping_cart.cart_positions.all()
-        if not cart_positions.count():
+        purchaser = Purchaser.objects.select_related("shopping_cart").get(user=user)
+        if not purchaser.shopping_cart.cart_positions.exists():
             return Response(
                 {"error": "Your shopping cart is empty"},
                 status=status.HTTP_400_BAD_REQUEST,
@@ -1104,68 +1527,64 @@ class OrderViewSet(ModelViewSet):
 
         serializer = OrderCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        if (
-            ChainStore.objects.get(id=request.data["chain_store"]).purchaser
-            != purchaser
-        ):
+        if serializer.validated_data["chain_store"].purchaser_id != purchaser.id:
             return Response(
                 {"error": "Your can order delivery only to your chain stores"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-
-        order = Order.objects.get(id=serializer.data["id"])
-        suppliers = {}
-        for position in cart_positions:
-            new_position = OrderPosition.objects.create(
-                order=order,
-                stock=position.stock,
-                quantity=position.quantity,
-                price=position.price,
+        with transaction.atomic():
+            cart_positions = list(
+                purchaser.shopping_cart.cart_positions.select_for_update(of=("self",))
+                .select_related("stock__product", "stock__supplier__user")
+                .order_by("id")
             )
-            if new_position.stock.supplier.user not in suppliers:
-                suppliers[new_position.stock.supplier.user] = [
-                    {
-                        "id": new_position.id,
-                        "order": order.id,
-                        "stock": new_position.stock,
-                        "quantity": new_position.quantity,
-                        "price": new_position.price,
-                    }
-                ]
-            else:
-                suppliers[new_position.stock.supplier.user].append(
-                    {
-                        "id": new_position.id,
-                        "order": order.id,
-                        "stock": new_position.stock,
-                        "quantity": new_position.quantity,
-                        "price": new_position.price,
-                    }
+            if not cart_positions:
+                return Response(
+                    {"error": "Your shopping cart is empty"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            positions = [
+                OrderPosition(
+                    stock=position.stock,
+                    quantity=position.quantity,
+                    price=position.price,
                 )
+                for position in cart_positions
+            ]
+            order = serializer.save(**Order.summarize(positions))
+            for position in positions:
+                position.order = order
+            OrderPosition.objects.bulk_create(positions)
+            CartPosition.objects.filter(
+                id__in=[position.id for position in cart_positions]
+            ).delete()
+        headers = self.get_success_headers(serializer.data)
 
-        cart_positions.delete()
-        for supplier, positions in suppliers.items():
+        suppliers = {}
+        for position in positions:
+            suppliers.setdefault(position.stock.supplier.user, []).append(position)
+        notifications = []
+        for supplier, supplier_positions in suppliers.items():
             text = "You have new orders\n"
-            for position in positions:
-                text += f'''Order #{position["order"]}, stock {position["stock"].product.name}, 
-                quantity {position["quantity"]}, price {position["price"]}\n'''
+            for position in supplier_positions:
+                text += f'''Order #{order.id}, stock {position.stock.product.name}, 
+                quantity {position.quantity}, price {position.price}\n'''
             text += "Use application to confirm orders"
-            send_email.delay("New order", text, supplier.email)
+            notifications.append(("New order", text, supplier.email))
 
         response = serializer.data.copy()
         response["total_quantity"] = order.total_quantity
         response["total_amount"] = order.total_amount
-        send_email.delay(
+        notifications.append((
             "New order",
             f"""Thank you for your order.
             You have created new order #{response["id"]} to chain store {response["chain_store"]} 
             for total amount of {response["total_amount"]}
             Status of your order will automatically update after suppliers confirmations""",
             user.email
-        )
+        ))
+        Notification.enqueue(*notifications)
         return Response(response, status=status.HTTP_201_CREATED, headers=headers)
 
     def destroy(self, request, *args, **kwargs):
@@ -1175,13 +1594,17 @@ class OrderViewSet(ModelViewSet):
 
         instance = self.get_object()
 
-        if instance.status == "cancelled":
-            return Response(
-                {"error": "Order is already cancelled"},
-                status=status.HTTP_400_BAD_REQUEST,
+        with transaction.atomic():
+            instance = Order.objects.select_for_update().get(id=instance.id)
+            if instance.status == "cancelled":
+                return Response(
+                    {"error": "Order is already cancelled"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            positions = list(
+                instance.order_positions.values_list("stock_id", "quantity", "confirmed", "delivered")
             )
-        for position in instance.order_positions.all():
-            if position.confirmed or position.delivered:
+            if any(confirmed or delivered for _, _, confirmed, delivered in positions):
                 return Response(
                     {
                         "error": "Your can cancel only fully unconfirmed and undelivered orders"
@@ -1189,14 +1612,13 @@ class OrderViewSet(ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-        instance.status = "cancelled"
-        instance.save()
-
-        for position in instance.order_positions.all():
-            stock = Stock.objects.get(id=position.stock.id)
-            stock.quantity += position.quantity
-            stock.save()
-        return Response({"success": "Order cancelled"}, status.HTTP_200_OK)
+            Order.objects.filter(id=instance.id).update(status="cancelled")
+            restored = {stock_id: quantity for stock_id, quantity, _, _ in positions}
+            Stock.release_many(restored)
+        return Response(
+            {"success": "Order cancelled", "restored": restored_stocks(restored)},
+            status.HTTP_200_OK,
+        )
 
     def update(self, request, *args, **kwargs):
         """
@@ -1253,6 +1675,8 @@ class OrderPositionViewSet(ModelViewSet):
     queryset = OrderPosition.objects.all()
     serializer_class = OrderPositionSerializer
     http_method_names = ["patch", "get"]
+    pagination_class = OptionalKeysetPagination
+    cursor_ordering = ("order_id", "price", "id")
     filterset_fields = ["order__status"]
 
     def get_queryset(self):
@@ -1269,20 +1693,20 @@ class OrderPositionViewSet(ModelViewSet):
         if isinstance(queryset, QuerySet):
             queryset = queryset.all()
         if self.request.user.is_superuser:
-            return queryset.select_related("stock").prefetch_related(
-                "stock__product_characteristics"
+            return queryset.select_related("stock", "order__purchaser__user").prefetch_related(
+                characteristics_prefetch("stock__product_characteristics")
             )
         if self.request.user.type == "purchaser":
             return (
                 queryset.filter(order__purchaser__user=self.request.user)
-                .select_related("stock")
-                .prefetch_related("stock__product_characteristics")
+                .select_related("stock", "order__purchaser__user")
+                .prefetch_related(characteristics_prefetch("stock__product_characteristics"))
             )
         if self.request.user.type == "supplier":
             return (
                 queryset.filter(stock__supplier__user=self.request.user)
-                .select_related("stock")
-                .prefetch_related("stock__product_characteristics")
+                .select_related("stock", "order__purchaser__user")
+                .prefetch_related(characteristics_prefetch("stock__product_characteristics"))
             )
 
     def get_permissions(self):
@@ -1315,7 +1739,6 @@ class OrderPositionViewSet(ModelViewSet):
                 {"error": "You cannot confirm and deliver cancelled order positions"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        purchaser = instance.order.purchaser.user
         if "confirmed" in request.data:
             if type(request.data["confirmed"]) == bool and request.data["confirmed"]:
                 if not instance.confirmed:
@@ -1357,3 +1780,61 @@ class OrderPositionViewSet(ModelViewSet):
         return Response(
             {"success": "Оrder position successfully amended"}, status.HTTP_200_OK
         )
+
+
+class OrderPositionBulkView(APIView):
+    """
+    APIView class to confirm or/and deliver many order positions with one request
+    """
+
+    permission_classes = [IsSupplier]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Confirms or/and delivers indicated order positions or all positions of indicated order supplied by user.
+        Ownership and status of positions are checked with one query, positions are changed with single UPDATE
+        and purchaser receives one notification for each order
+        """
+
+        serializer = OrderPositionBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if "order" in data:
+            positions = OrderPosition.objects.filter(order=data["order"], stock__supplier__user=request.user)
+        else:
+            positions = OrderPosition.objects.filter(id__in=data["positions"])
+        found = list(positions.values_list("id", "stock__supplier__user", "order__status"))
+        if not found:
+            return Response(
+                {"error": "Order positions of your stocks are not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        if "positions" in data:
+            missing = set(data["positions"]) - {position_id for position_id, _, _ in found}
+            if missing:
+                return Response(
+                    {"error": f"Order positions {sorted(missing)} are not found"},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+            if any(user_id != request.user.id for _, user_id, _ in found):
+                return Response(
+                    {"error": "You can confirm and deliver only positions of your stocks"},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+        if any(order_status == "cancelled" for _, _, order_status in found):
+            return Response(
+                {"error": "You cannot confirm and deliver cancelled order positions"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        changed = OrderPosition.objects.filter(id__in=[position_id for position_id, _, _ in found]).update_status(
+            **{field: True for field in ("confirmed", "delivered") if data.get(field)}
+        )
+        return Response(
+            {
+                "success": f"{len(changed)} order positions successfully amended",
+                "positions": [position.id for position in changed],
+            },
+            status.HTTP_200_OK,
+        )
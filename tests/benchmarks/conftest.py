@@ -0,0 +1,183 @@
+import json
+import time
+from decimal import Decimal
+from itertools import cycle
+from pathlib import Path
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from model_bakery import baker
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from procurement_supply.models import (CartPosition, Category, ChainStore,
+                                       Characteristic, ImportSource, Order,
+                                       OrderPosition, Product,
+                                       ProductCharacteristic, Purchaser,
+                                       ShoppingCart, Stock, Supplier, User)
+
+BUDGET_PATH = Path(__file__).with_name("query_budget.json")
+SUPPLIERS = 10
+PURCHASERS = 20
+CATEGORIES = 10
+CHARACTERISTICS = 3
+POSITIONS_PER_ORDER = 3
+CART_POSITIONS = 20
+
+results = []
+plans = []
+
+
+def seed_catalog(stocks_count, orders_count):
+    """
+    Fills database with catalog of indicated size with bulk inserts
+    :return: dict with tokens of "admin", "purchaser" and "supplier" users and ids of objects used in endpoints
+    """
+    admin = baker.make(User, username="bench_admin", type="admin", is_superuser=True, is_staff=True)
+    purchaser_user = baker.make(User, username="bench_purchaser", type="purchaser")
+    supplier_users = baker.make(User, type="supplier", _quantity=SUPPLIERS)
+    suppliers = baker.make(
+        Supplier, user=iter(supplier_users), name=iter(f"Поставщик {number}" for number in range(SUPPLIERS)),
+        order_status=True, _quantity=SUPPLIERS, _bulk_create=True,
+    )
+    categories = baker.make(Category, _quantity=CATEGORIES, _bulk_create=True)
+    products = baker.make(
+        Product, category=cycle(categories), _quantity=max(stocks_count // 10, 1), _bulk_create=True
+    )
+    stocks = Stock.objects.bulk_create(
+        baker.prepare(
+            Stock, product=cycle(products), supplier=cycle(suppliers),
+            sku=iter(f"sku-{number}" for number in range(stocks_count)), price=Decimal("100.00"),
+            price_rrc=Decimal("120.00"), quantity=cycle([1000, 1000, 1000, 0]), _quantity=stocks_count,
+        )
+    )
+    characteristics = baker.make(Characteristic, _quantity=CHARACTERISTICS, _bulk_create=True)
+    ProductCharacteristic.objects.bulk_create(
+        ProductCharacteristic(stock=stock, characteristic=characteristic, value=str(number))
+        for stock in stocks for number, characteristic in enumerate(characteristics)
+    )
+    for supplier in suppliers:
+        baker.make(ImportSource, supplier=supplier, url=f"https://example.com/{supplier.id}.yml")
+
+    purchaser_users = [purchaser_user] + baker.make(User, type="purchaser", _quantity=PURCHASERS - 1)
+    purchasers = baker.make(
+        Purchaser, user=iter(purchaser_users), _quantity=PURCHASERS, _bulk_create=True
+    )
+    chain_stores = baker.make(ChainStore, purchaser=iter(purchasers), _quantity=PURCHASERS, _bulk_create=True)
+    purchaser = purchasers[0]
+    cart = baker.make(ShoppingCart, purchaser=purchaser)
+    CartPosition.objects.bulk_create(
+        CartPosition(shopping_cart=cart, stock=stock, quantity=1, price=stock.price)
+        for stock in stocks[:CART_POSITIONS]
+    )
+    stores = cycle(chain_stores)
+    statuses = cycle(["saved", "saved", "saved", "cancelled"])
+    orders = Order.objects.bulk_create(
+        Order(purchaser_id=store.purchaser_id, chain_store=store, status=status)
+        for store, status, _ in zip(stores, statuses, range(orders_count))
+    )
+    OrderPosition.objects.bulk_create(
+        OrderPosition(
+            order=order, stock=stocks[(number * POSITIONS_PER_ORDER + shift) % len(stocks)], quantity=1,
+            price=Decimal("100.00"),
+        )
+        for number, order in enumerate(orders) for shift in range(POSITIONS_PER_ORDER)
+    )
+    Order.objects.refresh_summaries()
+
+    supplier_position = OrderPosition.objects.filter(stock__supplier=suppliers[0]).first()
+    return {
+        "tokens": {
+            "admin": Token.objects.create(user=admin).key,
+            "purchaser": Token.objects.create(user=purchaser_user).key,
+            "supplier": Token.objects.create(user=supplier_users[0]).key,
+        },
+        "ids": {
+            "stock": stocks[0].id,
+            "order": supplier_position.order_id,
+            "order_position": supplier_position.id,
+            "shopping_cart": cart.id,
+            "cart_position": CartPosition.objects.filter(shopping_cart=cart).values_list("id", flat=True).first(),
+            "purchaser_user": purchaser_user.id,
+            "supplier": suppliers[0].id,
+            "supplier_user": supplier_users[0].id,
+        },
+    }
+
+
+@pytest.fixture(scope="module")
+def catalog(request, django_db_setup, django_db_blocker):
+    """
+    Seeds benchmark catalog once per module and rolls it back after the last test of module
+    """
+    with django_db_blocker.unblock():
+        with transaction.atomic():
+            yield seed_catalog(
+                request.config.getoption("--benchmark-stocks"), request.config.getoption("--benchmark-orders")
+            )
+            transaction.set_rollback(True)
+
+
+@pytest.fixture(scope="session")
+def query_budget(request):
+    """
+    Stored maximal number of queries per endpoint and role. With --benchmark-save option measured numbers
+    are written to budget file at the end of session
+    """
+    budget = json.loads(BUDGET_PATH.read_text()) if BUDGET_PATH.exists() else {}
+    yield budget
+    if request.config.getoption("--benchmark-save"):
+        BUDGET_PATH.write_text(json.dumps(dict(sorted(budget.items())), indent=2, ensure_ascii=False) + "\n")
+
+
+@pytest.fixture
+def measure(catalog):
+    """
+    Requests endpoint on behalf of indicated role and measures number of SQL queries and wall time of request
+    :return: function (url, role, **params) -> (response, number of queries, seconds)
+    """
+
+    def measure(url, role, **params):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {catalog["tokens"][role]}')
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url.format(**catalog["ids"]), data=params, format="json")
+        return response, len(context), time.perf_counter() - started
+
+    return measure
+
+
+@pytest.fixture
+def check_budget(request, query_budget):
+    """
+    Records measurement of endpoint and checks it against stored budget
+    """
+
+    def check_budget(endpoint, role, status_code, queries, seconds):
+        key = f"GET {endpoint} {role}"
+        results.append({"endpoint": key, "status": status_code, "queries": queries, "ms": round(seconds * 1000, 1)})
+        if request.config.getoption("--benchmark-save"):
+            query_budget[key] = queries
+            return
+        assert key in query_budget, f"No query budget for {key}, run benchmarks with --benchmark-save"
+        assert queries <= query_budget[key], f"{key} makes {queries} queries, budget is {query_budget[key]}"
+
+    return check_budget
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if plans:
+        terminalreporter.section("query plans")
+        for plan in plans:
+            terminalreporter.write_line(f'{plan["index"]}\nwithout index:\n{plan["before"]}\nwith index:\n{plan["after"]}\n')
+    if not results:
+        return
+    terminalreporter.section("query count benchmarks")
+    for result in results:
+        terminalreporter.write_line(
+            f'{result["endpoint"]:<60} {result["status"]:>4} {result["queries"]:>4} queries {result["ms"]:>9} ms'
+        )
+    if config.getoption("--benchmark-json"):
+        Path(config.getoption("--benchmark-json")).write_text(json.dumps(results, indent=2, ensure_ascii=False))
@@ -0,0 +1,67 @@
+import pytest
+
+ROLES = ["admin", "purchaser", "supplier"]
+LIST_ENDPOINTS = [
+    "/api/v1/users/",
+    "/api/v1/suppliers/",
+    "/api/v1/categories/",
+    "/api/v1/products/",
+    "/api/v1/characteristics/",
+    "/api/v1/stocks/",
+    "/api/v1/product_characteristics/",
+    "/api/v1/purchasers/",
+    "/api/v1/chain_stores/",
+    "/api/v1/shopping_carts/",
+    "/api/v1/cart_positions/",
+    "/api/v1/orders/",
+    "/api/v1/order_positions/",
+    "/api/v1/import_sources/",
+]
+DETAIL_ENDPOINTS = [
+    "/api/v1/stocks/{stock}/",
+    "/api/v1/shopping_carts/{shopping_cart}/",
+    "/api/v1/cart_positions/{cart_position}/",
+    "/api/v1/orders/{order}/",
+    "/api/v1/order_positions/{order_position}/",
+]
+CURSOR_ENDPOINTS = ["/api/v1/stocks/", "/api/v1/orders/", "/api/v1/order_positions/"]
+CURSOR_PAGES = 20
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize("role", ROLES)
+@pytest.mark.parametrize("endpoint", LIST_ENDPOINTS)
+def test_list_query_count(endpoint, role, measure, check_budget):
+    response, queries, seconds = measure(endpoint, role, page_size=10)
+    assert response.status_code < 500
+    large_response, large_queries, large_seconds = measure(endpoint, role, page_size=100)
+    assert large_queries == queries, f"{endpoint} makes {queries} queries for 10 and {large_queries} for 100 objects"
+    check_budget(endpoint, role, large_response.status_code, large_queries, large_seconds)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize("role", ROLES)
+@pytest.mark.parametrize("endpoint", DETAIL_ENDPOINTS)
+def test_detail_query_count(endpoint, role, measure, check_budget):
+    response, queries, seconds = measure(endpoint, role)
+    assert response.status_code < 500
+    check_budget(endpoint, role, response.status_code, queries, seconds)
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize("endpoint", CURSOR_ENDPOINTS)
+def test_cursor_query_count(endpoint, measure, check_budget):
+    response, queries, seconds = measure(endpoint, "admin", pagination="cursor", page_size=100)
+    page_queries, page_seconds, pages = queries, seconds, 0
+    for _ in range(CURSOR_PAGES):
+        assert response.status_code == 200
+        if not response.json()["next"]:
+            break
+        response, page_queries, page_seconds = measure(response.json()["next"], "admin")
+        pages += 1
+        assert page_queries == queries, f"{endpoint} makes {queries} queries for first and {page_queries} for next page"
+    assert pages, f"{endpoint} has only one page, catalog is too small to measure next pages"
+    check_budget(f"{endpoint}?pagination=cursor", "admin", response.status_code, page_queries, page_seconds)
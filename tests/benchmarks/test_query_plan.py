@@ -0,0 +1,56 @@
+import re
+
+import pytest
+from django.db import connection, transaction
+
+from procurement_supply.models import (Order, OrderPosition,
+                                       ProductCharacteristic, Stock)
+
+from tests.benchmarks.conftest import plans
+
+QUERIES = {
+    "stock_available_idx": lambda ids: Stock.objects.filter(supplier__order_status=True, quantity__gt=0)[:10],
+    "stock_supplier_idx": lambda ids: Stock.objects.filter(supplier__user_id=ids["supplier_user"])[:10],
+    "order_date_idx": lambda ids: Order.objects.all()[:10],
+    "order_purchaser_date_idx": lambda ids: Order.objects.filter(purchaser__user_id=ids["purchaser_user"])[:10],
+    "order_position_ordering_idx": lambda ids: OrderPosition.objects.all()[:10],
+    "product_char_stock_value_idx": lambda ids: ProductCharacteristic.objects.all()[:10],
+}
+
+# Plan lines of sequential scan or explicit sort in PostgreSQL and SQLite
+FULL_SCAN_OR_SORT = re.compile(r"Seq Scan|\bSort\b|^\W*SCAN \S+$|TEMP B-TREE", re.MULTILINE)
+
+
+@pytest.fixture(scope="module")
+def analyzed(catalog):
+    """
+    Collects statistics of seeded catalog for query planner
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return catalog
+
+
+def explain(queryset, dropped_index=None):
+    """
+    Returns query plan of queryset, optionally as it was without indicated index
+    """
+    with transaction.atomic():
+        if dropped_index:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(dropped_index)}")
+        plan = queryset.explain()
+        transaction.set_rollback(True)
+    return plan
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+@pytest.mark.parametrize("index", QUERIES)
+def test_query_uses_index(index, analyzed):
+    queryset = QUERIES[index](analyzed["ids"])
+    before = explain(queryset, dropped_index=index)
+    after = explain(queryset)
+    plans.append({"index": index, "before": before, "after": after})
+    assert FULL_SCAN_OR_SORT.search(before), f"Query without {index} neither scans nor sorts table:\n{before}"
+    assert index in after, f"Query does not use {index}:\n{after}"
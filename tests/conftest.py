@@ -4,6 +4,8 @@ from model_bakery import baker
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 
+from order_service.celery import app as celery_app
+
 from procurement_supply.models import (CartPosition, Category, ChainStore,
                                        Characteristic, Order, OrderPosition,
                                        Product, ProductCharacteristic,
@@ -13,11 +15,50 @@ from procurement_supply.models import (CartPosition, Category, ChainStore,
 TEST_EMAIL = settings.EMAIL_HOST_USER
 
 
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark", "query count benchmarks of tests/benchmarks")
+    group.addoption("--benchmark", action="store_true", help="Run query count benchmarks")
+    group.addoption("--benchmark-stocks", type=int, default=1000, help="Number of stocks in benchmark catalog")
+    group.addoption("--benchmark-orders", type=int, default=1000, help="Number of orders in benchmark catalog")
+    group.addoption("--benchmark-save", action="store_true",
+                    help="Write measured query counts to budget file instead of checking them")
+    group.addoption("--benchmark-json", help="Path of JSON report with query counts and wall time of endpoints")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="query count benchmarks run with --benchmark option")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def client():
     return APIClient()
 
 
+@pytest.fixture(autouse=True)
+def memory_result_backend(settings):
+    """
+    Stores results of celery tasks in memory, so that tests do not require Redis.
+    App reads setting with CELERY namespace from django settings and caches backend instance,
+    so backend is recreated with memory backend and dropped after test
+    """
+    settings.CELERY_RESULT_BACKEND = "cache+memory://"
+    celery_app._local.__dict__.pop("backend", None)
+    yield
+    celery_app._local.__dict__.pop("backend", None)
+
+
+@pytest.fixture
+def eager_celery(monkeypatch):
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    for task in celery_app.tasks.values():
+        monkeypatch.setattr(task, "store_eager_result", True, raising=False)
+
+
 @pytest.fixture
 def admin_auth():
     admin = User.objects.create(
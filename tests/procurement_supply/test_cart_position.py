@@ -1,6 +1,17 @@
+import threading
+from collections import Counter
+from datetime import timedelta
+
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-from procurement_supply.models import (CartPosition, ShoppingCart, Stock)
+from procurement_supply.models import (CartPosition, Purchaser, ShoppingCart,
+                                       Stock, User)
+from procurement_supply.tasks import release_expired_reservations
 
 
 @pytest.mark.django_db
@@ -577,3 +588,217 @@ def test_update_cart_position_more_quantity_success(client, full_base):
         - position.quantity * position.price
         + data["quantity"] * updated_stock.price
     )
+
+
+def make_purchaser_tokens(count):
+    tokens = []
+    for number in range(count):
+        user = User.objects.create(username=f"buyer{number}", email=f"buyer{number}@mail.ru", type="purchaser")
+        purchaser = Purchaser.objects.create(user=user, name=f"Покупатель {number}")
+        ShoppingCart.objects.create(purchaser=purchaser)
+        tokens.append(Token.objects.create(user=user).key)
+    return tokens
+
+
+def run_in_threads(target, arguments):
+    errors = []
+
+    def run(argument):
+        try:
+            target(argument)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(argument,)) for argument in arguments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+@pytest.mark.django_db(transaction=True)
+def test_stock_reserve_concurrency(half_base):
+    stock = Stock.objects.first()
+    Stock.objects.filter(id=stock.id).update(quantity=50)
+    reserved = []
+    refused = []
+
+    def reserve(number):
+        for _ in range(10):
+            (reserved if Stock.reserve(stock.id, 1) else refused).append(number)
+
+    assert run_in_threads(reserve, range(10)) == []
+    stock.refresh_from_db()
+    assert len(reserved) == 50
+    assert len(refused) == 50
+    assert stock.quantity == 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_cart_position_concurrency_hot_stock(half_base):
+    if connection.vendor == "sqlite":
+        pytest.skip("SQLite locks whole tables instead of rows of concurrent transactions")
+    stock = Stock.objects.filter(supplier__order_status=True).first()
+    Stock.objects.filter(id=stock.id).update(quantity=30)
+    tokens = make_purchaser_tokens(12)
+    created = {}
+    codes = []
+
+    def buy(token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        response = client.post("/api/v1/cart_positions/", data={"stock": stock.id, "quantity": 3}, format="json")
+        codes.append(response.status_code)
+        if response.status_code == 201:
+            created[token] = response.json()["id"]
+
+    assert run_in_threads(buy, tokens) == []
+    assert sorted(codes) == [201] * 10 + [400] * 2
+    stock.refresh_from_db()
+    assert stock.quantity == 0
+    assert CartPosition.objects.filter(stock=stock).count() == 10
+
+    codes.clear()
+    deleted = next(iter(created))
+
+    def give_back(token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        for quantity in (2, 1):
+            response = client.patch(
+                f"/api/v1/cart_positions/{created[token]}/", data={"quantity": quantity}, format="json"
+            )
+            codes.append(response.status_code)
+        if token == deleted:
+            codes.append(client.delete(f"/api/v1/cart_positions/{created[token]}/").status_code)
+
+    assert run_in_threads(give_back, created) == []
+    assert sorted(codes) == [200] * 20 + [204]
+    stock.refresh_from_db()
+    reserved = sum(CartPosition.objects.filter(stock=stock).values_list("quantity", flat=True))
+    assert reserved == 9
+    assert stock.quantity == 21
+
+
+@pytest.mark.django_db
+def test_update_cart_position_extends_reservation(client, full_base):
+    position = CartPosition.objects.filter(quantity=100, price=100).first()
+    CartPosition.objects.filter(id=position.id).update(reserved_until=timezone.now() + timedelta(minutes=1))
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    response = client.patch(f"/api/v1/cart_positions/{position.id}/", data={"quantity": 50}, format="json")
+    assert response.status_code == 200
+    position.refresh_from_db()
+    assert position.reserved_until > timezone.now() + timedelta(hours=23)
+
+
+@pytest.mark.django_db
+def test_release_expired_reservations(full_base, settings, django_assert_max_num_queries):
+    settings.CART_SWEEP_BATCH_SIZE = 2
+    positions = list(CartPosition.objects.order_by("id"))
+    expired, kept = positions[:3], positions[3:]
+    CartPosition.objects.filter(id__in=[position.id for position in expired]).update(
+        reserved_until=timezone.now() - timedelta(seconds=1)
+    )
+    returned = Counter()
+    for position in expired:
+        returned[position.stock_id] += position.quantity
+    quantities = dict(Stock.objects.values_list("id", "quantity"))
+
+    with django_assert_max_num_queries(12):
+        result = release_expired_reservations()
+    assert result == {"status": "success", "detail": "3 expired cart positions released"}
+    assert set(CartPosition.objects.values_list("id", flat=True)) == {position.id for position in kept}
+    for stock_id, quantity in Stock.objects.values_list("id", "quantity"):
+        assert quantity == quantities[stock_id] + returned[stock_id]
+    assert release_expired_reservations()["detail"] == "0 expired cart positions released"
+
+
+@pytest.mark.django_db
+def test_bulk_cart_positions_supplier_token(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    response = client.post("/api/v1/cart_positions/bulk/", data={"positions": []}, format="json")
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_bulk_cart_positions_invalid_request(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    response = client.post("/api/v1/cart_positions/bulk/", data={"positions": []}, format="json")
+    assert response.status_code == 400
+    assert "positions" in response.json()
+    data = {"positions": [{"stock": 1, "quantity": -1}]}
+    response = client.post("/api/v1/cart_positions/bulk/", data=data, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"positions": [{"quantity": ["Ensure this value is greater than or equal to 0."]}]}
+
+
+@pytest.mark.django_db
+def test_bulk_cart_positions_success(client, full_base):
+    cart = Purchaser.objects.filter(name="ОК").first().shopping_cart
+    changed, removed, kept = cart.cart_positions.order_by("id")
+    new_stock = (
+        Stock.objects.filter(supplier__order_status=True, quantity__gte=10)
+        .exclude(cart_positions__shopping_cart=cart)
+        .first()
+    )
+    closed_stock = Stock.objects.filter(product__name="Рис").first()
+    quantities = dict(Stock.objects.values_list("id", "quantity"))
+    data = {
+        "positions": [
+            {"stock": changed.stock_id, "quantity": changed.quantity - 40},
+            {"stock": removed.stock_id, "quantity": 0},
+            {"stock": new_stock.id, "quantity": 10},
+            {"stock": new_stock.id, "quantity": 5},
+            {"stock": closed_stock.id, "quantity": 10},
+            {"stock": kept.stock_id, "quantity": kept.quantity + quantities[kept.stock_id] + 1},
+            {"stock": 0, "quantity": 1},
+        ]
+    }
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    response = client.post("/api/v1/cart_positions/bulk/", data=data, format="json")
+    assert response.status_code == 200
+    results = response.json()["positions"]
+    assert [result["status"] for result in results] == [
+        "updated", "deleted", "created", "error", "error", "error", "error"
+    ]
+    assert results[0]["id"] == changed.id
+    assert results[0]["quantity"] == changed.quantity - 40
+    assert results[1] == {"stock": removed.stock_id, "quantity": 0, "status": "deleted", "id": removed.id}
+    assert results[2]["id"] == cart.cart_positions.get(stock=new_stock).id
+    assert results[2]["price"] == str(new_stock.price)
+    assert results[3]["error"] == "This product is repeated in request"
+    assert results[4]["error"] == "This supplier does not take new orders at the moment"
+    assert results[5]["error"] == (
+        f"Not enough stock. You can add only {quantities[kept.stock_id]} to your initial quantity"
+    )
+    assert results[6]["error"] == "Stock does not exist"
+
+    positions = dict(cart.cart_positions.values_list("stock_id", "quantity"))
+    assert positions == {changed.stock_id: changed.quantity - 40, kept.stock_id: kept.quantity, new_stock.id: 10}
+    stocks = dict(Stock.objects.values_list("id", "quantity"))
+    assert stocks[changed.stock_id] == quantities[changed.stock_id] + 40
+    assert stocks[removed.stock_id] == quantities[removed.stock_id] + removed.quantity
+    assert stocks[new_stock.id] == quantities[new_stock.id] - 10
+    assert stocks[kept.stock_id] == quantities[kept.stock_id]
+
+
+@pytest.mark.django_db
+def test_bulk_cart_positions_queries_do_not_depend_on_positions_count(client, full_base):
+    Stock.objects.update(quantity=1000)
+    positions = Purchaser.objects.filter(name="Фасоль").first().shopping_cart.cart_positions
+    positions.all().delete()
+    stocks = list(Stock.objects.filter(supplier__order_status=True).values_list("id", flat=True))
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["minimarket"]}')
+    queries = []
+    for operations in (stocks[:1], stocks[1:]):
+        data = {"positions": [{"stock": stock_id, "quantity": 5} for stock_id in operations]}
+        with CaptureQueriesContext(connection) as context:
+            response = client.post("/api/v1/cart_positions/bulk/", data=data, format="json")
+        assert response.status_code == 200
+        queries.append(len(context))
+    assert len(stocks) > 2
+    assert queries[0] == queries[1]
+    assert positions.count() == len(stocks)
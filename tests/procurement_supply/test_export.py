@@ -0,0 +1,273 @@
+import csv
+import gzip
+import io
+import json
+from datetime import timedelta
+
+import pytest
+import yaml
+from django.core.management import CommandError, call_command
+from django.db.models import Count
+from django.utils import timezone
+
+from procurement_supply.exporter import (StockExporter, export_shard,
+                                         shard_path)
+from procurement_supply.models import (Characteristic, OrderPosition,
+                                       ProductCharacteristic, Stock,
+                                       StockTombstone, Supplier)
+from procurement_supply.readers import (iter_json_lines, iter_yaml,
+                                        read_price_list)
+
+
+def export(**options):
+    outfile = io.StringIO()
+    count = StockExporter(**options).write(outfile)
+    return count, outfile.getvalue()
+
+
+@pytest.mark.django_db
+def test_export_yaml(full_base):
+    count, content = export(chunk_size=2)
+    assert count == Stock.objects.count()
+    data = yaml.safe_load(content)
+    assert list(data) == ["categories", "shop", "goods"]
+    assert len(data["goods"]) == count
+    assert len(data["shop"]) == Supplier.objects.count()
+    good = data["goods"][0]
+    stock = Stock.objects.order_by("id").first()
+    assert good["id"] == stock.sku
+    assert good["shop"] == stock.supplier_id
+    assert good["parameters"] == {
+        parameter.characteristic.name: parameter.value
+        for parameter in ProductCharacteristic.objects.filter(stock=stock)
+    }
+
+
+@pytest.mark.django_db
+def test_export_yaml_streams_to_reader(full_base):
+    count, content = export()
+    data = read_price_list(iter_yaml(io.StringIO(content)))
+    assert len(list(data["goods"])) == count
+
+
+@pytest.mark.django_db
+def test_export_json_formats(full_base):
+    count, content = export(export_format="json")
+    assert len(json.loads(content)["goods"]) == count
+    count, content = export(export_format="jsonl")
+    data = read_price_list(iter_json_lines(content.splitlines()))
+    assert len(list(data["goods"])) == count
+    count, content = export(export_format="csv")
+    rows = list(csv.DictReader(io.StringIO(content)))
+    assert len(rows) == count
+    assert isinstance(json.loads(rows[0]["parameters"]), dict)
+
+
+@pytest.mark.django_db
+def test_export_empty(half_base):
+    Stock.objects.all().delete()
+    assert yaml.safe_load(export()[1])["goods"] == []
+    assert json.loads(export(export_format="json")[1])["goods"] == []
+
+
+@pytest.mark.django_db
+def test_export_filters(full_base):
+    stock = Stock.objects.order_by("id").first()
+    count, content = export(suppliers=[stock.supplier_id])
+    data = yaml.safe_load(content)
+    assert count == Stock.objects.filter(supplier_id=stock.supplier_id).count()
+    assert [shop["id"] for shop in data["shop"]] == [stock.supplier_id]
+    category = stock.product.category_id
+    count, content = export(categories=[category])
+    assert count == Stock.objects.filter(product__category_id=category).count()
+    assert {good["category"] for good in yaml.safe_load(content)["goods"]} == {category}
+
+
+@pytest.mark.django_db
+def test_export_queries_do_not_depend_on_stocks_count(full_base, django_assert_max_num_queries):
+    with django_assert_max_num_queries(6):
+        export(chunk_size=Stock.objects.count())
+
+
+@pytest.mark.django_db
+def test_export_shards(full_base, tmp_path):
+    exporter = StockExporter(export_format="jsonl", chunk_size=3)
+    ranges = exporter.shards(3)
+    assert ranges[0][0] == Stock.objects.order_by("id").first().id
+    assert ranges[-1][1] == Stock.objects.order_by("id").last().id
+    path = str(tmp_path / "export.jsonl.gz")
+    counts = [
+        export_shard({"export_format": "jsonl"}, id_range, shard_path(path, number), True)
+        for number, id_range in enumerate(ranges, start=1)
+    ]
+    assert sum(counts) == Stock.objects.count()
+    with gzip.open(tmp_path / "export-1.jsonl.gz", "rt", encoding="utf8") as shard:
+        assert len(shard.readlines()) == counts[0] + 1
+
+
+@pytest.mark.django_db
+def test_export_goods_command(full_base, tmp_path):
+    path = tmp_path / "goods.csv"
+    out = io.StringIO()
+    call_command("export_goods", "--format", "csv", "--output", str(path), stdout=out)
+    assert out.getvalue() == f"{Stock.objects.count()} goods exported to {path}\n"
+    assert path.read_text(encoding="utf8").startswith("id,category,model,name,shop,price")
+
+
+def test_shard_path():
+    assert shard_path("export.yml", 2) == "export-2.yml"
+    assert shard_path("dir/export.jsonl.gz", 1) == "dir/export-1.jsonl.gz"
+
+
+@pytest.mark.django_db
+def test_incremental_export(full_base):
+    since = timezone.now()
+    stocks = list(Stock.objects.order_by("id")[:4])
+    Stock.objects.filter(id=stocks[0].id).update(updated_at=since - timedelta(days=1))
+    stocks[1].price = 1000
+    stocks[1].save()
+    stocks[2].quantity = 0
+    stocks[2].save()
+    ProductCharacteristic.objects.create(
+        stock=stocks[3], characteristic=Characteristic.objects.create(name="Новая"), value="да"
+    )
+    deleted = Stock.objects.order_by("id").last()
+    deleted.delete()
+    Stock.objects.exclude(id__in=[stock.id for stock in stocks[1:4]]).update(updated_at=since - timedelta(days=1))
+
+    count, content = export(since=since)
+    data = yaml.safe_load(content)
+    assert data["since"] == since.isoformat()
+    assert count == 4
+    assert [good["id"] for good in data["goods"][:2]] == [stocks[1].sku, stocks[3].sku]
+    assert data["goods"][0]["price"] == 1000
+    assert data["goods"][1]["parameters"]["Новая"] == "да"
+    assert data["goods"][2:] == [
+        {"id": stocks[2].sku, "shop": stocks[2].supplier_id, "tombstone": "zeroed"},
+        {"id": deleted.sku, "shop": deleted.supplier_id, "tombstone": "deleted"},
+    ]
+    assert export(since=timezone.now())[0] == 0
+
+
+@pytest.mark.django_db
+def test_stock_tombstone(full_base):
+    stock = Stock.objects.select_related("product").first()
+    stock.delete()
+    tombstone = StockTombstone.objects.get()
+    assert (tombstone.sku, tombstone.supplier_id, tombstone.category_id) == (
+        stock.sku, stock.supplier_id, stock.product.category_id
+    )
+
+
+
+@pytest.mark.django_db
+def test_stock_tombstones_of_deleted_queryset(full_base, django_assert_max_num_queries):
+    OrderPosition.objects.all().delete()
+    stocks = Stock.objects.filter(quantity__gt=0)
+    expected = set(stocks.values_list("id", "sku", "supplier_id", "product__category_id"))
+    with django_assert_max_num_queries(8):
+        stocks.delete()
+    assert set(
+        StockTombstone.objects.values_list("stock_id", "sku", "supplier_id", "category_id")
+    ) == expected
+
+
+@pytest.mark.django_db
+def test_stock_tombstones_of_deleted_supplier_and_product(full_base, django_assert_max_num_queries):
+    OrderPosition.objects.all().delete()
+    supplier = Supplier.objects.annotate(count=Count("stocks")).filter(count__gt=1).first()
+    expected = set(supplier.stocks.values_list("id", flat=True))
+    with django_assert_max_num_queries(15):
+        supplier.delete()
+    product = Stock.objects.select_related("product").first().product
+    expected.update(product.stocks.values_list("id", flat=True))
+    product.delete()
+    assert sorted(StockTombstone.objects.values_list("stock_id", flat=True)) == sorted(expected)
+
+@pytest.mark.django_db
+def test_incremental_export_csv(full_base):
+    Stock.objects.order_by("id").first().delete()
+    count, content = export(export_format="csv", since=timezone.now() - timedelta(minutes=1))
+    rows = list(csv.DictReader(io.StringIO(content)))
+    assert len(rows) == count == Stock.objects.count() + 1
+    assert sum(row["tombstone"] == "zeroed" for row in rows) == Stock.objects.filter(quantity=0).count()
+    assert rows[-1]["tombstone"] == "deleted"
+
+
+@pytest.mark.django_db
+def test_export_goods_command_since(full_base, tmp_path):
+    out = io.StringIO()
+    call_command("export_goods", "--since", "2000-01-01T00:00:00", "--output", str(tmp_path / "e.yml"), stdout=out)
+    assert out.getvalue().startswith("Next incremental export may start since ")
+    with pytest.raises(CommandError):
+        call_command("export_goods", "--since", "yesterday")
+
+
+@pytest.fixture
+def export_root(settings, tmp_path):
+    settings.EXPORT_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def get_task_id(response):
+    return response.json()["detail"].rsplit(" ", 1)[1]
+
+
+@pytest.mark.django_db
+def test_export_api_purchaser_token(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["minimarket"]}')
+    response = client.post("/api/v1/export/", format="json")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "You do not have permission to perform this action."}
+
+
+@pytest.mark.django_db
+def test_export_api_wrong_format(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    response = client.post("/api/v1/export/", data={"format": "xml"}, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"format": ['"xml" is not a valid choice.']}
+
+
+@pytest.mark.django_db
+def test_export_api_supplier_token(client, full_base, eager_celery, export_root):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    supplier = Supplier.objects.get(user__auth_token__key=full_base["vegsupplier"])
+    response = client.post("/api/v1/export/", data={"format": "jsonl", "suppliers": [0]}, format="json")
+    assert response.status_code == 200
+    task_id = get_task_id(response)
+
+    reply = client.get(f"/api/v1/export/{task_id}/").json()
+    assert reply["status"] == "SUCCESS"
+    assert reply["result"]["count"] == Stock.objects.filter(supplier=supplier).count()
+
+    response = client.get(f"/api/v1/export/{task_id}/download/")
+    assert response.status_code == 200
+    assert response["Content-Disposition"] == f'attachment; filename="{task_id}-export.jsonl"'
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert {json.loads(line)["shop"] for line in lines[1:]} == {supplier.id}
+    assert [path.name for path in export_root.iterdir()] == [f"{task_id}-export.jsonl"]
+
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["grainsupplier"]}')
+    assert client.get(f"/api/v1/export/{task_id}/").json() == {"status": "PENDING", "result": None}
+    assert client.get(f"/api/v1/export/{task_id}/download/").status_code == 404
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    assert client.get(f"/api/v1/export/{task_id}/download/").status_code == 200
+
+
+@pytest.mark.django_db
+def test_export_api_admin_gzip(client, full_base, eager_celery, export_root):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    response = client.post("/api/v1/export/", data={"gzip": True}, format="json")
+    response = client.get(f"/api/v1/export/{get_task_id(response)}/download/")
+    assert response.status_code == 200
+    data = yaml.safe_load(gzip.decompress(b"".join(response.streaming_content)))
+    assert len(data["goods"]) == Stock.objects.count()
+
+
+@pytest.mark.django_db
+def test_export_download_not_finished(client, full_base, export_root):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    response = client.get("/api/v1/export/unknown-task/download/")
+    assert response.status_code == 404
+    assert response.json() == {"error": "Export is not finished, expired or task does not exist"}
@@ -1,7 +1,26 @@
+import hashlib
+import io
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
 import pytest
+import yaml
+from celery.result import AsyncResult
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 
-from procurement_supply.models import (Category, Characteristic, Product,
+from procurement_supply.importer import (ImportFailed, StockImporter, batched,
+                                         lock_supplier, unlock_supplier)
+from procurement_supply.models import (Category, Characteristic,
+                                       ImportChunk, ImportSource, Product,
                                        ProductCharacteristic, Stock, Supplier)
+from procurement_supply.readers import (is_json_lines, iter_json_lines,
+                                        iter_yaml, read_price_list)
+from procurement_supply.tasks import (ImportProgress, do_import,
+                                      import_in_chunks, schedule_imports)
 
 
 # @pytest.mark.django_db
@@ -155,3 +174,458 @@ def test_import_no_url(client, half_base):
 #     client.post("/api/v1/import/", data=data, format="json")
 #
 #     assert Stock.objects.get(id=rice.id).quantity == 0
+
+
+def make_import_data(goods_count=3, quantity=10):
+    return {
+        "shop": "Каравай",
+        "categories": [{"id": 101, "name": "Хлеб"}, {"id": 102, "name": "Выпечка"}],
+        "goods": [
+            {
+                "id": 1000 + number,
+                "category": 101 if number % 2 else 102,
+                "model": f"model {number}",
+                "name": f"Батон {number % 5}",
+                "price": 50 + number,
+                "price_rrc": 60 + number,
+                "quantity": quantity,
+                "parameters": {"Вес (г)": 400, "Мука": "пшеничная"},
+            }
+            for number in range(goods_count)
+        ],
+    }
+
+
+@pytest.mark.django_db
+def test_bulk_import_success(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    result = StockImporter(user.id).run(make_import_data())
+    assert result["status"] == "success"
+    assert result["detail"] == "Import or update performed successfully"
+    supplier = Supplier.objects.get(user=user)
+    assert supplier.name == "Каравай"
+    assert set(supplier.categories.values_list("id", flat=True)) == {101, 102}
+    assert Product.objects.filter(category__id__in=[101, 102]).count() == 3
+    assert Stock.objects.filter(supplier=supplier).count() == 3
+    assert Characteristic.objects.filter(name__in=["Вес (г)", "Мука"]).count() == 2
+    assert ProductCharacteristic.objects.filter(stock__supplier=supplier).count() == 6
+
+
+@pytest.mark.django_db
+def test_bulk_import_update_and_vanished_stock_nulled(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    StockImporter(user.id).run(make_import_data(goods_count=3))
+    result = StockImporter(user.id).run(make_import_data(goods_count=2, quantity=5))
+    assert result["status"] == "success"
+    stocks = Stock.objects.filter(supplier__user=user)
+    assert stocks.count() == 3
+    assert stocks.get(sku="1000").quantity == 5
+    assert stocks.get(sku="1002").quantity == 0
+    assert ProductCharacteristic.objects.filter(stock__supplier__user=user).count() == 6
+
+
+@pytest.mark.django_db
+def test_bulk_import_category_another_name(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    Category.objects.create(id=101, name="Не хлеб")
+    result = StockImporter(user.id).run(make_import_data())
+    assert result == {
+        "status": "fail",
+        "detail": "Category with id from your file already exists with another name",
+    }
+    assert not Supplier.objects.filter(user=user).exists()
+
+
+@pytest.mark.django_db
+def test_bulk_import_supplier_does_not_exist(half_base):
+    result = StockImporter().run(make_import_data())
+    assert result == {"status": "fail", "detail": "Indicted supplier does not exist"}
+
+
+@pytest.mark.django_db
+def test_bulk_import_queries_do_not_depend_on_goods_count(
+    half_base, django_assert_max_num_queries
+):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    StockImporter(user.id).run(make_import_data(goods_count=10))
+    with django_assert_max_num_queries(28):
+        StockImporter(user.id).run(make_import_data(goods_count=500))
+
+
+def test_read_yaml_price_list_streams_goods():
+    stream = io.BytesIO(
+        yaml.dump(make_import_data(goods_count=3), allow_unicode=True, sort_keys=False).encode()
+    )
+    data = read_price_list(iter_yaml(stream))
+    assert data["shop"] == "Каравай"
+    assert data["categories"] == [{"id": 101, "name": "Хлеб"}, {"id": 102, "name": "Выпечка"}]
+    assert not isinstance(data["goods"], list)
+    assert [good["id"] for good in data["goods"]] == [1000, 1001, 1002]
+
+
+def test_read_json_lines_price_list():
+    source = make_import_data(goods_count=2)
+    lines = [json.dumps({"shop": source["shop"], "categories": source["categories"]}), ""]
+    lines += [json.dumps(good) for good in source["goods"]]
+    data = read_price_list(iter_json_lines(lines))
+    assert data["shop"] == "Каравай"
+    assert list(data["goods"]) == source["goods"]
+
+
+def test_read_price_list_goods_before_header():
+    lines = [json.dumps({"id": 1}), json.dumps({"shop": "Каравай", "categories": []})]
+    with pytest.raises(ImportFailed):
+        read_price_list(iter_json_lines(lines))
+
+
+def test_read_yaml_price_list_invalid():
+    with pytest.raises(ImportFailed):
+        read_price_list(iter_yaml(io.BytesIO(b"shop: [unclosed")))
+
+
+def test_is_json_lines():
+    assert is_json_lines("https://example.com/price.jsonl")
+    assert is_json_lines("https://example.com/price", "application/x-ndjson; charset=utf-8")
+    assert not is_json_lines("https://example.com/price.yaml", "text/yaml")
+
+
+@pytest.mark.django_db
+def test_delta_import_counts(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    result = StockImporter(user.id, delta=True).run(make_import_data(goods_count=4))
+    assert result["counts"] == {"unchanged": 0, "updated": 0, "created": 4, "zeroed": 0, "invalid": 0}
+
+    data = make_import_data(goods_count=3)
+    data["goods"][0]["price"] = 99
+    data["goods"][1]["parameters"]["Мука"] = "ржаная"
+    result = StockImporter(user.id, delta=True).run(data)
+    assert result["counts"] == {"unchanged": 1, "updated": 2, "created": 0, "zeroed": 1, "invalid": 0}
+    assert Stock.objects.get(supplier__user=user, sku="1000").price == 99
+    assert ProductCharacteristic.objects.get(
+        stock__supplier__user=user, stock__sku="1001", characteristic__name="Мука"
+    ).value == "ржаная"
+    assert Stock.objects.get(supplier__user=user, sku="1003").quantity == 0
+
+
+@pytest.mark.django_db
+def test_delta_import_rewrites_amended_stock(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    StockImporter(user.id, delta=True).run(make_import_data(goods_count=2))
+    Stock.objects.filter(supplier__user=user, sku="1000").update(quantity=1)
+    characteristic = ProductCharacteristic.objects.filter(
+        stock__supplier__user=user, stock__sku="1001"
+    ).first()
+    characteristic.value = "другое"
+    characteristic.save()
+
+    result = StockImporter(user.id, delta=True).run(make_import_data(goods_count=2))
+    assert result["counts"] == {"unchanged": 0, "updated": 2, "created": 0, "zeroed": 0, "invalid": 0}
+    assert Stock.objects.get(supplier__user=user, sku="1000").quantity == 10
+    assert not ProductCharacteristic.objects.filter(value="другое").exists()
+
+
+@pytest.mark.django_db
+def test_full_import_rewrites_unchanged_stocks(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    StockImporter(user.id).run(make_import_data(goods_count=2))
+    result = StockImporter(user.id, delta=False).run(make_import_data(goods_count=2))
+    assert result["counts"] == {"unchanged": 0, "updated": 2, "created": 0, "zeroed": 0, "invalid": 0}
+
+
+@pytest.mark.django_db
+def test_import_delta_not_boolean(client, half_base):
+    data = {"url": "https://example.com/shop.yaml", "delta": "yes"}
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["breadsupplier"]}')
+    response = client.post("/api/v1/import/", data=data, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"delta": ["Must be a valid boolean."]}
+
+
+@pytest.mark.django_db
+def test_chunked_import(half_base, eager_celery):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    StockImporter(user.id).run(make_import_data(goods_count=7))
+    data = make_import_data(goods_count=5, quantity=3)
+    result = import_in_chunks(StockImporter(user.id), data, batched(data["goods"], 2))
+    assert result["status"] == "processing"
+    assert result["chunks_total"] == 3
+    stocks = Stock.objects.filter(supplier__user=user)
+    assert stocks.filter(quantity=3).count() == 5
+    assert stocks.filter(quantity=0).count() == 2
+    assert not ImportChunk.objects.exists()
+
+
+@pytest.mark.django_db
+def test_chunked_import_validates_staged_chunks_once(half_base, eager_celery, monkeypatch):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    data = make_import_data(goods_count=5)
+    del data["goods"][2]["price"]
+    staged = []
+    validated = []
+    original_create = ImportChunk.objects.create
+    original_validate = StockImporter.validate
+    monkeypatch.setattr(
+        ImportChunk.objects, "create", lambda **fields: staged.append(fields["goods"]) or original_create(**fields)
+    )
+
+    def validate(importer, goods, first_row=1):
+        validated.append(first_row)
+        return original_validate(importer, goods, first_row)
+
+    monkeypatch.setattr(StockImporter, "validate", validate)
+
+    result = import_in_chunks(StockImporter(user.id), data, batched(data["goods"], 2))
+    assert result["chunks_total"] == 3
+    assert [len(goods) for goods in staged] == [2, 2, 1]
+    assert validated == [1, 3, 5]
+    assert not ImportChunk.objects.exists()
+    finished = AsyncResult(result["callback_id"]).result
+    assert finished["counts"]["created"] == 4
+    assert finished["errors"] == [{"row": 3, "sku": "1002", "errors": ['Field "price" is required']}]
+    assert finished["supplier_id"] == Supplier.objects.get(user=user).id
+
+
+def test_finish_import_merges_chunks():
+    error = {"row": 3, "sku": "1002", "errors": ['Field "price" is required']}
+    chunk = {"status": "success", "rows": 2, "stock_ids": [1, 2], "errors": [error],
+             "counts": {"unchanged": 1, "updated": 1, "created": 0, "zeroed": 0, "invalid": 1}}
+    failed_chunk = {"status": "fail", "detail": "Import file contains duplicated goods", "rows": 0,
+                    "stock_ids": [], "errors": [],
+                    "counts": {"unchanged": 0, "updated": 0, "created": 0, "zeroed": 0, "invalid": 0}}
+    result = StockImporter().finish([chunk, failed_chunk, failed_chunk])
+    assert result == {
+        "status": "fail",
+        "detail": "Import file contains duplicated goods",
+        "counts": {"unchanged": 1, "updated": 1, "created": 0, "zeroed": 0, "invalid": 1},
+        "errors": [error],
+    }
+
+
+@pytest.mark.django_db
+def test_import_skips_invalid_goods(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    data = make_import_data(goods_count=5)
+    del data["goods"][1]["price"]
+    data["goods"][2]["quantity"] = -1
+    data["goods"][3]["category"] = 999
+    result = StockImporter(user.id).run(data)
+    assert result["status"] == "success"
+    assert result["detail"] == "Import or update performed successfully, 3 invalid goods skipped"
+    assert result["counts"]["created"] == 2
+    assert result["errors"] == [
+        {"row": 2, "sku": "1001", "errors": ['Field "price" is required']},
+        {"row": 3, "sku": "1002", "errors": ['Field "quantity" must be a non-negative integer']},
+        {"row": 4, "sku": "1003", "errors": ["Category with id 999 does not exist"]},
+    ]
+    assert Stock.objects.filter(supplier__user=user).count() == 2
+
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("category", ["abc", "101", [101], {}, True, 101.0])
+def test_import_invalid_category_type(half_base, category):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    data = make_import_data(goods_count=3)
+    data["goods"][1]["category"] = category
+    result = StockImporter(user.id).run(data)
+    assert result["status"] == "success"
+    assert result["counts"]["created"] == 2
+    assert result["errors"] == [
+        {"row": 2, "sku": "1001", "errors": ['Field "category" must be an integer id of category']}
+    ]
+    assert not Stock.objects.filter(supplier__user=user, sku="1001").exists()
+
+@pytest.mark.django_db
+def test_import_errors_limit(half_base, settings):
+    settings.IMPORT_ERRORS_LIMIT = 2
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    data = make_import_data(goods_count=5)
+    for good in data["goods"]:
+        good["price"] = "free"
+    result = StockImporter(user.id).run(data)
+    assert result["counts"]["invalid"] == 5
+    assert len(result["errors"]) == 2
+
+
+@pytest.mark.django_db
+def test_import_report_not_finished(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["breadsupplier"]}')
+    response = client.get("/api/v1/import/unknown-task/report/")
+    assert response.status_code == 404
+    assert response.json() == {"error": "Import is not finished or task does not exist"}
+
+
+@pytest.mark.django_db
+def test_import_report_purchaser_token(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["minimarket"]}')
+    response = client.get("/api/v1/import/unknown-task/report/")
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_import_report_only_for_own_supplier(client, half_base, monkeypatch):
+    supplier = Supplier.objects.get(name="Выборжец")
+    error = {"row": 3, "sku": "1002", "errors": ['Field "price" is required']}
+    result = {"status": "success", "detail": "", "errors": [error], "supplier_id": supplier.id}
+    monkeypatch.setattr("procurement_supply.views.AsyncResult", lambda task_id, app: SimpleNamespace(result=result))
+
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["grainsupplier"]}')
+    response = client.get("/api/v1/import/task/report/")
+    assert response.status_code == 404
+
+    for token in ("vegsupplier", "admin"):
+        client.credentials(HTTP_AUTHORIZATION=f"Token {half_base[token]}")
+        response = client.get("/api/v1/import/task/report/")
+        assert response.status_code == 200
+        assert response.content.decode().splitlines() == ["row,sku,errors", '3,1002,"Field ""price"" is required"']
+
+
+class PriceListHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.path != "/shop.yaml":
+            self.send_error(404)
+            return
+        etag = f'"{hashlib.sha256(server.body).hexdigest()}"'
+        if server.conditional and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-yaml")
+        self.send_header("Content-Length", str(len(server.body)))
+        if server.conditional:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def price_list_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PriceListHandler)
+    server.body = yaml.dump(make_import_data(), allow_unicode=True, sort_keys=False).encode()
+    server.conditional = True
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}/shop.yaml"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.django_db
+def test_import_not_modified(half_base, price_list_server, django_assert_max_num_queries):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    assert do_import(price_list_server.url, user.id)["status"] == "success"
+    source = ImportSource.objects.get(supplier__user=user, url=price_list_server.url)
+    assert source.content_hash == hashlib.sha256(price_list_server.body).hexdigest()
+    with django_assert_max_num_queries(1):
+        result = do_import(price_list_server.url, user.id)
+    assert result == {"status": "success", "detail": "Import file is not modified since last import", "skipped": True}
+    assert price_list_server.requests[-1]["If-None-Match"] == f'"{source.content_hash}"'
+
+
+@pytest.mark.django_db
+def test_import_content_not_changed(half_base, price_list_server, django_assert_max_num_queries):
+    price_list_server.conditional = False
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    assert do_import(price_list_server.url, user.id)["status"] == "success"
+    with django_assert_max_num_queries(2):
+        result = do_import(price_list_server.url, user.id)
+    assert result["detail"] == "Import file content is not changed since last import"
+    price_list_server.body = yaml.dump(make_import_data(quantity=5), allow_unicode=True, sort_keys=False).encode()
+    result = do_import(price_list_server.url, user.id)
+    assert result["counts"]["updated"] == 3
+    assert not Stock.objects.filter(supplier__user=user).exclude(quantity=5).exists()
+
+
+@pytest.mark.django_db
+def test_full_import_ignores_import_source(half_base, price_list_server):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    do_import(price_list_server.url, user.id)
+    result = do_import(price_list_server.url, user.id, delta=False)
+    assert result["counts"]["unchanged"] == 0
+    assert result["counts"]["updated"] == 3
+    assert "If-None-Match" not in price_list_server.requests[-1]
+
+
+@pytest.mark.django_db
+def test_import_http_error(half_base, price_list_server):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    result = do_import(price_list_server.url.replace("shop.yaml", "missing.yaml"), user.id)
+    assert result == {"status": "fail", "detail": "Import file could not be downloaded: HTTP 404"}
+
+
+@pytest.mark.django_db
+def test_import_supplier_locked(half_base, price_list_server):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    do_import(price_list_server.url, user.id, delta=False)
+    supplier = Supplier.objects.get(user=user)
+    assert lock_supplier(supplier.id, "another import")
+    result = do_import(price_list_server.url, user.id, delta=False)
+    assert result == {"status": "fail", "detail": "Import of this supplier is already in progress"}
+    unlock_supplier(supplier.id, "another import")
+    assert do_import(price_list_server.url, user.id, delta=False)["status"] == "success"
+    supplier.refresh_from_db()
+    assert supplier.import_lock == ""
+    assert supplier.import_locked_until is None
+
+
+@pytest.mark.django_db
+def test_import_lock_expires(half_base):
+    supplier = Supplier.objects.first()
+    assert lock_supplier(supplier.id, "first")
+    assert not lock_supplier(supplier.id, "second")
+    unlock_supplier(supplier.id, "second")
+    assert Supplier.objects.get(id=supplier.id).import_lock == "first"
+    Supplier.objects.filter(id=supplier.id).update(import_locked_until=timezone.now() - timedelta(seconds=1))
+    assert lock_supplier(supplier.id, "second")
+
+
+@pytest.mark.django_db
+def test_schedule_imports(half_base, price_list_server, eager_celery):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    do_import(price_list_server.url, user.id)
+    source = ImportSource.objects.get(supplier__user=user)
+    source.refresh_interval = 30
+    source.save()
+    price_list_server.body = yaml.dump(make_import_data(quantity=5), allow_unicode=True, sort_keys=False).encode()
+    assert schedule_imports() == {"status": "success", "detail": "1 imports scheduled"}
+    assert not Stock.objects.filter(supplier__user=user).exclude(quantity=5).exists()
+    source.refresh_from_db()
+    assert source.next_import_at > timezone.now() + timedelta(minutes=29)
+    assert schedule_imports()["detail"] == "0 imports scheduled"
+
+
+@pytest.mark.django_db
+def test_schedule_imports_skips_locked_supplier(half_base):
+    supplier = Supplier.objects.first()
+    ImportSource.objects.create(supplier=supplier, url="http://127.0.0.1:1/shop.yaml", refresh_interval=30)
+    lock_supplier(supplier.id, "import")
+    assert schedule_imports()["detail"] == "0 imports scheduled"
+    assert ImportSource.objects.get(supplier=supplier).next_import_at is None
+
+
+def test_import_progress_measures_writing_only(monkeypatch):
+    states = []
+    task = SimpleNamespace(
+        request=SimpleNamespace(called_directly=False, is_eager=False),
+        update_state=lambda state, meta: states.append(meta),
+    )
+    now = [100.0]
+    monkeypatch.setattr("procurement_supply.tasks.time.monotonic", lambda: now[0])
+    progress = ImportProgress(task)
+    assert len(list(progress.count(range(1000)))) == 1000
+    now[0] = 160.0
+    progress(0)
+    assert states[-1] == {"rows_parsed": 1000, "rows_written": 0, "rows_per_second": 0, "eta_seconds": None}
+
+    progress.start_writing()
+    now[0] = 170.0
+    progress(250)
+    assert states[-1] == {"rows_parsed": 1000, "rows_written": 250, "rows_per_second": 25.0, "eta_seconds": 30.0}
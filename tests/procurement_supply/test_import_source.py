@@ -0,0 +1,105 @@
+import pytest
+from rest_framework.authtoken.models import Token
+
+from procurement_supply.models import ImportSource, Supplier
+
+URL = "https://example.com/shop.yaml"
+
+
+@pytest.mark.django_db
+def test_create_import_source_no_token(client, half_base):
+    response = client.post("/api/v1/import_sources/", data={"url": URL}, format="json")
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Authentication credentials were not provided."}
+
+
+@pytest.mark.django_db
+def test_create_import_source_purchaser_token(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["minimarket"]}')
+    response = client.post("/api/v1/import_sources/", data={"url": URL}, format="json")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "You do not have permission to perform this action."}
+
+
+@pytest.mark.django_db
+def test_create_import_source_supplier_no_instance_token(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["breadsupplier"]}')
+    response = client.post("/api/v1/import_sources/", data={"url": URL}, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"error": "you need to create Supplier before you create ImportSource"}
+
+
+@pytest.mark.django_db
+def test_create_import_source_supplier_token(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    data = {"url": URL, "refresh_interval": 60}
+    response = client.post("/api/v1/import_sources/", data=data, format="json")
+    assert response.status_code == 201
+    reply = response.json()
+    supplier = Supplier.objects.get(user=Token.objects.get(key=half_base["vegsupplier"]).user)
+    assert reply["supplier"] == supplier.id
+    assert reply["refresh_interval"] == 60
+    assert reply["next_import_at"] is None
+    response = client.post("/api/v1/import_sources/", data=data, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"error": "Import source with this url already exists"}
+
+
+@pytest.mark.django_db
+def test_create_import_source_interval_invalid(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    response = client.post("/api/v1/import_sources/", data={"url": URL, "refresh_interval": 0}, format="json")
+    assert response.status_code == 400
+    assert "refresh_interval" in response.json()
+
+
+@pytest.mark.django_db
+def test_list_import_sources(client, half_base):
+    for supplier in Supplier.objects.all():
+        ImportSource.objects.create(supplier=supplier, url=URL)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    response = client.get("/api/v1/import_sources/")
+    assert response.status_code == 200
+    assert response.json()["count"] == 1
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["minimarket"]}')
+    assert client.get("/api/v1/import_sources/").json()["count"] == 0
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    assert client.get("/api/v1/import_sources/").json()["count"] == Supplier.objects.count()
+
+
+@pytest.mark.django_db
+def test_update_import_source(client, half_base):
+    supplier = Supplier.objects.get(user=Token.objects.get(key=half_base["vegsupplier"]).user)
+    source = ImportSource.objects.create(
+        supplier=supplier, url=URL, etag='"abc"', content_hash="abc", refresh_interval=60
+    )
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["grainsupplier"]}')
+    response = client.patch(f"/api/v1/import_sources/{source.id}/", data={"refresh_interval": 5}, format="json")
+    assert response.status_code == 404
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    data = {"url": "https://example.com/shop2.yaml", "refresh_interval": 5}
+    response = client.patch(f"/api/v1/import_sources/{source.id}/", data=data, format="json")
+    assert response.status_code == 200
+    source.refresh_from_db()
+    assert (source.url, source.refresh_interval, source.etag, source.content_hash) == (data["url"], 5, "", "")
+
+
+@pytest.mark.django_db
+def test_update_import_source_supplier(client, half_base):
+    supplier = Supplier.objects.get(user=Token.objects.get(key=half_base["vegsupplier"]).user)
+    source = ImportSource.objects.create(supplier=supplier, url=URL)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    other = Supplier.objects.exclude(id=supplier.id).first()
+    response = client.patch(f"/api/v1/import_sources/{source.id}/", data={"supplier": other.id}, format="json")
+    assert response.status_code == 403
+    assert response.json() == {"error": "supplier cannot be amended"}
+
+
+@pytest.mark.django_db
+def test_delete_import_source(client, half_base):
+    supplier = Supplier.objects.get(user=Token.objects.get(key=half_base["vegsupplier"]).user)
+    source = ImportSource.objects.create(supplier=supplier, url=URL)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    response = client.delete(f"/api/v1/import_sources/{source.id}/")
+    assert response.status_code == 204
+    assert not ImportSource.objects.exists()
@@ -0,0 +1,114 @@
+from datetime import timedelta
+from smtplib import SMTPServerDisconnected
+
+import pytest
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.utils import timezone
+
+from procurement_supply.models import ChainStore, Notification
+from procurement_supply.tasks import dispatch_notifications
+
+
+@pytest.mark.django_db
+def test_dispatch_notifications_waits_for_window(settings):
+    settings.NOTIFICATION_DIGEST_WINDOW = 60
+    Notification.enqueue(("Subject", "Message", "first@mail.ru"))
+    assert dispatch_notifications()["detail"] == "0 notifications sent in 0 emails"
+    assert not mail.outbox
+
+    Notification.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+    assert dispatch_notifications()["detail"] == "1 notifications sent in 1 emails"
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].subject == "Subject"
+    assert mail.outbox[0].body == "Message"
+    assert mail.outbox[0].to == ["first@mail.ru"]
+
+
+@pytest.mark.django_db
+def test_dispatch_notifications_coalesces_recipient(settings):
+    settings.NOTIFICATION_DIGEST_WINDOW = 60
+    Notification.enqueue(
+        ("First", "First message", "first@mail.ru"),
+        ("Second", "Second message", "first@mail.ru"),
+        ("Other", "Other message", "second@mail.ru"),
+    )
+    Notification.objects.update(created_at=timezone.now() - timedelta(seconds=61))
+    Notification.enqueue(("Third", "Third message", "first@mail.ru"))
+
+    assert dispatch_notifications()["detail"] == "4 notifications sent in 2 emails"
+    messages = {message.to[0]: message for message in mail.outbox}
+    assert messages["first@mail.ru"].subject == "You have 3 new notifications"
+    assert messages["first@mail.ru"].body == (
+        "First\nFirst message\n\nSecond\nSecond message\n\nThird\nThird message"
+    )
+    assert messages["second@mail.ru"].subject == "Other"
+    assert not Notification.objects.filter(sent_at__isnull=True).exists()
+
+    mail.outbox.clear()
+    dispatch_notifications(window=0)
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_dispatch_notifications_reuses_connection(settings, monkeypatch):
+    settings.NOTIFICATION_BATCH_SIZE = 2
+    opened = []
+    monkeypatch.setattr(EmailBackend, "open", lambda backend: opened.append(backend), raising=False)
+    Notification.enqueue(*[("Subject", f"Message {number}", f"user{number}@mail.ru") for number in range(5)])
+
+    assert dispatch_notifications(window=0)["detail"] == "5 notifications sent in 5 emails"
+    assert len(mail.outbox) == 5
+    assert len(opened) == 1
+
+
+@pytest.mark.django_db
+def test_dispatch_notifications_marks_only_sent_digests(monkeypatch):
+    Notification.enqueue(*[("Subject", f"Message {number}", f"user{number}@mail.ru") for number in range(5)])
+    send_messages = EmailBackend.send_messages
+
+    def fail_third(backend, messages):
+        if len(mail.outbox) == 2:
+            raise SMTPServerDisconnected("Connection unexpectedly closed")
+        return send_messages(backend, messages)
+
+    monkeypatch.setattr(EmailBackend, "send_messages", fail_third)
+    result = dispatch_notifications(window=0)
+    assert result == {
+        "status": "fail",
+        "detail": "2 notifications sent in 2 emails, sending failed: Connection unexpectedly closed",
+    }
+    sent = [message.to[0] for message in mail.outbox]
+    assert set(Notification.objects.filter(sent_at__isnull=False).values_list("email", flat=True)) == set(sent)
+
+    monkeypatch.setattr(EmailBackend, "send_messages", send_messages)
+    assert dispatch_notifications(window=0)["detail"] == "3 notifications sent in 3 emails"
+    assert len(mail.outbox) == 5
+    assert len({message.to[0] for message in mail.outbox}) == 5
+
+@pytest.mark.django_db
+def test_dispatch_notifications_deletes_old_notifications(settings):
+    Notification.enqueue(("Old", "Message", "first@mail.ru"), ("New", "Message", "first@mail.ru"))
+    Notification.objects.filter(subject="Old").update(
+        sent_at=timezone.now() - timedelta(seconds=settings.NOTIFICATION_TTL + 1)
+    )
+    dispatch_notifications(window=0)
+    assert list(Notification.objects.values_list("subject", flat=True)) == ["New"]
+    assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_create_order_puts_notifications_into_outbox(client, full_base, eager_celery):
+    Notification.objects.all().delete()
+    mail.outbox.clear()
+    store = ChainStore.objects.filter(name="Ленинский").first()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["supermarket"]}')
+    response = client.post("/api/v1/orders/", data={"chain_store": store.id}, format="json")
+    assert response.status_code == 201
+    assert not mail.outbox
+    subjects = list(Notification.objects.values_list("subject", flat=True))
+    assert subjects and set(subjects) == {"New order"}
+
+    dispatch_notifications(window=0)
+    assert len(mail.outbox) == 1
+    assert not Notification.objects.filter(sent_at__isnull=True).exists()
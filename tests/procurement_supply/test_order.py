@@ -1,4 +1,10 @@
+from io import StringIO
+
 import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 
 from procurement_supply.models import (CartPosition, ChainStore, Order,
                                        OrderPosition, Purchaser, Stock)
@@ -173,6 +179,29 @@ def test_create_order_purchaser_success_combined_order_multiplier(client, full_b
     assert positions[3].price == 150
 
 
+@pytest.mark.django_db
+def test_create_order_queries_do_not_depend_on_cart_size(client, full_base):
+    store = ChainStore.objects.filter(name="Германа").first()
+    cart = Purchaser.objects.filter(name="ОК").first().shopping_cart
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    with CaptureQueriesContext(connection) as small_cart:
+        response = client.post("/api/v1/orders/", data={"chain_store": store.id}, format="json")
+    assert response.status_code == 201
+
+    stocks = Stock.objects.all()
+    CartPosition.objects.bulk_create(
+        [CartPosition(shopping_cart=cart, stock=stock, quantity=1, price=stock.price) for stock in stocks]
+    )
+    with CaptureQueriesContext(connection) as large_cart:
+        response = client.post("/api/v1/orders/", data={"chain_store": store.id}, format="json")
+    assert response.status_code == 201
+    reply = response.json()
+    assert reply["total_quantity"] == stocks.count()
+    assert OrderPosition.objects.filter(order_id=reply["id"]).count() == stocks.count() > 3
+    assert not cart.cart_positions.exists()
+    assert len(large_cart) == len(small_cart)
+
+
 @pytest.mark.django_db
 def test_list_order_no_token(client, full_base):
     response = client.get("/api/v1/orders/", format="json")
@@ -235,6 +264,111 @@ def test_list_order_supplier_with_orders_token(client, full_base):
     assert reply["count"] == 2
 
 
+@pytest.mark.django_db
+def test_order_summary_matches_positions(full_base):
+    orders = list(Order.objects.with_totals())
+    assert orders
+    for order in orders:
+        positions = list(order.order_positions.select_related("stock"))
+        assert order.calculate_summary() == Order.summarize(positions)
+        assert order.total_quantity == sum(position.quantity for position in positions)
+        assert order.position_count == len(positions)
+        assert order.confirmed == all(position.confirmed for position in positions)
+        assert order.delivered == all(position.delivered for position in positions)
+    assert not list(Order.objects.stale_summaries())
+
+
+@pytest.mark.django_db
+def test_order_summary_follows_position_changes(full_base):
+    position = OrderPosition.objects.filter(confirmed=False).first()
+    order = position.order
+    confirmed_count = order.confirmed_count
+    position.confirmed = True
+    position.save()
+    order.refresh_from_db()
+    assert order.confirmed_count == confirmed_count + 1
+    position.confirmed = False
+    position.save()
+    order.refresh_from_db()
+    assert order.confirmed_count == confirmed_count
+
+    amount = order.total_amount
+    position.quantity += 10
+    position.save()
+    order.refresh_from_db()
+    assert order.total_amount > amount
+    position.delete()
+    order.refresh_from_db()
+    assert not list(Order.objects.filter(id=order.id).stale_summaries())
+
+
+@pytest.mark.django_db
+def test_list_order_filter_and_ordering(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    response = client.get("/api/v1/orders/?ordering=-total_amount", format="json")
+    assert response.status_code == 200
+    amounts = [reply["total_amount"] for reply in response.json()["results"]]
+    assert amounts == sorted(amounts, reverse=True)
+
+    response = client.get("/api/v1/orders/?total_amount__gte=100000&confirmed=false", format="json")
+    assert response.status_code == 200
+    replies = response.json()["results"]
+    expected = Order.objects.filter(total_amount__gte=100000).exclude(confirmed_count=F("position_count"))
+    assert {reply["id"] for reply in replies} == set(expected.values_list("id", flat=True))
+    assert all(reply["total_amount"] >= 100000 and not reply["confirmed"] for reply in replies)
+
+
+@pytest.mark.django_db
+def test_rebuild_order_summary_command(full_base):
+    order = Order.objects.first()
+    Order.objects.filter(id=order.id).update(total_amount=1, confirmed_count=100)
+    out = StringIO()
+    with pytest.raises(CommandError, match="1 order summaries are stale"):
+        call_command("rebuild_order_summary", "--check", stdout=out)
+    assert f"Order #{order.id}: total_amount 1.00 != {order.total_amount}" in out.getvalue()
+
+    call_command("rebuild_order_summary", stdout=out)
+    assert "1 order summaries rebuilt" in out.getvalue()
+    refreshed = Order.objects.get(id=order.id)
+    assert (refreshed.total_amount, refreshed.confirmed_count) == (order.total_amount, order.confirmed_count)
+    call_command("rebuild_order_summary", "--check", stdout=out)
+    assert "All order summaries are consistent" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_list_order_supplier_totals_include_all_positions(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    response = client.get("/api/v1/orders/", format="json")
+    assert response.status_code == 200
+    for reply in response.json()["results"]:
+        order = Order.objects.get(id=reply["id"])
+        assert reply["total_quantity"] == order.total_quantity
+        assert reply["total_amount"] == order.total_amount
+        assert len(reply["order_positions"]) == order.order_positions.count()
+
+
+@pytest.mark.django_db
+def test_list_order_queries_do_not_depend_on_orders_count(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    with CaptureQueriesContext(connection) as few_orders:
+        response = client.get("/api/v1/orders/", format="json")
+    assert response.status_code == 200
+
+    for order in list(Order.objects.all()):
+        positions = list(order.order_positions.all())
+        order.id = None
+        order.save()
+        for position in positions:
+            position.id = None
+            position.order = order
+        OrderPosition.objects.bulk_create(positions)
+    with CaptureQueriesContext(connection) as many_orders:
+        response = client.get("/api/v1/orders/", format="json")
+    assert response.status_code == 200
+    assert response.json()["count"] == 14
+    assert len(many_orders) == len(few_orders)
+
+
 @pytest.mark.django_db
 def test_retrieve_order_no_token(client, full_base):
     order = Order.objects.filter(
@@ -454,10 +588,14 @@ def test_destroy_order_success(client, full_base):
         purchaser__name="ОК", chain_store__name="Германа"
     ).first()
     client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    restored = [
+        {"stock": stock_id, "quantity": quantity}
+        for stock_id, quantity in order.order_positions.order_by("stock_id").values_list("stock_id", "quantity")
+    ]
     response = client.delete(f"/api/v1/orders/{order.id}/", format="json")
     assert response.status_code == 200
     reply = response.json()
-    assert reply == {"success": "Order cancelled"}
+    assert reply == {"success": "Order cancelled", "restored": restored}
     assert (
         Order.objects.filter(purchaser__name="ОК", chain_store__name="Германа")
         .first()
@@ -502,6 +640,25 @@ def test_destroy_order_success(client, full_base):
     )
 
 
+@pytest.mark.django_db
+def test_destroy_order_queries_do_not_depend_on_positions_count(client, full_base, django_assert_max_num_queries):
+    order = Order.objects.filter(purchaser__name="ОК", chain_store__name="Германа").first()
+    stocks = Stock.objects.exclude(order_positions__order=order)
+    OrderPosition.objects.bulk_create(
+        [OrderPosition(order=order, stock=stock, quantity=1, price=stock.price) for stock in stocks]
+    )
+    quantities = dict(Stock.objects.values_list("id", "quantity"))
+    restored = dict(order.order_positions.values_list("stock_id", "quantity"))
+    assert len(restored) > 10
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    with django_assert_max_num_queries(13):
+        response = client.delete(f"/api/v1/orders/{order.id}/", format="json")
+    assert response.status_code == 200
+    assert len(response.json()["restored"]) == len(restored)
+    for stock_id, quantity in Stock.objects.values_list("id", "quantity"):
+        assert quantity == quantities[stock_id] + restored.get(stock_id, 0)
+
+
 @pytest.mark.django_db
 def test_update_order_no_token(client, full_base):
     order = Order.objects.filter(
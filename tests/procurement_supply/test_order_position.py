@@ -1,6 +1,14 @@
+from decimal import Decimal
+
 import pytest
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from procurement_supply.models import (OrderPosition,  Stock)
+from procurement_supply.models import (Characteristic, Notification, Order,
+                                       OrderPosition, ProductCharacteristic,
+                                       Stock)
+from procurement_supply.tasks import dispatch_notifications
 
 
 @pytest.mark.django_db
@@ -65,6 +73,15 @@ def test_list_order_position_supplier_with_order_token(client, full_base):
     assert reply["count"] == 6
 
 
+@pytest.mark.django_db
+def test_list_order_position_ordered_by_order_id_and_price(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    response = client.get("/api/v1/order_positions/", {"page_size": 100})
+    assert response.status_code == 200
+    keys = [(position["order"], Decimal(position["price"])) for position in response.json()["results"]]
+    assert len(keys) == 19
+    assert keys == sorted(keys)
+
 @pytest.mark.django_db
 def test_list_order_position_filter_cancelled(client, full_base):
     client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["grainsupplier"]}')
@@ -352,3 +369,179 @@ def test_update_order_position_undeliver(client, full_base):
     reply = response.json()
     assert reply == {"error": "Your cannot revoke your delivery"}
     assert OrderPosition.objects.filter(quantity=500, price=100).first().delivered
+
+
+@pytest.mark.django_db
+def test_update_order_position_tracks_changes_without_queries(client, full_base, eager_celery):
+    position = OrderPosition.objects.filter(stock__product__name="Aqua minerale").first()
+    email = position.order.purchaser.user.email
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["juice1supplier"]}')
+    Notification.objects.all().delete()
+    mail.outbox.clear()
+    with CaptureQueriesContext(connection) as context:
+        response = client.patch(f"/api/v1/order_positions/{position.id}/", data={"confirmed": True}, format="json")
+    assert response.status_code == 200
+    position_selects = [
+        query for query in context.captured_queries
+        if query["sql"].startswith("SELECT") and 'FROM "procurement_supply_orderposition"' in query["sql"]
+    ]
+    user_selects = [query for query in context.captured_queries if 'FROM "procurement_supply_user"' in query["sql"]]
+    assert len(position_selects) == 1
+    assert len(user_selects) == 1
+    assert not [
+        query for query in context.captured_queries
+        if 'FROM "procurement_supply_order"' in query["sql"] or 'FROM "procurement_supply_purchaser"' in query["sql"]
+    ]
+    dispatch_notifications(window=0)
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == [email]
+    assert f"Your order #{position.order_id} position {position.id} was\n- confirmed\n" in mail.outbox[0].body
+    order = Order.objects.get(id=position.order_id)
+    assert order.confirmed_count == order.order_positions.filter(confirmed=True).count()
+
+
+@pytest.mark.django_db
+def test_list_order_position_queries_do_not_depend_on_characteristics(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    ProductCharacteristic.objects.all().delete()
+    with CaptureQueriesContext(connection) as no_characteristics:
+        response = client.get("/api/v1/order_positions/", format="json")
+    assert response.status_code == 200
+
+    characteristics = Characteristic.objects.bulk_create(
+        [Characteristic(name=f"Характеристика {number}") for number in range(3)]
+    )
+    ProductCharacteristic.objects.bulk_create(
+        [
+            ProductCharacteristic(stock=stock, characteristic=characteristic, value=characteristic.name[-1])
+            for stock in Stock.objects.all() for characteristic in characteristics
+        ]
+    )
+    with CaptureQueriesContext(connection) as many_characteristics:
+        response = client.get("/api/v1/order_positions/", format="json")
+    assert response.status_code == 200
+    for position in response.json()["results"]:
+        assert position["stock"]["product_characteristics"] == {
+            "Характеристика 0": "0", "Характеристика 1": "1", "Характеристика 2": "2"
+        }
+    assert len(many_characteristics) == len(no_characteristics)
+
+
+@pytest.mark.django_db
+def test_order_position_snapshot(full_base):
+    position = OrderPosition.objects.filter(confirmed=False).first()
+    assert not position.was_changed("confirmed", "delivered")
+    position.confirmed = True
+    assert position.was_changed("confirmed")
+    position.save()
+    assert not position.was_changed("confirmed")
+    assert OrderPosition.objects.only("id", "confirmed").get(id=position.id).was_changed("quantity")
+
+
+@pytest.mark.django_db
+def test_update_status_of_many_order_positions(full_base, eager_celery, django_assert_max_num_queries):
+    positions = OrderPosition.objects.filter(order__status="saved")
+    expected = {
+        order_id: positions.filter(order_id=order_id).count()
+        for order_id in positions.values_list("order_id", flat=True).distinct()
+    }
+    orders = set(positions.filter(delivered=False).values_list("order_id", flat=True))
+    Notification.objects.all().delete()
+    mail.outbox.clear()
+    with django_assert_max_num_queries(6):
+        changed = positions.update_status(confirmed=True, delivered=True)
+    assert changed
+    assert not positions.filter(delivered=False).exists()
+    for order in Order.objects.filter(id__in=expected):
+        assert order.confirmed_count == order.delivered_count == order.position_count == expected[order.id]
+    assert not list(Order.objects.stale_summaries())
+    notifications = Notification.objects.all()
+    assert {int(notification.message.split("#")[1].split()[0]) for notification in notifications} == orders
+    assert len(notifications) == len(orders)
+    dispatch_notifications(window=0)
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].subject == f"You have {len(orders)} new notifications"
+    assert positions.update_status(confirmed=True) == []
+
+
+@pytest.mark.django_db
+def test_bulk_order_positions_purchaser_token(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
+    response = client.post("/api/v1/order_positions/bulk/", data={"order": 1, "confirmed": True}, format="json")
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize(
+    "data,error",
+    [
+        ({"confirmed": True}, 'Either "positions" or "order" field is required'),
+        ({"order": 1, "positions": [1], "confirmed": True}, 'Either "positions" or "order" field is required'),
+        ({"order": 1}, '"confirmed" or/and "delivered" field is required'),
+        ({"order": 1, "delivered": False}, "Your cannot revoke your confirmation or delivery"),
+    ],
+)
+@pytest.mark.django_db
+def test_bulk_order_positions_invalid_request(client, full_base, data, error):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    response = client.post("/api/v1/order_positions/bulk/", data=data, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"non_field_errors": [error]}
+
+
+@pytest.mark.django_db
+def test_bulk_order_positions_others_positions(client, full_base):
+    own = OrderPosition.objects.filter(stock__supplier__user__username="vegsupplier").first()
+    other = OrderPosition.objects.exclude(stock__supplier__user__username="vegsupplier").first()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    data = {"positions": [own.id, other.id], "confirmed": True}
+    response = client.post("/api/v1/order_positions/bulk/", data=data, format="json")
+    assert response.status_code == 403
+    assert OrderPosition.objects.get(id=own.id).confirmed == own.confirmed
+    data = {"positions": [own.id, 999999], "confirmed": True}
+    response = client.post("/api/v1/order_positions/bulk/", data=data, format="json")
+    assert response.status_code == 404
+    assert response.json() == {"error": "Order positions [999999] are not found"}
+
+
+@pytest.mark.django_db
+def test_bulk_order_positions_cancelled_order(client, full_base):
+    position = OrderPosition.objects.filter(stock__supplier__user__username="vegsupplier").first()
+    Order.objects.filter(id=position.order_id).update(status="cancelled")
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    data = {"order": position.order_id, "confirmed": True}
+    response = client.post("/api/v1/order_positions/bulk/", data=data, format="json")
+    assert response.status_code == 400
+    assert response.json() == {"error": "You cannot confirm and deliver cancelled order positions"}
+
+
+@pytest.mark.django_db
+def test_bulk_order_positions_success(client, full_base, eager_celery, django_assert_max_num_queries):
+    positions = OrderPosition.objects.filter(
+        stock__supplier__user__username="vegsupplier", order__status="saved", delivered=False
+    )
+    ids = sorted(positions.values_list("id", flat=True))
+    orders = set(positions.values_list("order_id", flat=True))
+    others = dict(
+        OrderPosition.objects.exclude(id__in=ids).values_list("id", "delivered")
+    )
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    Notification.objects.all().delete()
+    mail.outbox.clear()
+    with django_assert_max_num_queries(8):
+        response = client.post(
+            "/api/v1/order_positions/bulk/", data={"positions": ids, "confirmed": True, "delivered": True},
+            format="json",
+        )
+    assert response.status_code == 200
+    assert response.json() == {"success": f"{len(ids)} order positions successfully amended", "positions": ids}
+    assert OrderPosition.objects.filter(id__in=ids, confirmed=True, delivered=True).count() == len(ids)
+    assert dict(OrderPosition.objects.exclude(id__in=ids).values_list("id", "delivered")) == others
+    assert Notification.objects.filter(sent_at__isnull=True).count() == len(orders)
+    assert not list(Order.objects.stale_summaries())
+
+    order_id = orders.pop()
+    response = client.post(
+        "/api/v1/order_positions/bulk/", data={"order": order_id, "delivered": True}, format="json"
+    )
+    assert response.status_code == 200
+    assert response.json()["positions"] == []
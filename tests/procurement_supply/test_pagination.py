@@ -0,0 +1,81 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from procurement_supply.models import Order, OrderPosition, Stock
+from procurement_supply.pagination import KeysetPagination, PageSizePagination
+
+
+def walk(client, url, **params):
+    ids = []
+    response = client.get(url, data=params, format="json")
+    while True:
+        assert response.status_code == 200
+        reply = response.json()
+        assert "count" not in reply
+        ids.extend(item["id"] for item in reply["results"])
+        if not reply["next"]:
+            return ids, reply
+        response = client.get(reply["next"], format="json")
+
+
+@pytest.mark.django_db
+def test_list_stock_page_size(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    response = client.get("/api/v1/stocks/", data={"page_size": 4, "page": 2}, format="json")
+    assert response.status_code == 200
+    reply = response.json()
+    assert reply["count"] == 18
+    assert len(reply["results"]) == 4
+    assert "page_size=4" in reply["next"]
+
+
+@pytest.mark.django_db
+def test_list_page_size_is_capped(client, half_base, monkeypatch):
+    monkeypatch.setattr(PageSizePagination, "max_page_size", 5)
+    monkeypatch.setattr(KeysetPagination, "max_page_size", 5)
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    response = client.get("/api/v1/categories/", data={"page_size": 1000}, format="json")
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 5
+    response = client.get("/api/v1/stocks/", data={"page_size": 1000, "pagination": "cursor"}, format="json")
+    assert response.status_code == 200
+    assert len(response.json()["results"]) == 5
+
+
+@pytest.mark.django_db
+def test_list_stock_cursor_pagination(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    ids, last_page = walk(client, "/api/v1/stocks/", pagination="cursor", page_size=4)
+    assert ids == list(Stock.objects.order_by("product_id", "price", "id").values_list("id", flat=True))
+    response = client.get(last_page["previous"], format="json")
+    assert response.status_code == 200
+    assert [stock["id"] for stock in response.json()["results"]] == ids[-len(last_page["results"]) - 4:
+                                                                         -len(last_page["results"])]
+
+
+@pytest.mark.django_db
+def test_list_order_cursor_pagination(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    ids, last_page = walk(client, "/api/v1/orders/", pagination="cursor", page_size=3, ordering="total_amount")
+    assert ids == list(Order.objects.order_by("-date", "purchaser_id", "id").values_list("id", flat=True))
+
+
+@pytest.mark.django_db
+def test_list_order_position_cursor_pagination(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["vegsupplier"]}')
+    ids, last_page = walk(client, "/api/v1/order_positions/", pagination="cursor", page_size=2)
+    assert ids == list(
+        OrderPosition.objects.filter(stock__supplier__user__username="vegsupplier")
+        .order_by("order_id", "price", "id").values_list("id", flat=True)
+    )
+
+
+@pytest.mark.django_db
+def test_list_stock_cursor_pagination_does_not_count(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    response = client.get("/api/v1/stocks/", data={"pagination": "cursor", "page_size": 4}, format="json")
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(response.json()["next"], format="json")
+    assert response.status_code == 200
+    assert not [query for query in context.captured_queries if "COUNT(" in query["sql"]]
@@ -0,0 +1,147 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from procurement_supply.importer import StockImporter
+from procurement_supply.models import (Category, Characteristic,
+                                       ProductCharacteristic, Stock, Supplier)
+from procurement_supply.search import search_stocks, search_terms
+
+
+def search(client, token, text):
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+    response = client.get("/api/v1/stocks/", {"search": text, "page_size": 100})
+    assert response.status_code == 200
+    return response.json()["results"]
+
+
+def test_search_terms():
+    assert search_terms("Сок  ЯБЛОЧНЫЙ, 1л") == ["сок", "яблочный", "1л"]
+    assert search_terms(None) == []
+
+
+@pytest.mark.django_db
+def test_search_document_built_on_create(half_base):
+    stock = Stock.objects.filter(product__name="Помидор").first()
+    assert stock.search_document == stock.build_search_document()
+    assert stock.search_document.startswith("помидор")
+    assert "овощи" in stock.search_document
+    assert "выборг" in stock.search_document
+
+
+@pytest.mark.django_db
+def test_search_matches_all_words(client, half_base):
+    results = search(client, half_base["minimarket"], "сок ЯБЛОЧНЫЙ")
+    assert results
+    assert {result["product"] for result in results} == {
+        Stock.objects.filter(product__name="Сок яблочный").first().product_id
+    }
+    assert search(client, half_base["minimarket"], "яблочный помидор") == []
+
+
+@pytest.mark.django_db
+def test_search_ranks_important_fields_first(client, half_base):
+    juice = Stock.objects.filter(product__name="Сок томатный").first()
+    tomato = Stock.objects.filter(product__name="Помидор", supplier__order_status=True, quantity__gt=0).first()
+    tomato.description = "Подходит для сока, томатный вкус"
+    tomato.save()
+
+    results = search(client, half_base["minimarket"], "томатный")
+    ids = [result["id"] for result in results]
+    assert juice.id in ids and tomato.id in ids
+    assert ids.index(juice.id) < ids.index(tomato.id)
+
+
+@pytest.mark.django_db
+def test_search_does_not_join_related_tables(half_base):
+    with CaptureQueriesContext(connection) as context:
+        list(search_stocks(Stock.objects.all(), "санкт петербург"))
+    sql = context.captured_queries[0]["sql"].upper()
+    assert "JOIN" not in sql
+    assert "DISTINCT" not in sql
+
+
+@pytest.mark.django_db
+def test_search_document_updated_on_stock_edit(client, half_base):
+    tomato = Stock.objects.filter(product__name="Помидор", supplier__user__username="vegsupplier").first()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["vegsupplier"]}')
+    response = client.patch(f"/api/v1/stocks/{tomato.id}/", data={"model": "Черри"}, format="json")
+    assert response.status_code == 200
+    assert [result["id"] for result in search(client, half_base["vegsupplier"], "черри")] == [tomato.id]
+
+
+@pytest.mark.django_db
+def test_search_document_updated_on_characteristic_change(half_base):
+    tomato = Stock.objects.filter(product__name="Помидор").first()
+    characteristic = Characteristic.objects.create(name="Сорт")
+    product_characteristic = ProductCharacteristic.objects.create(
+        stock=tomato, characteristic=characteristic, value="Бычье сердце"
+    )
+    assert "бычье сердце" in Stock.objects.get(id=tomato.id).search_document
+
+    product_characteristic.delete()
+    assert "бычье" not in Stock.objects.get(id=tomato.id).search_document
+
+
+@pytest.mark.django_db
+def test_search_document_updated_on_supplier_and_category_rename(
+    client, half_base, eager_celery, django_capture_on_commit_callbacks
+):
+    supplier = Supplier.objects.get(name="Выборжец")
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        supplier.address = "Приозерск"
+        supplier.save()
+        supplier.save(update_fields=["order_status"])
+    assert len(callbacks) == 1
+    assert not Stock.objects.filter(supplier=supplier).exclude(search_document__contains="приозерск").exists()
+
+    category = Category.objects.get(name="Крупа")
+    with django_capture_on_commit_callbacks(execute=True):
+        category.name = "Злаки"
+        category.save()
+    stocks = Stock.objects.filter(product__category=category)
+    assert stocks.exists()
+    assert not stocks.exclude(search_document__contains="злаки").exists()
+
+
+@pytest.mark.django_db
+def test_search_document_updated_on_import(half_base):
+    user = Token.objects.get(key=half_base["breadsupplier"]).user
+    goods = [
+        {
+            "id": 1,
+            "category": 101,
+            "model": "Нарезной",
+            "name": "Батон",
+            "price": 50,
+            "price_rrc": 60,
+            "quantity": 10,
+            "parameters": {"Мука": "пшеничная"},
+        }
+    ]
+    data = {"shop": "Каравай", "categories": [{"id": 101, "name": "Хлеб"}], "goods": goods}
+    assert StockImporter(user.id).run(data)["status"] == "success"
+    stock = Stock.objects.get(sku="1", supplier__name="Каравай")
+    assert stock.search_document == "батон нарезной хлеб каравай пшеничная"
+
+    goods[0]["model"] = "Подмосковный"
+    goods[0]["parameters"] = {"Мука": "ржаная"}
+    assert StockImporter(user.id).run(data)["status"] == "success"
+    stock.refresh_from_db()
+    assert stock.search_document == "батон подмосковный хлеб каравай ржаная"
+
+
+@pytest.mark.django_db
+def test_search_source_save_does_not_read_instance_again(
+    half_base, django_assert_num_queries, django_capture_on_commit_callbacks
+):
+    supplier = Supplier.objects.get(name="Выборжец")
+    with django_capture_on_commit_callbacks() as callbacks, django_assert_num_queries(1):
+        supplier.order_status = False
+        supplier.save()
+    assert not callbacks
+    with django_capture_on_commit_callbacks() as callbacks, django_assert_num_queries(1):
+        supplier.name = "Выборжец и партнеры"
+        supplier.save()
+    assert len(callbacks) == 1
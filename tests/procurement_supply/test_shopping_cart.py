@@ -1,4 +1,6 @@
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from procurement_supply.models import (CartPosition, ShoppingCart, Stock)
 
@@ -60,6 +62,20 @@ def test_list_cart_supplier_with_order_token(client, full_base):
     assert reply["count"] == 2
 
 
+@pytest.mark.django_db
+def test_list_cart_totals_annotations(client, full_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["admin"]}')
+    with CaptureQueriesContext(connection) as context:
+        response = client.get("/api/v1/shopping_carts/", format="json")
+    assert response.status_code == 200
+    replies = response.json()["results"]
+    assert len(context) <= 5
+    for reply in replies:
+        cart = ShoppingCart.objects.get(id=reply["id"])
+        assert reply["total_quantity"] == cart.total_quantity
+        assert reply["total_amount"] == cart.total_amount
+
+
 @pytest.mark.django_db
 def test_retrieve_cart_no_token(client, full_base):
     cart = ShoppingCart.objects.filter(purchaser__name="5ка").first()
@@ -191,7 +207,7 @@ def test_destroy_cart_empty_purchaser_token(client, full_base):
     response = client.delete(f"/api/v1/shopping_carts/{cart.id}/", format="json")
     assert response.status_code == 200
     reply = response.json()
-    assert reply == {"success": f"Your shopping cart is empty"}
+    assert reply == {"success": f"Your shopping cart is empty", "restored": []}
 
 
 @pytest.mark.django_db
@@ -201,11 +217,17 @@ def test_destroy_cart_full_purchaser_token(client, full_base):
     count_cucumber = Stock.objects.filter(product__name="Огурец").first().quantity
     count_pepper = Stock.objects.filter(product__name="Перец").first().quantity
     count_positions = CartPosition.objects.count()
+    restored = [
+        {"stock": stock_id, "quantity": quantity}
+        for stock_id, quantity in cart.cart_positions.order_by("stock_id").values_list("stock_id", "quantity")
+    ]
     client.credentials(HTTP_AUTHORIZATION=f'Token {full_base["hypermarket"]}')
-    response = client.delete(f"/api/v1/shopping_carts/{cart.id}/", format="json")
+    with CaptureQueriesContext(connection) as context:
+        response = client.delete(f"/api/v1/shopping_carts/{cart.id}/", format="json")
     assert response.status_code == 200
     reply = response.json()
-    assert reply == {"success": f"Your shopping cart is empty"}
+    assert reply == {"success": f"Your shopping cart is empty", "restored": restored}
+    assert len([query for query in context.captured_queries if query["sql"].startswith("UPDATE")]) == 1
     assert CartPosition.objects.filter(shopping_cart=cart.id).count() == 0
     assert CartPosition.objects.count() == count_positions - 3
     assert (
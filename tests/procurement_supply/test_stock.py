@@ -1,7 +1,11 @@
+from decimal import Decimal
+
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from procurement_supply.models import (Product, ProductCharacteristic, Stock,
-                                       Supplier)
+from procurement_supply.models import (Characteristic, Product,
+                                       ProductCharacteristic, Stock, Supplier)
 
 
 @pytest.mark.django_db
@@ -88,7 +92,7 @@ def test_create_stock_supplier_token(client, half_base):
     assert reply["product"] == product.id
     assert reply["supplier"] == Supplier.objects.filter(name="Выборжец").first().id
     assert reply["quantity"] == data["quantity"]
-    assert reply["product_characteristics"] == []
+    assert reply["product_characteristics"] == {}
 
 
 @pytest.mark.django_db
@@ -294,6 +298,52 @@ def test_list_stock_purchaser_token(client, half_base):
     assert reply["count"] == 14
 
 
+@pytest.mark.django_db
+def test_list_stock_ordered_by_product_id_and_price(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    response = client.get("/api/v1/stocks/", {"page_size": 100})
+    assert response.status_code == 200
+    keys = [(stock["product"], Decimal(stock["price"])) for stock in response.json()["results"]]
+    assert len(keys) == 18
+    assert keys == sorted(keys)
+
+@pytest.mark.django_db
+def test_list_stock_characteristics_map(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    response = client.get("/api/v1/stocks/", data={"page": 1}, format="json")
+    assert response.status_code == 200
+    for stock in response.json()["results"]:
+        assert stock["product_characteristics"] == dict(
+            ProductCharacteristic.objects.filter(stock_id=stock["id"]).values_list("characteristic__name", "value")
+        )
+
+
+@pytest.mark.django_db
+def test_list_stock_queries_do_not_depend_on_characteristics(client, half_base):
+    client.credentials(HTTP_AUTHORIZATION=f'Token {half_base["admin"]}')
+    ProductCharacteristic.objects.all().delete()
+    with CaptureQueriesContext(connection) as no_characteristics:
+        response = client.get("/api/v1/stocks/", format="json")
+    assert response.status_code == 200
+
+    characteristics = Characteristic.objects.bulk_create(
+        [Characteristic(name=f"Характеристика {number}") for number in range(5)]
+    )
+    ProductCharacteristic.objects.bulk_create(
+        [
+            ProductCharacteristic(stock=stock, characteristic=characteristic, value=f"{stock.id}-{characteristic.id}")
+            for stock in Stock.objects.all() for characteristic in characteristics
+        ]
+    )
+    with CaptureQueriesContext(connection) as many_characteristics:
+        response = client.get("/api/v1/stocks/", format="json")
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert all(len(stock["product_characteristics"]) == 5 for stock in results)
+    assert results[0]["product_characteristics"]["Характеристика 0"] == f"{results[0]['id']}-{characteristics[0].id}"
+    assert len(many_characteristics) == len(no_characteristics)
+
+
 @pytest.mark.django_db
 def test_retrieve_stock_no_token(client, half_base):
     tomato = Stock.objects.filter(product__name="Помидор").first()